@@ -2,12 +2,21 @@
 # -*- coding: utf-8 -*-
 """
 Giao diện Streamlit cho Chatbot hỏi-đáp
-Hỗ trợ 2 loại: TF-IDF (chatbot.py) và Semantic Search (chatbot_pro.py)
+Hỗ trợ 3 loại: TF-IDF (chatbot.py), Semantic Search (chatbot_pro.py)
+và Hybrid (chatbot_hybrid.py)
+
+Module của mỗi engine chỉ được import khi engine đó được chọn (xem engines.py),
+nên chế độ TF-IDF không phải tải torch/sentence-transformers. Các engine được
+giữ trong EngineRegistry của tiến trình, dùng chung giữa mọi phiên.
+
+Câu trả lời của Semantic Search/Hybrid được hiển thị dần (answer_stream); mỗi phiên
+có một ConversationContext để câu nói rõ ý sau "Có phải ý bạn là..." được hiểu
+theo câu hỏi trước.
 """
 
 import streamlit as st
-from chatbot import Chatbot
-from chatbot_pro import ChatbotPro
+from engines import get_registry
+from query_cache import ConversationContext
 
 # Cấu hình trang
 st.set_page_config(
@@ -16,24 +25,21 @@ st.set_page_config(
     layout="centered"
 )
 
-# Khởi tạo chatbot TF-IDF trong session state
-@st.cache_resource
-def load_chatbot_tfidf():
-    """Load và train chatbot TF-IDF (chỉ chạy một lần)"""
-    chatbot = Chatbot(csv_file='data_converted.csv', similarity_threshold=0.1)
-    if chatbot.load_data():
-        chatbot.train()
-        return chatbot
-    return None
-
-# Khởi tạo chatbot Semantic Search trong session state
-@st.cache_resource
-def load_chatbot_pro():
-    """Load và khởi tạo chatbot Semantic Search (chỉ chạy một lần)"""
-    chatbot_pro = ChatbotPro(csv_file='data_converted.csv')
-    if chatbot_pro.initialize():
-        return chatbot_pro
-    return None
+# Tham số của từng engine; cùng tham số thì mọi phiên dùng chung một engine
+ENGINE_OPTIONS = {
+    'tfidf': {'similarity_threshold': 0.1},
+    'semantic': {'cache_dir': '.embedding_cache'},
+    'hybrid': {'cache_dir': '.embedding_cache'},
+}
+
+def load_engine(name):
+    """
+    Lấy engine từ registry dùng chung của tiến trình
+    
+    Engine được tạo ở lần dùng đầu tiên và bị giải phóng khi lâu không dùng; các
+    engine dùng chung một bản dữ liệu CSV, semantic và hybrid dùng chung mô hình.
+    """
+    return get_registry().get(name, csv_file='data_converted.csv', **ENGINE_OPTIONS[name])
 
 # Sidebar để chọn loại chatbot
 with st.sidebar:
@@ -42,8 +48,9 @@ with st.sidebar:
     # Lựa chọn loại chatbot
     chatbot_type = st.radio(
         "Chọn loại Chatbot:",
-        ["TF-IDF (Nhanh)", "Semantic Search (Chính xác)"],
-        help="TF-IDF: Nhanh, dựa trên từ khóa\nSemantic Search: Chính xác hơn, hiểu ngữ nghĩa"
+        ["TF-IDF (Nhanh)", "Semantic Search (Chính xác)", "Hybrid (Cân bằng)"],
+        help="TF-IDF: Nhanh, dựa trên từ khóa\nSemantic Search: Chính xác hơn, hiểu ngữ nghĩa\n"
+             "Hybrid: TF-IDF lọc ứng viên, Semantic Search xếp hạng lại"
     )
     
     st.markdown("---")
@@ -51,12 +58,21 @@ with st.sidebar:
     
     if chatbot_type == "TF-IDF (Nhanh)":
         st.info("**TF-IDF + Cosine Similarity**\n\n- Nhanh, hiệu quả\n- Dựa trên từ khóa\n- Phù hợp cho FAQ đơn giản")
-    else:
+    elif chatbot_type == "Semantic Search (Chính xác)":
         st.info("**Semantic Search**\n\n- Hiểu ngữ nghĩa\n- Chính xác hơn\n- Hỗ trợ đa ngôn ngữ")
+    else:
+        st.info("**Hybrid**\n\n- TF-IDF lọc ứng viên\n- Semantic Search xếp hạng lại\n- Chi phí tỉ lệ với số ứng viên")
+
+def show_startup_report(engine):
+    """Hiển thị thời gian khởi động của engine trong sidebar"""
+    with st.sidebar.expander("⏱️ Thời gian khởi động"):
+        for phase, seconds in engine.startup.phases.items():
+            st.markdown(f"- {phase}: {seconds:.2f}s")
+        st.markdown(f"**Tổng:** {engine.startup.total():.2f}s")
 
 # Load chatbot dựa trên lựa chọn
 if chatbot_type == "TF-IDF (Nhanh)":
-    chatbot = load_chatbot_tfidf()
+    chatbot = load_engine('tfidf')
     chatbot_pro = None
     
     if chatbot is None:
@@ -64,16 +80,22 @@ if chatbot_type == "TF-IDF (Nhanh)":
         st.stop()
     
     st.sidebar.markdown(f"**Số lượng câu hỏi:** {len(chatbot.questions)}")
+    show_startup_report(chatbot)
 else:
-    chatbot_pro = load_chatbot_pro()
+    if chatbot_type == "Semantic Search (Chính xác)":
+        chatbot_pro = load_engine('semantic')
+    else:
+        # ChatbotHybrid có cùng answer() và các mức độ tin cậy như ChatbotPro
+        chatbot_pro = load_engine('hybrid')
     chatbot = None
     
     if chatbot_pro is None:
-        st.error("❌ Không thể tải chatbot Semantic Search. Vui lòng kiểm tra file data_converted.csv")
+        st.error(f"❌ Không thể tải chatbot {chatbot_type}. Vui lòng kiểm tra file data_converted.csv")
         st.stop()
     
     st.sidebar.markdown(f"**Số lượng câu hỏi:** {len(chatbot_pro.questions)}")
     st.sidebar.markdown(f"**Mô hình:** paraphrase-multilingual-MiniLM-L12-v2")
+    show_startup_report(chatbot_pro)
 
 # Tiêu đề
 st.title("💬 Chatbot Hỏi-Đáp")
@@ -81,19 +103,26 @@ st.title("💬 Chatbot Hỏi-Đáp")
 # Hiển thị loại chatbot đang dùng
 if chatbot_type == "TF-IDF (Nhanh)":
     st.caption("🔍 Đang sử dụng: **TF-IDF + Cosine Similarity**")
-else:
+elif chatbot_type == "Semantic Search (Chính xác)":
     st.caption("🧠 Đang sử dụng: **Semantic Search (sentence-transformers)**")
+else:
+    st.caption("⚖️ Đang sử dụng: **Hybrid (TF-IDF + Semantic Search)**")
 
 # Khởi tạo lịch sử chat trong session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Ngữ cảnh hội thoại của phiên (embedding các lượt hỏi gần nhất)
+if "context" not in st.session_state:
+    st.session_state.context = ConversationContext()
+
 # Reset lịch sử khi đổi loại chatbot
 if "last_chatbot_type" not in st.session_state:
     st.session_state.last_chatbot_type = chatbot_type
 
 if st.session_state.last_chatbot_type != chatbot_type:
     st.session_state.messages = []
+    st.session_state.context.clear()
     st.session_state.last_chatbot_type = chatbot_type
     st.rerun()
 
@@ -115,15 +144,15 @@ if user_question:
     
     # Lấy và hiển thị câu trả lời
     with st.chat_message("assistant"):
-        with st.spinner("Đang suy nghĩ..."):
-            if chatbot_type == "TF-IDF (Nhanh)":
+        if chatbot_type == "TF-IDF (Nhanh)":
+            with st.spinner("Đang suy nghĩ..."):
                 # Sử dụng chatbot TF-IDF
                 answer = chatbot.answer(user_question)
                 st.write(answer)
-            else:
-                # Sử dụng chatbot Semantic Search
-                answer, score, matched = chatbot_pro.answer(user_question)
-                st.markdown(answer)
+        else:
+            # Sử dụng chatbot Semantic Search (hoặc Hybrid): hiển thị câu trả lời trước,
+            # mức độ tin cậy sau
+            answer = st.write_stream(chatbot_pro.answer_stream(user_question, st.session_state.context))
     
     # Thêm câu trả lời vào lịch sử
     st.session_state.messages.append({"role": "assistant", "content": answer})
@@ -132,4 +161,5 @@ if user_question:
 if st.session_state.messages:
     if st.button("🗑️ Xóa lịch sử", use_container_width=True):
         st.session_state.messages = []
+        st.session_state.context.clear()
         st.rerun()
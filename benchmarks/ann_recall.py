@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Báo cáo recall của chỉ mục vector xấp xỉ (ivf/cluster/hnsw) so với tìm kiếm chính xác
+
+Với mỗi giá trị của núm điều chỉnh (n_probe cho ivf/cluster, ef_search cho hnsw), in ra
+recall@1, recall@k, tỉ lệ query có cùng mức độ tin cậy (ngưỡng 0.75 / 0.45) với
+tìm kiếm chính xác, và độ trễ trung bình mỗi query. Với ivf/cluster còn kiểm tra
+query gần một cụm đã bị xóa hết thành viên vẫn có kết quả (mã lỗi 1 nếu không).
+
+Chạy trên dữ liệu thật (cần tải mô hình sentence-transformers):
+    python3 benchmarks/ann_recall.py --csv data_converted.csv --backend ivf --sweep 1 2 4 8 16
+    python3 benchmarks/ann_recall.py --backend cluster --threshold 0.85 --approx
+
+Chạy trên corpus vector ngẫu nhiên (không cần mô hình, dùng để đo độ trễ):
+    python3 benchmarks/ann_recall.py --random 1000000 --dim 384 --backend ivf
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vector_index  # noqa: E402
+
+
+def perturb(question, rng):
+    """Tạo câu hỏi biến thể: bỏ ngẫu nhiên một từ và đảo chỗ hai từ"""
+    words = question.split()
+    if len(words) > 2:
+        words.pop(rng.randrange(len(words)))
+    if len(words) > 1:
+        i, j = rng.sample(range(len(words)), 2)
+        words[i], words[j] = words[j], words[i]
+    return ' '.join(words)
+
+
+def load_vectors(args):
+    """Trả về (corpus vectors, query vectors)"""
+    if args.random:
+        rng = np.random.default_rng(0)
+        corpus = rng.standard_normal((args.random, args.dim), dtype=np.float32)
+        picked = corpus[rng.choice(args.random, size=args.n_queries)]
+        queries = picked + 0.5 * rng.standard_normal(picked.shape, dtype=np.float32)
+        return corpus, queries
+
+    from chatbot_pro import ChatbotPro
+
+    chatbot_pro = ChatbotPro(csv_file=args.csv, model_name=args.model, cache_dir=args.cache_dir)
+    if not chatbot_pro.initialize():
+        print(f"✗ Không khởi tạo được ChatbotPro từ {args.csv}")
+        sys.exit(1)
+
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as file:
+            query_texts = [line.strip() for line in file if line.strip()]
+    else:
+        rng = random.Random(0)
+        query_texts = [perturb(rng.choice(chatbot_pro.questions), rng) for _ in range(args.n_queries)]
+
+    queries = chatbot_pro.model.encode(query_texts, convert_to_numpy=True, show_progress_bar=False)
+    return chatbot_pro.corpus_embeddings.numpy(), queries
+
+
+def check_removed_list(backend, corpus, n_rows=10000, **params):
+    """
+    Xóa mọi thành viên của cụm lớn nhất rồi tìm kiếm tại tâm cụm đó với n_probe=1:
+    chỉ mục phải bỏ qua cụm rỗng và vẫn trả về kết quả
+
+    Returns:
+        True nếu query có kết quả
+    """
+    corpus = np.asarray(corpus[:n_rows], dtype=np.float32)
+    index = vector_index.create_index(backend, **params)
+    index.build(corpus)
+    index.n_probe = 1
+    target = int(np.argmax(np.diff(index.list_ptr)))
+    members = np.sort(index.list_ids[index.list_ptr[target]:index.list_ptr[target + 1]])
+    if len(members) == len(corpus):
+        return True
+    index.remove(np.delete(corpus, members, axis=0), members)
+    return bool(index.search(index.centroids[target:target + 1], 1)[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall của chỉ mục vector xấp xỉ so với exact")
+    parser.add_argument('--csv', default='data_converted.csv')
+    parser.add_argument('--model', default='paraphrase-multilingual-MiniLM-L12-v2')
+    parser.add_argument('--cache-dir', default='.embedding_cache')
+    parser.add_argument('--queries', help="File câu hỏi (mỗi dòng một câu); mặc định: biến thể của câu hỏi mẫu")
+    parser.add_argument('--n-queries', type=int, default=500)
+    parser.add_argument('--random', type=int, default=0, help="Dùng corpus ngẫu nhiên N vector thay vì CSV")
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--backend', choices=['ivf', 'cluster', 'hnsw'], default='ivf')
+    parser.add_argument('--n-lists', type=int, default=None, help="Số cụm cho ivf")
+    parser.add_argument('--threshold', type=float, default=0.85, help="Ngưỡng cosine gom cụm cho cluster")
+    parser.add_argument('--approx', action='store_true',
+                        help="cluster: chỉ mở n_probe cụm (mặc định mở thêm các cụm còn có thể vào top-k)")
+    parser.add_argument('--sweep', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help="Các giá trị n_probe (ivf/cluster) hoặc ef_search (hnsw)")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--high-threshold', type=float, default=0.75)
+    parser.add_argument('--low-threshold', type=float, default=0.45)
+    parser.add_argument('--output', help="Ghi báo cáo JSON ra file")
+    args = parser.parse_args()
+
+    corpus, queries = load_vectors(args)
+    exact = vector_index.create_index('exact')
+    exact.build(corpus)
+
+    reports = []
+    print(f"Corpus: {len(corpus)} vector, {len(queries)} query, backend: {args.backend}\n")
+    print(f"{'knob':>6} {'recall@1':>9} {f'recall@{args.k}':>10} {'tier agree':>11} "
+          f"{'exact ms':>9} {'approx ms':>10}")
+    print("-" * 60)
+
+    approx = None
+    for value in args.sweep:
+        if args.backend == 'ivf':
+            if approx is None:
+                approx = vector_index.create_index('ivf', n_lists=args.n_lists)
+                approx.build(corpus)
+            approx.n_probe = value
+        elif args.backend == 'cluster':
+            if approx is None:
+                approx = vector_index.create_index('cluster', threshold=args.threshold, exact=not args.approx)
+                approx.build(corpus)
+            approx.n_probe = value
+        else:
+            if approx is None:
+                approx = vector_index.create_index('hnsw')
+                approx.build(corpus)
+            approx.ef_search = value
+
+        report = vector_index.recall_report(approx, exact, queries, k=args.k,
+                                            thresholds=(args.high_threshold, args.low_threshold))
+        reports.append(report)
+        print(f"{value:>6} {report['recall@1']:>9.3f} {report[f'recall@{args.k}']:>10.3f} "
+              f"{report['tier_agreement']:>11.3f} {report['exact_ms_per_query']:>9.3f} "
+              f"{report['approx_ms_per_query']:>10.3f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(reports, file, ensure_ascii=False, indent=2)
+        print(f"\n✓ Đã ghi báo cáo vào {args.output}")
+
+    if args.backend in ('ivf', 'cluster'):
+        params = {'n_lists': args.n_lists} if args.backend == 'ivf' else \
+            {'threshold': args.threshold, 'exact': not args.approx}
+        if not check_removed_list(args.backend, corpus, **params):
+            print("\n✗ Query gần cụm đã bị xóa hết thành viên không có kết quả")
+            sys.exit(1)
+        print("\n✓ Query gần cụm đã bị xóa hết thành viên vẫn có kết quả")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Thời gian encode corpus: một lần model.encode() so với encode_pipeline.CorpusEncoder
+
+Corpus tổng hợp (các câu hỏi của file CSV được diễn đạt lại như ann_recall.py)
+được encode bằng một lần gọi model.encode() với batch mặc định, rồi bằng
+CorpusEncoder (sắp xếp theo độ dài, lô theo độ dài, nhiều worker). In ra thời
+gian, số câu/giây và độ lệch cosine lớn nhất so với cách encode ban đầu.
+
+Chạy:
+    python3 benchmarks/bench_encode.py --n 50000 --workers 1 2 4 --batch-size auto
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_recall import perturb  # noqa: E402
+from encode_pipeline import CorpusEncoder, load_encoder  # noqa: E402
+
+
+def unit(embeddings):
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thời gian encode corpus theo số worker")
+    parser.add_argument('--csv', default='data_converted.csv')
+    parser.add_argument('--model', default='paraphrase-multilingual-MiniLM-L12-v2')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch')
+    parser.add_argument('--n', type=int, default=20000, help="Số câu hỏi của corpus tổng hợp")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--batch-size', default='32', help="Số câu mỗi lô của CorpusEncoder hoặc 'auto'")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.csv, 'r', encoding='utf-8') as file:
+        questions = [row['question'].strip() for row in csv.DictReader(file) if row['question'].strip()]
+    rng = random.Random(args.seed)
+    texts = [perturb(rng.choice(questions), rng) for _ in range(args.n)]
+    batch_size = args.batch_size if args.batch_size == 'auto' else int(args.batch_size)
+
+    model = load_encoder(args.model, args.backend, device='cpu' if args.backend == 'torch' else None)
+    start = time.perf_counter()
+    baseline = unit(np.asarray(model.encode(texts, convert_to_numpy=True, show_progress_bar=False)))
+    baseline_seconds = time.perf_counter() - start
+
+    print(f"Corpus: {args.n} câu, mô hình {args.model} ({args.backend}), CPU: {os.cpu_count()}\n")
+    print(f"{'cách encode':>18} {'giây':>8} {'câu/giây':>10} {'tăng tốc':>9} {'lệch cos':>10}")
+    print("-" * 60)
+    print(f"{'model.encode()':>18} {baseline_seconds:>8.1f} {args.n / baseline_seconds:>10.1f} {1.0:>9.2f} {'-':>10}")
+
+    for n_workers in args.workers:
+        encoder = CorpusEncoder(model, args.model, batch_size=batch_size, workers=n_workers,
+                                worker_model=(args.model, args.backend, None))
+        start = time.perf_counter()
+        embeddings = unit(encoder.encode(texts))
+        seconds = time.perf_counter() - start
+        deviation = float((1.0 - np.sum(baseline * embeddings, axis=1)).max())
+        label = f"{n_workers} worker (lô {encoder.batch_size})"
+        print(f"{label:>18} {seconds:>8.1f} {args.n / seconds:>10.1f} {baseline_seconds / seconds:>9.2f} "
+              f"{deviation:>10.1e}")
+
+
+if __name__ == "__main__":
+    main()
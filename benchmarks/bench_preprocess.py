@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark và kiểm tra tương đương cho preprocess_vietnamese
+
+Kiểm tra trên toàn bộ câu hỏi + câu trả lời của file CSV rằng:
+    - preprocess_vietnamese cho kết quả giống bản gốc (NFD + lọc 'Mn' + regex),
+      ngoại trừ đ/Đ giờ được chuyển thành d
+    - preprocess_vietnamese_batch giống preprocess_vietnamese từng phần tử
+sau đó đo thời gian của từng cách.
+
+Chạy:
+    python3 benchmarks/bench_preprocess.py --csv data_converted.csv
+"""
+
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot import preprocess_query, preprocess_vietnamese, preprocess_vietnamese_batch  # noqa: E402
+
+
+def preprocess_reference(text):
+    """Bản gốc của preprocess_vietnamese (trước khi dùng bảng chuyển đổi)"""
+    if not isinstance(text, str):
+        return text
+    text = text.lower()
+    nfd_text = unicodedata.normalize('NFD', text)
+    text = ''.join(char for char in nfd_text if unicodedata.category(char) != 'Mn')
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text
+
+
+def load_texts(csv_file):
+    """Toàn bộ câu hỏi và câu trả lời trong file CSV"""
+    texts = []
+    with open(csv_file, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            texts.append(row['question'])
+            texts.append(row['answer'])
+    return texts
+
+
+def measure(fn, repeat):
+    """Thời gian trung bình (ms) của fn()"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tiền xử lý tiếng Việt")
+    parser.add_argument('--csv', default='data_converted.csv')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    texts = load_texts(args.csv)
+    # Thêm các trường hợp biên: dấu rời (NFD), chữ không phải Latin, khoảng trắng lạ
+    texts += [unicodedata.normalize('NFD', text) for text in texts[:50]]
+    texts += ["Đà Nẵng và  ĐÀ LẠT\t", "Ελληνικά ΟΔΟΣ", "日本語 テスト", "İstanbul", "ﬁnal   café\n"]
+
+    mismatches = 0
+    batch = preprocess_vietnamese_batch(texts)
+    for text, batch_result in zip(texts, batch):
+        expected = preprocess_reference(text).replace('đ', 'd')
+        result = preprocess_vietnamese(text)
+        if result != expected or batch_result != result:
+            mismatches += 1
+            print(f"✗ Khác kết quả: {text!r}\n    gốc:   {expected!r}\n    mới:   {result!r}\n    batch: {batch_result!r}")
+
+    print(f"Kiểm tra tương đương: {len(texts)} văn bản, {mismatches} khác biệt")
+
+    t_reference = measure(lambda: [preprocess_reference(text) for text in texts], args.repeat)
+    t_single = measure(lambda: [preprocess_vietnamese(text) for text in texts], args.repeat)
+    t_batch = measure(lambda: preprocess_vietnamese_batch(texts), args.repeat)
+    preprocess_query.cache_clear()
+    [preprocess_query(text) for text in texts]
+    t_cached = measure(lambda: [preprocess_query(text) for text in texts], args.repeat)
+
+    per_text = 1000 / len(texts)
+    print(f"\n{'cách':<28} {'ms/lô':>10} {'µs/văn bản':>12}")
+    print("-" * 52)
+    for name, elapsed in (("bản gốc (NFD + regex)", t_reference),
+                          ("preprocess_vietnamese", t_single),
+                          ("preprocess_vietnamese_batch", t_batch),
+                          ("preprocess_query (LRU hit)", t_cached)):
+        print(f"{name:<28} {elapsed:>10.3f} {elapsed * per_text:>12.2f}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput của chỉ mục 'sharded' (nhiều tiến trình, bộ nhớ dùng chung) theo số worker
+
+So sánh với ExactIndex chạy trong một tiến trình trên cùng corpus ngẫu nhiên và
+kiểm tra kết quả top-k giống hệt nhau.
+
+Chạy:
+    python3 benchmarks/bench_sharding.py --n 1000000 --dim 384 --workers 1 2 4 8 16 32
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vector_index  # noqa: E402
+
+
+def measure(index, queries, batch_size, k):
+    """Trả về (kết quả, số query mỗi giây)"""
+    results = []
+    start = time.perf_counter()
+    for begin in range(0, len(queries), batch_size):
+        results.extend(index.search(queries[begin:begin + batch_size], k))
+    return results, len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput của chỉ mục sharded theo số worker")
+    parser.add_argument('--n', type=int, default=200000, help="Số vector trong corpus")
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--n-queries', type=int, default=512)
+    parser.add_argument('--batch-size', type=int, default=32, help="Số query mỗi lần search")
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = rng.standard_normal((args.n, args.dim), dtype=np.float32)
+    queries = rng.standard_normal((args.n_queries, args.dim), dtype=np.float32)
+
+    exact = vector_index.create_index('exact')
+    exact.build(corpus)
+    expected, baseline_qps = measure(exact, queries, args.batch_size, args.k)
+    expected_ids = [[idx for idx, _ in row] for row in expected]
+
+    print(f"Corpus: {args.n} x {args.dim}, {args.n_queries} query, lô {args.batch_size}, CPU: {os.cpu_count()}\n")
+    print(f"{'workers':>8} {'khởi động (s)':>14} {'query/s':>10} {'tăng tốc':>9} {'giống exact':>12}")
+    print("-" * 58)
+    print(f"{'exact':>8} {'-':>14} {baseline_qps:>10.1f} {1.0:>9.2f} {'-':>12}")
+
+    for n_workers in args.workers:
+        start = time.perf_counter()
+        index = vector_index.create_index('sharded', n_workers=n_workers)
+        index.build(corpus)
+        # Lần search đầu khởi động các worker và gắn vào bộ nhớ dùng chung
+        index.search(queries[:1], args.k)
+        startup = time.perf_counter() - start
+
+        results, qps = measure(index, queries, args.batch_size, args.k)
+        same = [[idx for idx, _ in row] for row in results] == expected_ids
+        print(f"{n_workers:>8} {startup:>14.2f} {qps:>10.1f} {qps / baseline_qps:>9.2f} {str(same):>12}")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Thời gian xử lý một câu hỏi của Chatbot TF-IDF: sklearn so với tfidf_query.QueryVectorizer
+
+Với mỗi câu hỏi (câu hỏi của corpus được diễn đạt lại như ann_recall.py) đo số
+µs của từng bước theo hai cách:
+    transform   TfidfVectorizer.transform([q])  /  QueryVectorizer.transform_one(q)
+    tìm kiếm    transform + InvertedIndex.search  /  transform_one + search_terms
+    cosine      cosine_similarity với toàn bộ corpus  /  tích với ma trận đã chuẩn hóa sẵn
+đồng thời kiểm tra vector và điểm của hai cách giống hệt nhau đến từng bit, và
+top-k tìm qua chỉ mục ngược (--n-random câu hỏi ghép ngẫu nhiên từ vocabulary,
+top_k 1..5) giống hệt top-k của cosine_similarity. Trả về mã lỗi 1 nếu có khác biệt.
+
+Chạy:
+    python3 benchmarks/bench_tfidf_query.py --csv data_converted.csv --n-queries 2000
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_recall import perturb  # noqa: E402
+from chatbot import Chatbot, preprocess_vietnamese_batch  # noqa: E402
+from retrieval import top_k  # noqa: E402
+from tfidf_query import normalize_rows, normalize_weights  # noqa: E402
+
+
+def median_us(fn, inputs, repeat):
+    """Thời gian trung vị (µs) của fn trên từng phần tử của inputs"""
+    fn(inputs[0])
+    samples = []
+    for _ in range(repeat):
+        for value in inputs:
+            start = time.perf_counter()
+            fn(value)
+            samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+def same_bits(a, b):
+    return a.shape == b.shape and np.array_equal(np.ascontiguousarray(a).view(np.int64),
+                                                 np.ascontiguousarray(b).view(np.int64))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="µs mỗi câu hỏi của TF-IDF: sklearn so với QueryVectorizer")
+    parser.add_argument('--csv', default='data_converted.csv')
+    parser.add_argument('--n-queries', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--n-random', type=int, default=500,
+                        help="Số câu hỏi ghép ngẫu nhiên từ vocabulary để kiểm tra chỉ mục ngược")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from sklearn.metrics.pairwise import cosine_similarity
+    from sklearn.preprocessing import normalize
+
+    chatbot = Chatbot(args.csv, result_cache_size=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not chatbot.load_data() or not chatbot.train():
+            print(f"✗ Không huấn luyện được từ {args.csv}")
+            sys.exit(1)
+    rng = random.Random(args.seed)
+    questions = list(chatbot.questions)
+    queries = preprocess_vietnamese_batch([perturb(rng.choice(questions), rng) for _ in range(args.n_queries)])
+
+    vectorizer = chatbot.vectorizer
+    query_vectorizer = chatbot.query_vectorizer
+    inverted_index = chatbot.inverted_index
+    question_vectors = chatbot.question_vectors
+    normalized = normalize_rows(question_vectors)
+    n_features = query_vectorizer.n_features
+
+    def sklearn_search(text):
+        return inverted_index.search(normalize(vectorizer.transform([text])))
+
+    def fast_search(text, k=1):
+        terms, weights = query_vectorizer.transform_one(text)
+        return inverted_index.search_terms(terms, normalize_weights(weights), k)
+
+    def fast_vector(text):
+        terms, weights = query_vectorizer.transform_one(text)
+        return csr_matrix((weights, terms, [0, len(terms)]), shape=(1, n_features))
+
+    def sklearn_cosine(text):
+        return cosine_similarity(vectorizer.transform([text]), question_vectors)
+
+    def fast_cosine(text):
+        return (normalize_rows(fast_vector(text)) @ normalized.T).toarray()
+
+    # Kiểm tra kết quả giống hệt nhau đến từng bit
+    expected = vectorizer.transform(queries)
+    expected.sort_indices()
+    actual = query_vectorizer.transform(queries)
+    mismatches = int(not (np.array_equal(expected.indptr, actual.indptr)
+                          and np.array_equal(expected.indices, actual.indices)
+                          and same_bits(expected.data, actual.data)))
+    check = queries[:200]
+    mismatches += sum(sklearn_search(text) != fast_search(text) for text in check)
+    mismatches += sum(not same_bits(sklearn_cosine(text), fast_cosine(text)) for text in check)
+
+    # Chỉ mục ngược so với cosine_similarity trên toàn corpus: cùng câu hỏi, cùng điểm đến từng bit
+    terms = [term for term, _ in sorted(query_vectorizer.features.items(), key=lambda item: item[1][0])]
+    random_queries = [' '.join(rng.choice(terms) for _ in range(rng.randint(1, 8))) for _ in range(args.n_random)]
+    for text in check + random_queries:
+        k = rng.randint(1, 5)
+        expected_top = [(idx, score) for idx, score in top_k(sklearn_cosine(text)[0], k, ties='highest')
+                        if score > 0]
+        actual_top = fast_search(text, k)
+        if [idx for idx, _ in expected_top] != [idx for idx, _ in actual_top] or \
+                not same_bits(np.array([score for _, score in expected_top]),
+                              np.array([score for _, score in actual_top])):
+            mismatches += 1
+
+    rows = [
+        ('transform', median_us(lambda text: vectorizer.transform([text]), queries, args.repeat),
+         median_us(query_vectorizer.transform_one, queries, args.repeat)),
+        ('tìm kiếm', median_us(sklearn_search, queries, args.repeat),
+         median_us(fast_search, queries, args.repeat)),
+        ('cosine', median_us(sklearn_cosine, check, args.repeat),
+         median_us(fast_cosine, check, args.repeat)),
+    ]
+
+    print(f"Corpus: {len(questions)} câu hỏi, {n_features} term; {len(queries)} câu hỏi đo\n")
+    print(f"{'bước':>10} {'sklearn µs':>11} {'nhanh µs':>9} {'giảm µs':>8} {'tăng tốc':>9}")
+    print("-" * 51)
+    for name, baseline, fast in rows:
+        print(f"{name:>10} {baseline:>11.1f} {fast:>9.1f} {baseline - fast:>8.1f} {baseline / fast:>9.2f}")
+
+    if mismatches:
+        print(f"\n✗ {mismatches} kết quả khác với sklearn")
+        sys.exit(1)
+    print("\n✓ Vector và điểm giống hệt sklearn")
+
+
+if __name__ == "__main__":
+    main()
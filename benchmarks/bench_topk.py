@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark chọn top-k: sắp xếp toàn bộ (argsort) so với lớp retrieval dùng chung
+
+Với mỗi kích thước corpus, đo độ trễ trung bình cho một câu hỏi:
+    argsort:       similarities.argsort()[-top_k:][::-1] (cách làm cũ của find_answer)
+    top_k:         retrieval.top_k trên cùng vector điểm đã tính sẵn
+    full+argsort:  chấm điểm toàn corpus (dot product) rồi argsort
+    chunked:       retrieval.chunked_top_k, chấm điểm + chọn theo từng khối
+
+Chạy:
+    python3 benchmarks/bench_topk.py --sizes 1000 10000 100000 1000000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import DEFAULT_CHUNK_SIZE, chunked_top_k, top_k  # noqa: E402
+
+
+def measure(fn, repeat):
+    """Thời gian trung bình (ms) của fn() sau một lần chạy khởi động"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chọn top-k theo kích thước corpus")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--dim', type=int, default=64, help="Số chiều vector của corpus giả lập")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'corpus':>10} {'argsort (ms)':>14} {'top_k (ms)':>12} {'full+argsort (ms)':>19} {'chunked (ms)':>14}")
+    print("-" * 73)
+
+    for size in args.sizes:
+        corpus = rng.standard_normal((size, args.dim), dtype=np.float32)
+        query = rng.standard_normal(args.dim, dtype=np.float32)
+        scores = corpus @ query
+
+        def score_chunk(start, end):
+            return (corpus[start:end] @ query)[None, :]
+
+        t_argsort = measure(lambda: scores.argsort()[-args.top_k:][::-1], args.repeat)
+        t_top_k = measure(lambda: top_k(scores, args.top_k), args.repeat)
+        t_full = measure(lambda: (corpus @ query).argsort()[-args.top_k:][::-1], args.repeat)
+        t_chunked = measure(lambda: chunked_top_k(score_chunk, size, args.top_k,
+                                                  chunk_size=args.chunk_size), args.repeat)
+
+        # Hai cách phải cho cùng tập điểm
+        expected = np.sort(scores[scores.argsort()[-args.top_k:]])[::-1]
+        got = np.array([score for _, score in top_k(scores, args.top_k)])
+        assert np.array_equal(expected, got), "top_k khác kết quả argsort"
+
+        print(f"{size:>10} {t_argsort:>14.3f} {t_top_k:>12.3f} {t_full:>19.3f} {t_chunked:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark và load-test cho cả hai loại chatbot (TF-IDF và Semantic Search)
+
+Sinh corpus hỏi-đáp tiếng Việt tổng hợp với kích thước tùy chọn từ
+data_converted.csv (diễn đạt lại và xáo trộn từ), rồi với mỗi engine đo:
+- Thời gian khởi động lạnh: load_data()/train() (TF-IDF), initialize() (Semantic Search)
+- Độ trễ từng câu hỏi: p50/p95/p99 (bộ nhớ đệm kết quả bị tắt)
+- Throughput theo lô với answer_many()
+- Bộ nhớ RSS cao nhất
+
+Mỗi engine chạy trong một tiến trình riêng để RSS không lẫn vào nhau. Kết quả
+được ghi ra JSON; --baseline so sánh với một lần chạy trước và trả về mã lỗi 1
+nếu có chỉ số chậm hơn quá --tolerance.
+
+Chạy:
+    python3 benchmarks/load_test.py --sizes 1000 10000 100000 --output bench.json
+    python3 benchmarks/load_test.py --sizes 1000 10000 100000 --baseline bench.json
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_recall import perturb  # noqa: E402
+
+ENGINES = ('tfidf', 'semantic')
+
+# Cách diễn đạt lại câu hỏi: thay cụm từ, thêm lời mở đầu/kết thúc
+SYNONYMS = [
+    ('là gì', 'nghĩa là gì'),
+    ('là gì', 'được hiểu là gì'),
+    ('như thế nào', 'ra sao'),
+    ('như thế nào', 'thế nào'),
+    ('làm sao', 'làm thế nào'),
+    ('tại sao', 'vì sao'),
+    ('có thể', 'có khả năng'),
+    ('sử dụng', 'dùng'),
+    ('khác nhau', 'khác biệt'),
+    ('ứng dụng', 'áp dụng'),
+]
+PREFIXES = ['', '', 'Cho mình hỏi ', 'Bạn ơi, ', 'Xin hỏi ', 'Mình muốn biết ', 'Giải thích giúp tôi: ']
+SUFFIXES = ['', '', ' vậy', ' nhỉ', ' ạ', ' không']
+
+# Các chỉ số được so sánh với baseline: True = càng lớn càng tốt
+METRICS = {
+    'load_data_s': False,
+    'train_s': False,
+    'initialize_s': False,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'batch_qps': True,
+    'peak_rss_mb': False,
+}
+
+
+def paraphrase(question, rng):
+    """Tạo một cách hỏi khác của câu hỏi: thay cụm từ đồng nghĩa, thêm lời mở đầu/kết thúc, xáo trộn từ"""
+    text = question.rstrip('?').strip()
+    lowered = text.lower()
+    for source, target in rng.sample(SYNONYMS, len(SYNONYMS)):
+        position = lowered.find(source)
+        if position >= 0 and rng.random() < 0.5:
+            text = text[:position] + target + text[position + len(source):]
+            lowered = text.lower()
+    if rng.random() < 0.3:
+        text = perturb(text, rng)
+    prefix = rng.choice(PREFIXES)
+    if prefix:
+        text = text[:1].lower() + text[1:]
+    return f"{prefix}{text}{rng.choice(SUFFIXES)}?"
+
+
+def synthesize_corpus(csv_file, size, seed=0):
+    """
+    Sinh corpus tổng hợp gồm size cặp câu hỏi-đáp từ file CSV gốc
+
+    Các câu hỏi gốc được giữ nguyên, phần còn lại là các cách hỏi khác (không
+    trùng nhau nếu có thể) của một câu hỏi gốc ngẫu nhiên với cùng câu trả lời.
+
+    Returns:
+        List các cặp (question, answer)
+    """
+    with open(csv_file, 'r', encoding='utf-8') as file:
+        base = [(row['question'].strip(), row['answer'].strip())
+                for row in csv.DictReader(file) if row['question'].strip() and row['answer'].strip()]
+
+    rng = random.Random(seed)
+    pairs = base[:size]
+    seen = {question for question, _ in pairs}
+    attempts = 0
+    while len(pairs) < size:
+        question, answer = rng.choice(base)
+        variant = paraphrase(question, rng)
+        attempts += 1
+        # Corpus rất lớn sẽ hết cách hỏi khác nhau: khi đó chấp nhận câu hỏi trùng
+        if variant in seen and attempts < 20 * size:
+            continue
+        seen.add(variant)
+        pairs.append((variant, answer))
+    return pairs
+
+
+def write_corpus(pairs, csv_file):
+    """Ghi corpus ra file CSV cùng định dạng với data_converted.csv"""
+    with open(csv_file, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['question', 'answer'])
+        writer.writerows(pairs)
+
+
+def make_queries(pairs, n_queries, seed=1):
+    """Câu hỏi thử: biến thể (bỏ/đảo từ) của các câu hỏi ngẫu nhiên trong corpus"""
+    rng = random.Random(seed)
+    return [perturb(rng.choice(pairs)[0], rng) for _ in range(n_queries)]
+
+
+def peak_rss_mb():
+    """RSS cao nhất của tiến trình hiện tại (MB)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def timed(fn, *args):
+    """Trả về (kết quả của fn, số giây)"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def run_engine(engine, csv_file, queries, batch_size, model_name):
+    """
+    Đo một engine trên corpus csv_file (chạy trong tiến trình con riêng)
+
+    Returns:
+        Dict các chỉ số, hoặc {'error': ...} nếu engine không khởi tạo được
+    """
+    report = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        if engine == 'tfidf':
+            from chatbot import Chatbot
+
+            chatbot = Chatbot(csv_file=csv_file, result_cache_size=0)
+            loaded, report['load_data_s'] = timed(chatbot.load_data)
+            if not loaded:
+                return {'error': f"Không đọc được {csv_file}"}
+            _, report['train_s'] = timed(chatbot.train)
+            ask = chatbot.find_answer
+        else:
+            from chatbot_pro import ChatbotPro
+
+            chatbot = ChatbotPro(csv_file=csv_file, model_name=model_name, result_cache_size=0)
+            initialized, report['initialize_s'] = timed(chatbot.initialize)
+            if not initialized:
+                return {'error': f"Không khởi tạo được ChatbotPro ({model_name})"}
+            ask = chatbot.answer
+
+        # Câu hỏi đầu tiên thường chậm hơn (khởi tạo lazy), không tính vào độ trễ
+        ask(queries[0])
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            ask(query)
+            latencies.append(time.perf_counter() - start)
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        report.update(p50_ms=float(p50), p95_ms=float(p95), p99_ms=float(p99))
+
+        start = time.perf_counter()
+        for begin in range(0, len(queries), batch_size):
+            chatbot.answer_many(queries[begin:begin + batch_size])
+        report['batch_qps'] = len(queries) / (time.perf_counter() - start)
+
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+def compare(results, baseline, tolerance):
+    """
+    So sánh với lần chạy trước
+
+    Returns:
+        List các chuỗi mô tả chỉ số bị chậm/tốn bộ nhớ hơn quá tolerance
+    """
+    previous = {(row['engine'], row['size']): row for row in baseline['results']}
+    regressions = []
+    for row in results:
+        old = previous.get((row['engine'], row['size']))
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in row or metric not in old or not old[metric]:
+                continue
+            change = row[metric] / old[metric] - 1.0
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{row['engine']} size={row['size']} {metric}: "
+                                   f"{old[metric]:.3f} -> {row[metric]:.3f} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark và load-test cho các chatbot")
+    parser.add_argument('--csv', default='data_converted.csv', help="Dữ liệu gốc để sinh corpus tổng hợp")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="Kích thước corpus")
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES))
+    parser.add_argument('--model', default='paraphrase-multilingual-MiniLM-L12-v2')
+    parser.add_argument('--n-queries', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=64, help="Số câu hỏi mỗi lần answer_many")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Ghi kết quả JSON ra file")
+    parser.add_argument('--baseline', help="File JSON của lần chạy trước để kiểm tra regression")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Mức chậm hơn cho phép so với baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Tiến trình con mới cho mỗi engine: không dùng chung bộ nhớ, mô hình hay bộ nhớ đệm
+    context = multiprocessing.get_context('spawn')
+    results = []
+    print(f"{'engine':<9} {'size':>8} {'khởi động (s)':>14} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'lô q/s':>9} {'RSS MB':>8}")
+    print("-" * 80)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            pairs = synthesize_corpus(args.csv, size, seed=args.seed)
+            csv_file = os.path.join(directory, f'corpus_{size}.csv')
+            write_corpus(pairs, csv_file)
+            queries = make_queries(pairs, args.n_queries, seed=args.seed + 1)
+
+            for engine in args.engines:
+                with context.Pool(1) as pool:
+                    try:
+                        report = pool.apply(run_engine, (engine, csv_file, queries, args.batch_size, args.model))
+                    except Exception as e:
+                        # Vd. không tải được mô hình: vẫn đo các engine còn lại
+                        report = {'error': f"{type(e).__name__}: {e}"}
+                report.update(engine=engine, size=size)
+                results.append(report)
+                if 'error' in report:
+                    print(f"{engine:<9} {size:>8} ✗ {report['error']}")
+                    continue
+                cold_start = report.get('initialize_s', report.get('load_data_s', 0) + report.get('train_s', 0))
+                print(f"{engine:<9} {size:>8} {cold_start:>14.2f} {report['p50_ms']:>8.2f} "
+                      f"{report['p95_ms']:>8.2f} {report['p99_ms']:>8.2f} {report['batch_qps']:>9.1f} "
+                      f"{report['peak_rss_mb']:>8.1f}")
+
+    output = {
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'cpu_count': os.cpu_count()},
+        'settings': {'csv': args.csv, 'n_queries': args.n_queries, 'batch_size': args.batch_size,
+                     'seed': args.seed, 'model': args.model},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(output, file, ensure_ascii=False, indent=2)
+        print(f"\n✓ Đã ghi kết quả vào {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"\n✗ {len(regressions)} chỉ số chậm hơn baseline quá {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"\n✓ Không có chỉ số nào chậm hơn baseline quá {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
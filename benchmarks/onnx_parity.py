@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+So sánh bộ encode ONNX Runtime (onnx_encoder.py) với PyTorch (sentence-transformers)
+
+Encode câu hỏi của corpus và các biến thể (bỏ/đảo từ) bằng cả hai cách chạy,
+in ra độ lệch cosine giữa hai embeddings của cùng một câu, tỉ lệ top-1 và mức
+độ tin cậy giống nhau khi tìm trong corpus, và độ trễ encode một câu hỏi.
+Trả về mã lỗi 1 nếu độ lệch cosine lớn nhất vượt quá --tolerance.
+
+Chạy (cần pip install onnxruntime; lần đầu export mô hình ra --export-dir):
+    python3 benchmarks/onnx_parity.py --csv data_converted.csv
+    python3 benchmarks/onnx_parity.py --quantize --threads auto --tolerance 0.05
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_recall import perturb  # noqa: E402
+from onnx_encoder import OnnxEncoder  # noqa: E402
+
+
+def tier(scores, high_threshold, low_threshold):
+    """Mức độ tin cậy theo điểm: 2 = cao, 1 = trung bình, 0 = thấp"""
+    return (scores >= high_threshold).astype(np.int8) + (scores > low_threshold).astype(np.int8)
+
+
+def unit(embeddings):
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+
+def latency_ms(model, queries, repeat):
+    """Độ trễ trung vị (ms) encode từng câu hỏi một"""
+    model.encode(queries[0], convert_to_numpy=True, show_progress_bar=False)
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            model.encode(query, convert_to_numpy=True, show_progress_bar=False)
+            samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Độ lệch và tốc độ của bộ encode ONNX so với PyTorch")
+    parser.add_argument('--csv', default='data_converted.csv')
+    parser.add_argument('--model', default='paraphrase-multilingual-MiniLM-L12-v2')
+    parser.add_argument('--export-dir', default='.onnx_models')
+    parser.add_argument('--quantize', action='store_true', help="Dùng bản lượng tử hóa động int8")
+    parser.add_argument('--threads', default=None,
+                        help="intra_op_threads của onnxruntime: số nguyên hoặc 'auto' (mặc định của onnxruntime)")
+    parser.add_argument('--n-queries', type=int, default=500)
+    parser.add_argument('--latency-queries', type=int, default=50, help="Số câu hỏi dùng để đo độ trễ")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--high-threshold', type=float, default=0.75)
+    parser.add_argument('--low-threshold', type=float, default=0.45)
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help="Độ lệch cosine lớn nhất cho phép giữa hai embeddings của cùng một câu")
+    parser.add_argument('--output', help="Ghi báo cáo JSON ra file")
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    with open(args.csv, 'r', encoding='utf-8') as file:
+        questions = [row['question'].strip() for row in csv.DictReader(file) if row['question'].strip()]
+    rng = random.Random(args.seed)
+    queries = [perturb(rng.choice(questions), rng) for _ in range(args.n_queries)]
+
+    threads = int(args.threads) if args.threads and args.threads != 'auto' else args.threads
+    torch_model = SentenceTransformer(args.model, device='cpu')
+    onnx_model = OnnxEncoder(args.model, export_dir=args.export_dir, quantize=args.quantize,
+                             intra_op_threads=threads)
+
+    texts = questions + queries
+    torch_embeddings = unit(torch_model.encode(texts, convert_to_numpy=True, show_progress_bar=False))
+    onnx_embeddings = unit(onnx_model.encode(texts, convert_to_numpy=True))
+    # 1 - cos giữa hai embeddings của cùng một câu
+    deviation = 1.0 - np.sum(torch_embeddings * onnx_embeddings, axis=1)
+
+    n = len(questions)
+    torch_scores = torch_embeddings[n:] @ torch_embeddings[:n].T
+    onnx_scores = onnx_embeddings[n:] @ onnx_embeddings[:n].T
+    torch_best = torch_scores.max(axis=1)
+    onnx_best = onnx_scores.max(axis=1)
+
+    latency_queries = queries[:args.latency_queries]
+    report = {
+        'model': args.model,
+        'quantize': args.quantize,
+        'intra_op_threads': onnx_model.intra_op_threads,
+        'n_texts': len(texts),
+        'max_cosine_deviation': float(deviation.max()),
+        'mean_cosine_deviation': float(deviation.mean()),
+        'top1_agreement': float(np.mean(torch_scores.argmax(axis=1) == onnx_scores.argmax(axis=1))),
+        'tier_agreement': float(np.mean(tier(torch_best, args.high_threshold, args.low_threshold)
+                                        == tier(onnx_best, args.high_threshold, args.low_threshold))),
+        'max_top1_score_gap': float(np.abs(torch_best - onnx_best).max()),
+        'torch_ms_per_query': latency_ms(torch_model, latency_queries, args.repeat),
+        'onnx_ms_per_query': latency_ms(onnx_model, latency_queries, args.repeat),
+    }
+    report['speedup'] = report['torch_ms_per_query'] / report['onnx_ms_per_query']
+
+    print(f"Mô hình: {args.model} ({'int8' if args.quantize else 'float32'}, "
+          f"intra_op_threads={report['intra_op_threads']}), {len(texts)} câu\n")
+    print(f"Độ lệch cosine:   lớn nhất {report['max_cosine_deviation']:.2e}, "
+          f"trung bình {report['mean_cosine_deviation']:.2e}")
+    print(f"Top-1 giống nhau: {report['top1_agreement']:.3f}")
+    print(f"Tier giống nhau:  {report['tier_agreement']:.3f} "
+          f"(lệch điểm top-1 lớn nhất {report['max_top1_score_gap']:.2e})")
+    print(f"ms/query:         torch {report['torch_ms_per_query']:.2f}, onnx {report['onnx_ms_per_query']:.2f} "
+          f"(x{report['speedup']:.2f})")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"\n✓ Đã ghi báo cáo vào {args.output}")
+
+    if report['max_cosine_deviation'] > args.tolerance:
+        print(f"\n✗ Độ lệch cosine {report['max_cosine_deviation']:.2e} vượt quá {args.tolerance}")
+        sys.exit(1)
+    print(f"\n✓ Độ lệch cosine trong giới hạn {args.tolerance}")
+
+
+if __name__ == "__main__":
+    main()
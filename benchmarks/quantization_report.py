@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Báo cáo bộ nhớ và độ chính xác của embeddings lượng tử hóa (float16/int8) so với float32
+
+Với mỗi kiểu lưu trữ của ExactIndex (có/không chấm điểm lại bằng vector gốc),
+in ra dung lượng dữ liệu được duyệt khi tìm kiếm, tỉ lệ top-1 giống float32,
+recall@k, tỉ lệ query có cùng mức độ tin cậy và độ trễ trung bình mỗi query.
+
+Chạy trên dữ liệu thật (cần tải mô hình sentence-transformers):
+    python3 benchmarks/quantization_report.py --csv data_converted.csv
+
+Chạy trên corpus vector ngẫu nhiên (không cần mô hình):
+    python3 benchmarks/quantization_report.py --random 1000000 --dim 384
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vector_index  # noqa: E402
+from ann_recall import load_vectors  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bộ nhớ và độ chính xác của embeddings lượng tử hóa")
+    parser.add_argument('--csv', default='data_converted.csv')
+    parser.add_argument('--model', default='paraphrase-multilingual-MiniLM-L12-v2')
+    parser.add_argument('--cache-dir', default='.embedding_cache')
+    parser.add_argument('--queries', help="File câu hỏi (mỗi dòng một câu); mặc định: biến thể của câu hỏi mẫu")
+    parser.add_argument('--n-queries', type=int, default=500)
+    parser.add_argument('--random', type=int, default=0, help="Dùng corpus ngẫu nhiên N vector thay vì CSV")
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--rescore', type=int, default=16, help="Số ứng viên được chấm điểm lại bằng float32")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--high-threshold', type=float, default=0.75)
+    parser.add_argument('--low-threshold', type=float, default=0.45)
+    parser.add_argument('--output', help="Ghi báo cáo JSON ra file")
+    args = parser.parse_args()
+
+    corpus, queries = load_vectors(args)
+    exact = vector_index.create_index('exact')
+    exact.build(corpus)
+    baseline_bytes = exact.nbytes()
+
+    reports = []
+    print(f"Corpus: {len(corpus)} vector x {corpus.shape[1]} chiều, {len(queries)} query\n")
+    print(f"{'storage':<8} {'rescore':>7} {'MB':>9} {'tỉ lệ':>6} {'top-1 =':>8} {f'recall@{args.k}':>10} "
+          f"{'tier =':>7} {'Δ top-1':>9} {'ms/query':>9}")
+    print("-" * 82)
+
+    for storage, rescore in (('float32', 0), ('float16', 0), ('float16', args.rescore),
+                             ('int8', 0), ('int8', args.rescore)):
+        index = vector_index.create_index('exact', storage=storage, rescore=rescore)
+        index.build(corpus)
+        report = vector_index.recall_report(index, exact, queries, k=args.k,
+                                            thresholds=(args.high_threshold, args.low_threshold))
+        report['bytes'] = index.nbytes()
+        report['bytes_ratio'] = index.nbytes() / baseline_bytes
+        reports.append(report)
+        print(f"{storage:<8} {rescore:>7} {report['bytes'] / 2**20:>9.2f} {report['bytes_ratio']:>6.2f} "
+              f"{report['recall@1']:>8.3f} {report[f'recall@{args.k}']:>10.3f} {report['tier_agreement']:>7.3f} "
+              f"{report['mean_top1_score_gap']:>9.2e} {report['approx_ms_per_query']:>9.3f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(reports, file, ensure_ascii=False, indent=2)
+        print(f"\n✓ Đã ghi báo cáo vào {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,26 +4,156 @@
 Chatbot hỏi-đáp sử dụng TF-IDF và Cosine Similarity
 """
 
-import csv
-import re
+import functools
+import hashlib
+import json
+import os
+import threading
 import unicodedata
+from numbers import Integral
+
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy.sparse import csr_matrix, vstack
+
+import tfidf_index
+from corpus_loader import DEFAULT_CHUNK_ROWS, LOADER_VERSION, CsvAnswers, load_corpus, select_rows
+from incremental import BackgroundCompactor, check_indices, clean_pairs
+from inverted_index import InvertedIndex
+from metrics import StartupReport, count_answer, count_cache, request, stage, startup_phase
+from query_cache import QueryCache
+from retrieval import DEFAULT_CHUNK_SIZE, chunked_top_k
+from sharding import ShardPool, sparse_search_task
+from tfidf_query import QueryVectorizer, normalize_rows, normalize_weights
+
+
+# Tham số TF-IDF Vectorizer
+# Sử dụng ngram_range=(1, 2) để bắt cả từ đơn và cụm 2 từ
+TFIDF_PARAMS = {
+    'ngram_range': (1, 2),
+    'max_features': 5000,
+    'min_df': 1,
+    'max_df': 0.95,
+}
+
+# Tăng khi preprocess_vietnamese thay đổi để các chỉ mục đã lưu bị train lại
+# (phiên bản 2: đ/Đ được chuyển thành d)
+PREPROCESS_VERSION = 2
+
+# Số câu hỏi người dùng đã tiền xử lý được nhớ lại (LRU)
+QUERY_CACHE_SIZE = 4096
+
+
+def _strip_marks(text):
+    """Bỏ dấu tổng quát: tách NFD rồi loại các ký tự dấu (Mn)"""
+    nfd_text = unicodedata.normalize('NFD', text)
+    return ''.join(char for char in nfd_text if unicodedata.category(char) != 'Mn')
+
+
+def _build_translation_table():
+    """
+    Bảng chuyển đổi ký tự có dấu -> không dấu cho vùng Latin (gồm toàn bộ chữ tiếng Việt)
+    
+    Chỉ chứa các ký tự mà kết quả bỏ dấu là ASCII; ký tự khác đi qua _strip_marks.
+    """
+    table = {}
+    for code in list(range(0x00C0, 0x0250)) + list(range(0x1E00, 0x1F00)):
+        char = chr(code)
+        stripped = _strip_marks(char.lower())
+        if stripped.isascii() and stripped != char:
+            table[code] = stripped
+    # NFD không tách được đ/Đ thành d + dấu nên phải thêm thủ công
+    table[ord('đ')] = 'd'
+    table[ord('Đ')] = 'd'
+    # Dấu rời (tổ hợp) đứng sau chữ cái không dấu
+    for code in range(0x0300, 0x0370):
+        table[code] = None
+    return table
+
+
+_LUT_SIZE = 0x1F00
+_LUT_DELETE = 0xFFFFFFFF
+
+
+def _build_lookup_array(table):
+    """Cùng bảng chuyển đổi dưới dạng mảng tra cứu theo code point (cho bản xử lý theo lô)"""
+    lookup = np.arange(_LUT_SIZE, dtype=np.uint32)
+    for code, value in table.items():
+        lookup[code] = _LUT_DELETE if value is None else ord(value)
+    return lookup
+
+
+_VIETNAMESE_TABLE = _build_translation_table()
+_VIETNAMESE_LUT = _build_lookup_array(_VIETNAMESE_TABLE)
 
 
 def preprocess_vietnamese(text):
-    """Tiền xử lý tiếng Việt: lowercase, bỏ dấu, chuẩn hóa khoảng trắng"""
+    """Tiền xử lý tiếng Việt: lowercase, bỏ dấu (kể cả đ -> d), chuẩn hóa khoảng trắng"""
     if not isinstance(text, str):
         return text
-    # Lowercase
-    text = text.lower()
-    # Bỏ dấu
-    nfd_text = unicodedata.normalize('NFD', text)
-    text = ''.join(char for char in nfd_text if unicodedata.category(char) != 'Mn')
+    # Lowercase + bỏ dấu bằng bảng chuyển đổi tính sẵn
+    text = text.lower().translate(_VIETNAMESE_TABLE)
+    # Ký tự ngoài bảng (chữ không phải Latin...): bỏ dấu tổng quát
+    if not text.isascii():
+        text = _strip_marks(text)
     # Chuẩn hóa khoảng trắng
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+    return ' '.join(text.split())
+
+
+def preprocess_vietnamese_batch(texts):
+    """
+    Tiền xử lý một danh sách văn bản, cho kết quả giống preprocess_vietnamese từng phần tử
+    
+    Các văn bản được nối lại để lowercase một lần, sau đó bỏ dấu cho toàn bộ
+    bằng một phép tra mảng numpy trên các code point (UTF-32).
+    
+    Args:
+        texts: Danh sách văn bản
+        
+    Returns:
+        List văn bản đã tiền xử lý
+    """
+    texts = list(texts)
+    if not all(isinstance(text, str) and '\x00' not in text for text in texts):
+        return [preprocess_vietnamese(text) for text in texts]
+    
+    if not texts:
+        return []
+    
+    try:
+        codes = np.frombuffer('\x00'.join(texts).lower().encode('utf-32-le'), dtype=np.uint32)
+    except UnicodeEncodeError:
+        # Văn bản chứa surrogate lẻ: xử lý từng phần tử
+        return [preprocess_vietnamese(text) for text in texts]
+    in_table = codes < _LUT_SIZE
+    codes = np.where(in_table, _VIETNAMESE_LUT[np.where(in_table, codes, 0)], codes)
+    codes = codes[codes != _LUT_DELETE]
+    joined = codes.tobytes().decode('utf-32-le')
+    
+    results = []
+    for text in joined.split('\x00'):
+        if not text.isascii():
+            text = _strip_marks(text)
+        results.append(' '.join(text.split()))
+    return results
+
+
+def _build_inverted_index(question_vectors):
+    """
+    Chỉ mục ngược trên question_vectors chuẩn hóa L2 lại như cosine_similarity
+    
+    Cùng với câu hỏi người dùng được chuẩn hóa lại, điểm tìm qua chỉ mục ngược
+    giống hệt điểm của _top_matches (cosine_similarity) đến từng bit.
+    """
+    return InvertedIndex.from_matrix(normalize_rows(question_vectors))
+
+
+def _copy_results(results):
+    """Bản sao kết quả của find_answer() để bộ nhớ đệm không bị sửa từ bên ngoài"""
+    return [dict(result) for result in results] if results is not None else None
+
+
+# Phiên bản có nhớ (LRU) cho câu hỏi người dùng: các câu hỏi phổ biến lặp lại rất nhiều
+preprocess_query = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(preprocess_vietnamese)
 
 
 class Chatbot:
@@ -31,51 +161,157 @@ class Chatbot:
     Chatbot hỏi-đáp sử dụng TF-IDF và Cosine Similarity
     """
     
-    def __init__(self, csv_file='data_converted.csv', similarity_threshold=0.1):
+    engine_name = 'tfidf'
+    
+    def __init__(self, csv_file='data_converted.csv', similarity_threshold=0.1, chunk_size=DEFAULT_CHUNK_SIZE,
+                 result_cache_size=1024, result_cache_ttl=300.0, metrics=None, corpus_store=None):
         """
         Khởi tạo chatbot
         
         Args:
             csv_file: Đường dẫn đến file CSV chứa dữ liệu câu hỏi-đáp
             similarity_threshold: Ngưỡng similarity tối thiểu để trả lời (0-1)
+            chunk_size: Số câu hỏi trong database được chấm điểm mỗi khối khi tìm top-k
+            result_cache_size: Số kết quả truy vấn được giữ trong bộ nhớ đệm (0 = tắt)
+            result_cache_ttl: Thời gian sống (giây) của mỗi kết quả trong bộ nhớ đệm
+            metrics: metrics.Metrics ghi thời gian từng bước và các counter (None = tắt)
+            corpus_store: corpus_loader.CorpusStore để dùng chung dữ liệu đã đọc với các engine
+                khác trong tiến trình (None = tự đọc file CSV)
         """
         self.csv_file = csv_file
+        self.corpus_store = corpus_store
         self.similarity_threshold = similarity_threshold
+        self.chunk_size = chunk_size
         self.questions = []
         self.answers = []
         self.processed_questions = []
-        self.vectorizer = None
+        # Số dòng đã đọc/bỏ qua của file CSV (corpus_loader.CorpusStats)
+        self.corpus_stats = None
+        # Corpus dùng chung của corpus_store (giữ để store không giải phóng nó khi engine còn dùng)
+        self.corpus = None
+        # sklearn chỉ được import khi cần: vectorizer đọc từ chỉ mục đã lưu được dựng lại ở lần dùng đầu tiên
+        self._vectorizer = None
+        self._saved_vocabulary = None
+        # Câu hỏi người dùng được vector hóa không qua sklearn (tfidf_query.py)
+        self._query_vectorizer = None
         self.question_vectors = None
+        # (corpus_version, question_vectors đã chuẩn hóa L2 lại) dùng bởi _top_matches
+        self._scoring_vectors = None
+        self.inverted_index = None
+        # Tăng mỗi khi dữ liệu/mô hình thay đổi (huấn luyện, thêm/xóa/sửa câu hỏi)
+        self.corpus_version = 0
+        # Số thay đổi tăng dần chưa được compact() (IDF chưa được tính lại)
+        self.pending_changes = 0
+        self._lock = threading.RLock()
+        self._compactor = None
+        # Chế độ nhiều tiến trình (start_sharding): corpus_version của dữ liệu đã chia sẻ cho worker
+        self._shard_pool = None
+        self._shared_version = None
+        # Kết quả theo câu hỏi đã tiền xử lý; tự xóa khi dữ liệu hoặc ngưỡng thay đổi
+        self.result_cache = QueryCache(result_cache_size, result_cache_ttl) if result_cache_size else None
+        self.metrics = metrics
+        # Thời gian các giai đoạn khởi động (load_data, build_index/load_index...)
+        self.startup = StartupReport()
+    
+    @property
+    def vectorizer(self):
+        """TfidfVectorizer đã fit (None nếu chưa huấn luyện)"""
+        if self._vectorizer is None and self._saved_vocabulary is not None:
+            self._vectorizer = tfidf_index.build_vectorizer(*self._saved_vocabulary)
+            self._saved_vocabulary = None
+        return self._vectorizer
+    
+    @vectorizer.setter
+    def vectorizer(self, vectorizer):
+        self._vectorizer = vectorizer
+        self._saved_vocabulary = None
+        self._query_vectorizer = None
+    
+    @property
+    def query_vectorizer(self):
+        """
+        tfidf_query.QueryVectorizer cho ra vector giống hệt vectorizer.transform() (None nếu chưa huấn luyện)
+        
+        Được dựng từ vocabulary/IDF đã lưu mà không import sklearn.
+        """
+        if self._query_vectorizer is None:
+            if self._saved_vocabulary is not None:
+                self._query_vectorizer = QueryVectorizer.from_params(*self._saved_vocabulary)
+            elif self._vectorizer is not None:
+                self._query_vectorizer = QueryVectorizer.from_vectorizer(self._vectorizer)
+        return self._query_vectorizer
+    
+    def warm_up(self, background=True):
+        """
+        Dựng trước bộ vector hóa câu hỏi để câu hỏi đầu tiên không phải chờ
+        
+        Args:
+            background: Chạy trong thread nền; chatbot vẫn trả lời được ngay, câu
+                hỏi đến trước khi xong sẽ chờ dựng xong
+            
+        Returns:
+            Thread đang chạy (background=True) hoặc None
+        """
+        if not background:
+            self._warm_up()
+            return None
+        thread = threading.Thread(target=self._warm_up, name='tfidf-warm-up', daemon=True)
+        thread.start()
+        return thread
+    
+    @startup_phase('warm_up')
+    def _warm_up(self):
+        """Truy cập query_vectorizer để nó được dựng từ vocabulary/IDF (nếu chưa)"""
+        return self.query_vectorizer
+    
+    def is_trained(self):
+        """Mô hình đã được huấn luyện hoặc đọc từ chỉ mục (không dựng lại vectorizer)"""
+        return (self._vectorizer is not None or self._saved_vocabulary is not None) \
+            and self.question_vectors is not None
         
+    @startup_phase('load_data')
     def load_data(self):
         """
-        Đọc dữ liệu từ file CSV
+        Đọc dữ liệu từ file CSV theo từng khối (xem corpus_loader.py)
+        
+        Câu hỏi được tiền xử lý theo từng khối ngay khi đọc; câu trả lời được đọc
+        lại từ file khi cần thay vì giữ trong RAM. Với corpus_store, câu hỏi và câu
+        trả lời là bản dùng chung của store.
         """
+        processed_questions = []
+        corpus = None
         try:
-            with open(self.csv_file, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                
-                for row in reader:
-                    question = row['question'].strip()
-                    answer = row['answer'].strip()
-                    
-                    if question and answer:
-                        self.questions.append(question)
-                        self.answers.append(answer)
-                        # Tiền xử lý câu hỏi để so sánh
-                        processed_q = preprocess_vietnamese(question)
-                        self.processed_questions.append(processed_q)
-            
-            print(f"✓ Đã tải {len(self.questions)} cặp câu hỏi-đáp từ {self.csv_file}")
-            return True
-            
+            if self.corpus_store is not None:
+                corpus = self.corpus_store.get(self.csv_file)
+                questions, answers, stats = corpus.questions, corpus.answers, corpus.stats
+                for start in range(0, len(questions), DEFAULT_CHUNK_ROWS):
+                    chunk = questions[start:start + DEFAULT_CHUNK_ROWS]
+                    processed_questions.extend(preprocess_vietnamese_batch(chunk))
+            else:
+                questions, answers, stats = load_corpus(
+                    self.csv_file,
+                    on_chunk=lambda chunk: processed_questions.extend(preprocess_vietnamese_batch(chunk))
+                )
         except FileNotFoundError:
             print(f"✗ Không tìm thấy file: {self.csv_file}")
             return False
         except Exception as e:
             print(f"✗ Lỗi khi đọc file: {e}")
             return False
+        
+        with self._lock:
+            self.questions = questions
+            self.answers = answers
+            self.processed_questions = processed_questions
+            self.corpus_stats = stats
+            self.corpus = corpus
+        
+        print(f"✓ Đã tải {len(questions)} cặp câu hỏi-đáp từ {self.csv_file}")
+        if stats.skipped:
+            print(f"  {stats}")
+        return True
     
+    @startup_phase('build_index')
     def train(self):
         """
         Huấn luyện mô hình: vectorize các câu hỏi bằng TF-IDF
@@ -84,22 +320,382 @@ class Chatbot:
             print("✗ Chưa có dữ liệu. Vui lòng load_data() trước.")
             return False
         
-        # Khởi tạo TF-IDF Vectorizer
-        # Sử dụng ngram_range=(1, 2) để bắt cả từ đơn và cụm 2 từ
-        self.vectorizer = TfidfVectorizer(
-            ngram_range=(1, 2),
-            max_features=5000,
-            min_df=1,
-            max_df=0.95
-        )
-        
-        # Vectorize các câu hỏi đã tiền xử lý
-        self.question_vectors = self.vectorizer.fit_transform(self.processed_questions)
+        with self._lock:
+            self.vectorizer, self.question_vectors, self.inverted_index = self._fit(self.processed_questions)
+            self.corpus_version += 1
+            self.pending_changes = 0
         
         print(f"✓ Đã huấn luyện mô hình với {len(self.processed_questions)} câu hỏi")
         print(f"  Vocabulary size: {len(self.vectorizer.vocabulary_)}")
         return True
     
+    @staticmethod
+    def _fit(processed_questions, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """
+        Huấn luyện TF-IDF theo từng khối: trả về (vectorizer, question_vectors, inverted_index)
+        
+        Kết quả giống hệt TfidfVectorizer.fit_transform (từng bước như sklearn) nhưng
+        các list tạm của Python chỉ chứa một khối chunk_rows câu hỏi: mỗi khối được
+        đếm ngay thành mảng int32 gọn, vocabulary/IDF được chọn khi đã đếm hết rồi
+        từng khối được chuyển thành TF-IDF và ghi thẳng vào ma trận kết quả.
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.preprocessing import normalize
+        
+        # Khởi tạo TF-IDF Vectorizer
+        vectorizer = TfidfVectorizer(**TFIDF_PARAMS)
+        analyze = vectorizer.build_analyzer()
+        
+        # Đếm term của từng khối như CountVectorizer._count_vocab (chỉ số term theo thứ tự gặp lần đầu)
+        vocabulary = {}
+        chunks = []
+        for start in range(0, len(processed_questions), chunk_rows):
+            indices, counts, indptr = [], [], [0]
+            for document in processed_questions[start:start + chunk_rows]:
+                feature_counter = {}
+                for feature in analyze(document):
+                    feature_idx = vocabulary.setdefault(feature, len(vocabulary))
+                    feature_counter[feature_idx] = feature_counter.get(feature_idx, 0) + 1
+                indices.extend(feature_counter.keys())
+                counts.extend(feature_counter.values())
+                indptr.append(len(indices))
+            chunks.append((np.asarray(indices, dtype=np.int32), np.asarray(counts, dtype=np.int32),
+                           np.asarray(indptr, dtype=np.int64)))
+        if not vocabulary:
+            raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+        
+        # Sắp xếp term theo thứ tự chữ cái (CountVectorizer._sort_features)
+        terms = sorted(vocabulary)
+        order = np.fromiter((vocabulary[term] for term in terms), dtype=np.int64, count=len(terms))
+        map_index = np.empty(len(terms), dtype=np.int32)
+        map_index[order] = np.arange(len(terms), dtype=np.int32)
+        del vocabulary
+        
+        # Lọc theo min_df/max_df và giữ max_features term có tổng số lần xuất hiện lớn nhất
+        # (CountVectorizer._limit_features)
+        dfs = sum(np.bincount(indices, minlength=len(terms)) for indices, _, _ in chunks)[order]
+        n_documents = len(processed_questions)
+        max_df, min_df = vectorizer.max_df, vectorizer.min_df
+        max_doc_count = max_df if isinstance(max_df, Integral) else max_df * n_documents
+        min_doc_count = min_df if isinstance(min_df, Integral) else min_df * n_documents
+        mask = (dfs <= max_doc_count) & (dfs >= min_doc_count)
+        limit = vectorizer.max_features
+        if limit is not None and mask.sum() > limit:
+            tfs = sum(np.bincount(indices, weights=counts, minlength=len(terms))
+                      for indices, counts, _ in chunks)[order]
+            mask_inds = (-tfs[mask]).argsort()[:limit]
+            new_mask = np.zeros(len(dfs), dtype=bool)
+            new_mask[np.where(mask)[0][mask_inds]] = True
+            mask = new_mask
+        kept = np.where(mask)[0]
+        if len(kept) == 0:
+            raise ValueError("After pruning, no terms remain. Try a lower min_df or a higher max_df.")
+        
+        # IDF làm trơn như TfidfTransformer.fit: log((n + 1) / (df + 1)) + 1
+        df = dfs[kept].astype(np.float64) + 1.0
+        idf = np.full_like(df, fill_value=n_documents + 1, dtype=np.float64)
+        idf /= df
+        np.log(idf, out=idf)
+        idf += 1.0
+        vectorizer = tfidf_index.build_vectorizer(TFIDF_PARAMS, [terms[column] for column in kept], idf)
+        
+        # Vectorize các câu hỏi: mỗi khối được sắp xếp/lọc term, nhân IDF và chuẩn hóa L2 như
+        # sklearn (các bước chỉ phụ thuộc từng dòng) rồi ghi vào mảng cấp phát trước
+        kept_by_original = mask[map_index]
+        nnz = sum(int(np.count_nonzero(kept_by_original[indices])) for indices, _, _ in chunks)
+        data = np.empty(nnz, dtype=np.float64)
+        out_indices = np.empty(nnz, dtype=np.int32)
+        out_indptr = np.zeros(n_documents + 1, dtype=np.int32 if nnz <= np.iinfo(np.int32).max else np.int64)
+        row = position = 0
+        while chunks:
+            indices, counts, indptr = chunks.pop(0)
+            matrix = csr_matrix((counts.astype(np.float64), indices, indptr),
+                                shape=(len(indptr) - 1, len(terms)))
+            matrix.sort_indices()
+            matrix.indices = map_index.take(matrix.indices, mode='clip')
+            matrix = matrix[:, kept]
+            matrix.data *= idf[matrix.indices]
+            matrix = normalize(matrix, norm='l2', copy=False)
+            data[position:position + matrix.nnz] = matrix.data
+            out_indices[position:position + matrix.nnz] = matrix.indices
+            out_indptr[row + 1:row + 1 + matrix.shape[0]] = matrix.indptr[1:] + position
+            row += matrix.shape[0]
+            position += matrix.nnz
+        question_vectors = csr_matrix((data, out_indices, out_indptr), shape=(n_documents, len(kept)), copy=False)
+        
+        # Chỉ mục ngược: term -> (câu hỏi, trọng số) để chỉ chấm điểm các câu hỏi có chung term
+        return vectorizer, question_vectors, _build_inverted_index(question_vectors)
+    
+    def add_pairs(self, pairs):
+        """
+        Thêm các cặp câu hỏi-đáp mà không huấn luyện lại
+        
+        Câu hỏi mới được vector hóa bằng vocabulary và IDF hiện tại (term chưa có
+        trong vocabulary bị bỏ qua) cho tới lần compact() tiếp theo.
+        
+        Args:
+            pairs: Danh sách cặp (question, answer)
+            
+        Returns:
+            List chỉ số của các câu hỏi mới, hoặc None nếu mô hình chưa được huấn luyện
+        """
+        if not self.is_trained():
+            print("✗ Mô hình chưa được huấn luyện. Vui lòng gọi train() trước.")
+            return None
+        
+        pairs = clean_pairs(pairs)
+        if not pairs:
+            return []
+        processed = preprocess_vietnamese_batch([question for question, _ in pairs])
+        
+        with self._lock:
+            self._make_mutable()
+            start = len(self.questions)
+            new_vectors = self.query_vectorizer.transform(processed)
+            self._set_vectors(vstack([self.question_vectors, new_vectors], format='csr'))
+            self.questions.extend(question for question, _ in pairs)
+            self.answers.extend(answer for _, answer in pairs)
+            self.processed_questions.extend(processed)
+            self._mark_changed(len(pairs))
+        return list(range(start, start + len(pairs)))
+    
+    def remove_pairs(self, indices):
+        """
+        Xóa các cặp câu hỏi-đáp theo chỉ số (các câu hỏi phía sau bị dịch chỉ số)
+        
+        Args:
+            indices: Danh sách chỉ số cần xóa
+            
+        Returns:
+            Số cặp đã xóa, hoặc None nếu mô hình chưa được huấn luyện
+        """
+        if not self.is_trained():
+            print("✗ Mô hình chưa được huấn luyện. Vui lòng gọi train() trước.")
+            return None
+        
+        with self._lock:
+            removed = check_indices(indices, len(self.questions))
+            if len(removed) == 0:
+                return 0
+            self._make_mutable()
+            keep = np.ones(len(self.questions), dtype=bool)
+            keep[removed] = False
+            self._set_vectors(self.question_vectors[keep])
+            self.questions = [q for q, kept in zip(self.questions, keep) if kept]
+            self.answers = select_rows(self.answers, keep)
+            self.processed_questions = [p for p, kept in zip(self.processed_questions, keep) if kept]
+            self._mark_changed(len(removed))
+        return len(removed)
+    
+    def update_pair(self, index, question=None, answer=None):
+        """
+        Sửa một cặp câu hỏi-đáp tại chỗ (giữ nguyên chỉ số)
+        
+        Args:
+            index: Chỉ số cặp cần sửa
+            question: Câu hỏi mới (None = giữ nguyên)
+            answer: Câu trả lời mới (None = giữ nguyên)
+            
+        Returns:
+            True nếu đã sửa
+        """
+        if not self.is_trained():
+            print("✗ Mô hình chưa được huấn luyện. Vui lòng gọi train() trước.")
+            return False
+        
+        question = question.strip() if question is not None else None
+        answer = answer.strip() if answer is not None else None
+        if question == '' or answer == '':
+            return False
+        processed = preprocess_vietnamese(question) if question is not None else None
+        
+        with self._lock:
+            index = int(check_indices([index], len(self.questions))[0])
+            self._make_mutable()
+            if question is not None:
+                new_vector = self.query_vectorizer.transform([processed])
+                self._set_vectors(vstack([self.question_vectors[:index], new_vector,
+                                          self.question_vectors[index + 1:]], format='csr'))
+                self.questions[index] = question
+                self.processed_questions[index] = processed
+            if answer is not None:
+                self.answers[index] = answer
+            self._mark_changed(1 if question is not None else 0)
+        return True
+    
+    def _make_mutable(self):
+        """
+        Sao chép dữ liệu chỉ đọc (file chỉ mục, corpus dùng chung của CorpusStore) trước khi sửa
+        
+        CsvAnswers được sao chép (chỉ các vị trí byte), không đọc lại câu trả lời từ file.
+        """
+        if not isinstance(self.questions, list):
+            self.questions = list(self.questions)
+            self.answers = self.answers.copy() if isinstance(self.answers, CsvAnswers) else list(self.answers)
+            self.processed_questions = list(self.processed_questions)
+    
+    def _set_vectors(self, question_vectors):
+        """Thay ma trận TF-IDF và xây lại chỉ mục ngược tương ứng"""
+        question_vectors = csr_matrix(question_vectors)
+        self.inverted_index = _build_inverted_index(question_vectors)
+        self.question_vectors = question_vectors
+    
+    def _mark_changed(self, n_changes):
+        """Đánh dấu dữ liệu đã thay đổi (n_changes câu hỏi cần tính lại khi compact)"""
+        self.corpus_version += 1
+        self.pending_changes += n_changes
+    
+    def compact(self):
+        """
+        Huấn luyện lại TF-IDF trên dữ liệu hiện tại để tính lại chính xác vocabulary và IDF
+        
+        Việc huấn luyện chạy ngoài lock (vẫn trả lời câu hỏi bình thường); mô hình
+        mới chỉ được thay vào nếu dữ liệu không bị sửa trong lúc huấn luyện.
+        
+        Returns:
+            True nếu mô hình mới đã được thay vào
+        """
+        with self._lock:
+            version = self.corpus_version
+            pending = self.pending_changes
+            processed = list(self.processed_questions)
+        if not processed:
+            return False
+        
+        vectorizer, question_vectors, inverted_index = self._fit(processed)
+        
+        with self._lock:
+            if self.corpus_version != version:
+                return False
+            self.vectorizer = vectorizer
+            self.question_vectors = question_vectors
+            self.inverted_index = inverted_index
+            self.corpus_version += 1
+            self.pending_changes -= pending
+        return True
+    
+    def start_compaction(self, interval=300.0, min_changes=1):
+        """
+        Chạy compact() định kỳ trong thread nền khi có thay đổi đang chờ
+        
+        Args:
+            interval: Số giây giữa hai lần kiểm tra
+            min_changes: Số thay đổi tối thiểu để chạy compaction
+        """
+        self.stop_compaction()
+        self._compactor = BackgroundCompactor(self, interval, min_changes)
+        self._compactor.start()
+    
+    def stop_compaction(self):
+        """Dừng thread compaction nền (nếu có)"""
+        if self._compactor is not None:
+            self._compactor.stop()
+            self._compactor = None
+    
+    def fingerprint(self):
+        """
+        Dấu vân tay của file CSV và cấu hình huấn luyện
+        
+        Returns:
+            Chuỗi hex sha256, hoặc None nếu không đọc được file CSV
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            'format': tfidf_index.FORMAT_VERSION,
+            'preprocess': PREPROCESS_VERSION,
+            'loader': LOADER_VERSION,
+            'params': TFIDF_PARAMS,
+        }, sort_keys=True).encode('utf-8'))
+        try:
+            with open(self.csv_file, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+        except OSError:
+            return None
+        return digest.hexdigest()
+    
+    def save_index(self, index_path):
+        """
+        Lưu mô hình đã huấn luyện ra file chỉ mục (xem tfidf_index.py)
+        
+        Args:
+            index_path: Đường dẫn file chỉ mục
+        """
+        if not self.is_trained():
+            print("✗ Mô hình chưa được huấn luyện. Vui lòng gọi train() trước.")
+            return False
+        
+        try:
+            tfidf_index.save_index(
+                index_path, self.fingerprint(), TFIDF_PARAMS, self.vectorizer,
+                self.question_vectors, self.questions, self.answers, self.processed_questions
+            )
+        except OSError as e:
+            print(f"✗ Lỗi khi ghi chỉ mục: {e}")
+            return False
+        
+        print(f"✓ Đã lưu chỉ mục TF-IDF vào {index_path}")
+        return True
+    
+    @startup_phase('load_index')
+    def load_index(self, index_path, fingerprint=None):
+        """
+        Đọc (memory-map) mô hình đã huấn luyện từ file chỉ mục
+        
+        Args:
+            index_path: Đường dẫn file chỉ mục
+            fingerprint: Nếu có, chỉ nhận file có cùng dấu vân tay
+            
+        Returns:
+            True nếu đọc thành công
+        """
+        index = tfidf_index.load_index(index_path)
+        if index is None:
+            return False
+        if fingerprint is not None and index['fingerprint'] != fingerprint:
+            return False
+        
+        with self._lock:
+            self.vectorizer = None
+            self._saved_vocabulary = (index['params'], index['terms'], index['idf'])
+            self.question_vectors = index['question_vectors']
+            self.questions = index['questions']
+            self.answers = index['answers']
+            self.processed_questions = index['processed_questions']
+            self.corpus = None
+            self.inverted_index = _build_inverted_index(self.question_vectors)
+            self.corpus_version += 1
+            self.pending_changes = 0
+        
+        print(f"✓ Đã tải chỉ mục TF-IDF ({len(self.questions)} câu hỏi) từ {index_path}")
+        return True
+    
+    def load_or_train(self, index_path=None):
+        """
+        Đọc chỉ mục đã lưu nếu CSV không đổi, ngược lại load_data() + train() và lưu lại
+        
+        Args:
+            index_path: Đường dẫn file chỉ mục (mặc định: <tên file CSV>.tfidf.idx)
+            
+        Returns:
+            True nếu chatbot sẵn sàng trả lời
+        """
+        if index_path is None:
+            index_path = os.path.splitext(self.csv_file)[0] + '.tfidf.idx'
+        
+        fingerprint = self.fingerprint()
+        if fingerprint is None:
+            print(f"✗ Không tìm thấy file: {self.csv_file}")
+            return False
+        
+        if self.load_index(index_path, fingerprint=fingerprint):
+            return True
+        
+        if not self.load_data() or not self.train():
+            return False
+        self.save_index(index_path)
+        return True
+    
     def find_answer(self, user_question, top_k=1):
         """
         Tìm câu trả lời cho câu hỏi của người dùng
@@ -111,25 +707,155 @@ class Chatbot:
         Returns:
             Tuple (answer, similarity_score, matched_question) hoặc None nếu không tìm thấy
         """
-        if self.vectorizer is None or self.question_vectors is None:
+        if not self.is_trained():
             print("✗ Mô hình chưa được huấn luyện. Vui lòng gọi train() trước.")
             return None
         
+        if self.metrics is None:
+            return self._find_answer(user_question, top_k)
+        with request(self.metrics, self.engine_name, 'find_answer'):
+            results = self._find_answer(user_question, top_k)
+        count_answer(self.metrics, self.engine_name, 'answered' if results else 'fallback')
+        return results
+    
+    def _find_answer(self, user_question, top_k):
+        """find_answer() khi mô hình đã được huấn luyện"""
         # Tiền xử lý câu hỏi của người dùng
-        processed_user_q = preprocess_vietnamese(user_question)
+        with stage(self.metrics, self.engine_name, 'preprocess'):
+            processed_user_q = preprocess_query(user_question)
+        
+        cache_key = ('find', top_k, processed_user_q)
+        if self.result_cache is not None:
+            cached = self.result_cache.get(self._cache_scope(), cache_key)
+            count_cache(self.metrics, self.engine_name, cached is not QueryCache.MISS)
+            if cached is not QueryCache.MISS:
+                return _copy_results(cached)
+        
+        with self._lock:
+            scope = self._cache_scope()
+            # Vectorize câu hỏi của người dùng: các cột (tăng dần) và trọng số TF-IDF
+            with stage(self.metrics, self.engine_name, 'transform'):
+                terms, weights = self.query_vectorizer.transform_one(processed_user_q)
+            
+            with stage(self.metrics, self.engine_name, 'similarity'):
+                if self.inverted_index is not None and self.similarity_threshold > 0:
+                    # Chỉ chấm điểm các câu hỏi có chung term với câu hỏi người dùng.
+                    # Câu hỏi không chung term nào có similarity 0, luôn dưới ngưỡng.
+                    # Chuẩn hóa lại như cosine_similarity để điểm giống hệt _top_matches
+                    top_matches = self.inverted_index.search_terms(terms, normalize_weights(weights), top_k)
+                else:
+                    # Tính cosine similarity với các câu hỏi trong database theo từng khối
+                    # và chỉ giữ lại top_k câu hỏi có similarity cao nhất
+                    user_vector = csr_matrix((weights, terms, [0, len(terms)]),
+                                             shape=(1, self.query_vectorizer.n_features))
+                    top_matches = self._top_matches(user_vector, top_k)[0]
+            
+            with stage(self.metrics, self.engine_name, 'format'):
+                results = self._build_results(top_matches)
+        
+        if self.result_cache is not None:
+            self.result_cache.put(scope, cache_key, _copy_results(results))
+        return results
+    
+    def _cache_scope(self):
+        """Trạng thái mà kết quả truy vấn phụ thuộc vào (khóa phạm vi của result_cache)"""
+        return ('tfidf', PREPROCESS_VERSION, self.corpus_version, self.similarity_threshold)
+    
+    def shortlist(self, user_questions, size):
+        """
+        Lấy nhanh các câu hỏi ứng viên cho từng câu hỏi người dùng (dùng bởi ChatbotHybrid)
+        
+        Args:
+            user_questions: Danh sách câu hỏi của người dùng
+            size: Số ứng viên tối đa cho mỗi câu hỏi
+            
+        Returns:
+            List (mỗi câu hỏi một phần tử) các list cặp (index, similarity) theo
+            similarity giảm dần, chỉ gồm câu hỏi có chung term (similarity > 0),
+            không lọc theo similarity_threshold
+        """
+        processed = preprocess_vietnamese_batch(user_questions)
+        with self._lock:
+            user_vectors = self.query_vectorizer.transform(processed)
+            if self.inverted_index is not None:
+                user_vectors = normalize_rows(user_vectors)
+                return [self.inverted_index.search(user_vectors[row], size) for row in range(len(processed))]
+            return [[(idx, score) for idx, score in top_matches if score > 0]
+                    for top_matches in self._top_matches(user_vectors, size)]
+    
+    def _top_matches(self, user_vectors, top_k):
+        """Tìm top_k cặp (index, similarity) cho mỗi dòng của user_vectors"""
+        if self._shard_pool is not None:
+            return self._sharded_top_matches(user_vectors, top_k)
         
-        # Vectorize câu hỏi của người dùng
-        user_vector = self.vectorizer.transform([processed_user_q])
+        # Như cosine_similarity (chuẩn hóa lại cả hai phía rồi nhân) nhưng ma trận câu hỏi
+        # chỉ được chuẩn hóa lại một lần cho mỗi corpus_version
+        user_vectors = normalize_rows(user_vectors)
+        question_vectors = self._normalized_question_vectors()
+        n_rows = question_vectors.shape[0]
         
-        # Tính cosine similarity với tất cả các câu hỏi trong database
-        similarities = cosine_similarity(user_vector, self.question_vectors).flatten()
+        def score_chunk(start, end):
+            if start == 0 and end == n_rows:
+                return (user_vectors @ question_vectors.T).toarray()
+            return (user_vectors @ question_vectors[start:end].T).toarray()
         
-        # Tìm các câu hỏi có similarity cao nhất
-        top_indices = similarities.argsort()[-top_k:][::-1]
+        # Bằng điểm thì chỉ số lớn trước như argsort()[-top_k:][::-1] trước đây
+        return chunked_top_k(score_chunk, n_rows, top_k, n_queries=user_vectors.shape[0],
+                             chunk_size=self.chunk_size, ties='highest')
+    
+    def _normalized_question_vectors(self):
+        """
+        question_vectors được chuẩn hóa L2 lại như trong cosine_similarity
+        
+        Các dòng đã chuẩn hóa nhưng chuẩn hóa lại vẫn có thể đổi bit cuối; dùng bản
+        này để điểm giống hệt cosine_similarity. Tính lại khi corpus_version đổi.
+        """
+        if self._scoring_vectors is None or self._scoring_vectors[0] != self.corpus_version:
+            self._scoring_vectors = (self.corpus_version, normalize_rows(self.question_vectors))
+        return self._scoring_vectors[1]
+    
+    def start_sharding(self, n_workers=None, n_shards=None, start_method='spawn'):
+        """
+        Chấm điểm answer_many() trên nhiều tiến trình (xem sharding.py)
+        
+        Ma trận TF-IDF được sao chép vào bộ nhớ dùng chung và chia theo dòng cho
+        các worker; mỗi worker trả về top-k của shard mình, kết quả được gộp lại
+        giống hệt khi chấm điểm trong một tiến trình. find_answer() vẫn dùng chỉ
+        mục ngược trong tiến trình hiện tại.
         
+        Args:
+            n_workers: Số tiến trình worker (mặc định: số CPU)
+            n_shards: Số shard (mặc định: bằng n_workers)
+            start_method: Cách tạo tiến trình của multiprocessing
+        """
+        self.stop_sharding()
+        with self._lock:
+            self._shard_pool = ShardPool(n_workers, n_shards, start_method)
+            self._shared_version = None
+    
+    def stop_sharding(self):
+        """Dừng các worker và giải phóng bộ nhớ dùng chung (nếu có)"""
+        with self._lock:
+            if self._shard_pool is not None:
+                self._shard_pool.close()
+                self._shard_pool = None
+    
+    def _sharded_top_matches(self, user_vectors, top_k):
+        """Như _top_matches nhưng mỗi shard được chấm điểm trong một worker"""
+        if self._shared_version != self.corpus_version:
+            # Dữ liệu đã đổi (huấn luyện/thêm/xóa/sửa): chia sẻ lại ma trận cho các worker
+            question_vectors = self._normalized_question_vectors()
+            self._shard_pool.share({'data': question_vectors.data, 'indices': question_vectors.indices,
+                                    'indptr': question_vectors.indptr},
+                                   question_vectors.shape[0], n_columns=question_vectors.shape[1])
+            self._shared_version = self.corpus_version
+        return self._shard_pool.search(sparse_search_task, normalize_rows(user_vectors), top_k, self.chunk_size,
+                                       ties='highest')
+    
+    def _build_results(self, top_matches):
+        """Tạo danh sách kết quả từ các cặp (index, similarity), bỏ các kết quả dưới ngưỡng"""
         results = []
-        for idx in top_indices:
-            similarity_score = similarities[idx]
+        for idx, similarity_score in top_matches:
             if similarity_score >= self.similarity_threshold:
                 results.append({
                     'answer': self.answers[idx],
@@ -139,6 +865,71 @@ class Chatbot:
         
         return results if results else None
     
+    def answer_many(self, user_questions, top_k=1, batch_size=1024):
+        """
+        Tìm câu trả lời cho nhiều câu hỏi cùng lúc
+        
+        Mỗi lô batch_size câu hỏi được vector hóa bằng một lần transform và
+        chấm điểm bằng một phép nhân ma trận duy nhất.
+        
+        Args:
+            user_questions: Danh sách câu hỏi của người dùng
+            top_k: Số lượng câu trả lời tốt nhất cho mỗi câu hỏi
+            batch_size: Số câu hỏi được chấm điểm trong một phép nhân ma trận
+            
+        Returns:
+            List cùng độ dài với user_questions, mỗi phần tử giống kết quả
+            của find_answer() (list kết quả hoặc None)
+        """
+        if not self.is_trained():
+            print("✗ Mô hình chưa được huấn luyện. Vui lòng gọi train() trước.")
+            return None
+        
+        if self.metrics is None:
+            return self._answer_many(user_questions, top_k, batch_size)
+        with request(self.metrics, self.engine_name, 'answer_many'):
+            all_results = self._answer_many(user_questions, top_k, batch_size)
+        for results in all_results:
+            count_answer(self.metrics, self.engine_name, 'answered' if results else 'fallback')
+        return all_results
+    
+    def _answer_many(self, user_questions, top_k, batch_size):
+        """answer_many() khi mô hình đã được huấn luyện"""
+        with stage(self.metrics, self.engine_name, 'preprocess'):
+            processed = preprocess_vietnamese_batch(user_questions)
+        
+        # Chỉ chấm điểm các câu hỏi (đã tiền xử lý, không trùng) chưa có trong bộ nhớ đệm
+        all_results = [None] * len(processed)
+        pending = {}
+        scope = self._cache_scope()
+        for position, text in enumerate(processed):
+            if self.result_cache is not None:
+                cached = self.result_cache.get(scope, ('many', top_k, text))
+                count_cache(self.metrics, self.engine_name, cached is not QueryCache.MISS)
+                if cached is not QueryCache.MISS:
+                    all_results[position] = _copy_results(cached)
+                    continue
+            pending.setdefault(text, []).append(position)
+        
+        texts = list(pending)
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            with self._lock:
+                scope = self._cache_scope()
+                with stage(self.metrics, self.engine_name, 'transform'):
+                    user_vectors = self.query_vectorizer.transform(batch)
+                with stage(self.metrics, self.engine_name, 'similarity'):
+                    all_matches = self._top_matches(user_vectors, top_k)
+                with stage(self.metrics, self.engine_name, 'format'):
+                    batch_results = [self._build_results(top_matches) for top_matches in all_matches]
+            for text, results in zip(batch, batch_results):
+                if self.result_cache is not None:
+                    self.result_cache.put(scope, ('many', top_k, text), _copy_results(results))
+                for position in pending[text]:
+                    all_results[position] = _copy_results(results)
+        
+        return all_results
+    
     def answer(self, user_question, show_details=False):
         """
         Trả lời câu hỏi của người dùng (phương thức chính)
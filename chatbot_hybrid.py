@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chatbot Hỏi-Đáp kết hợp TF-IDF và Semantic Search
+
+TF-IDF (rẻ) chọn ra một danh sách ngắn các câu hỏi ứng viên có chung từ với câu
+hỏi người dùng, sau đó chỉ các ứng viên này được chấm điểm lại bằng embeddings
+của sentence-transformers. Chi phí chấm điểm ngữ nghĩa tỉ lệ với độ dài danh
+sách ngắn thay vì kích thước corpus.
+"""
+
+import numpy as np
+import torch
+from sentence_transformers import util
+
+from chatbot import Chatbot
+from chatbot_pro import ChatbotPro
+from metrics import stage
+
+FUSIONS = ('weighted', 'rrf')
+
+
+class ChatbotHybrid(ChatbotPro):
+    """
+    Chatbot hỏi-đáp: TF-IDF lọc ứng viên + Semantic Search xếp hạng lại
+
+    answer()/answer_many() giống hệt ChatbotPro (cùng các mức độ tin cậy); điểm
+    dùng để xét ngưỡng là cosine similarity ngữ nghĩa của câu hỏi được chọn, còn
+    thứ tự xếp hạng dùng điểm kết hợp (fusion) của hai phương pháp.
+    """
+
+    engine_name = 'hybrid'
+
+    def __init__(self, csv_file='data_converted.csv', model_name='paraphrase-multilingual-MiniLM-L12-v2',
+                 shortlist_size=50, fusion='weighted', semantic_weight=0.7, rrf_k=60,
+                 tfidf_index_path=None, **kwargs):
+        """
+        Khởi tạo ChatbotHybrid
+
+        Args:
+            csv_file: Đường dẫn đến file CSV chứa dữ liệu
+            model_name: Tên mô hình sentence-transformers
+            shortlist_size: Số ứng viên TF-IDF được chấm điểm lại bằng embeddings
+            fusion: Cách kết hợp điểm: 'weighted' (trung bình có trọng số của hai
+                điểm cosine) hoặc 'rrf' (reciprocal rank fusion theo thứ hạng)
+            semantic_weight: Trọng số của điểm ngữ nghĩa khi fusion='weighted' (0-1)
+            rrf_k: Hằng số k của reciprocal rank fusion: 1 / (k + thứ hạng)
+            tfidf_index_path: File chỉ mục TF-IDF (mặc định: <tên file CSV>.tfidf.idx)
+            **kwargs: Các tham số khác của ChatbotPro (cache_dir, index_backend, ngưỡng...)
+        """
+        if fusion not in FUSIONS:
+            raise ValueError(f"Fusion không hợp lệ: {fusion} (chọn một trong {list(FUSIONS)})")
+        super().__init__(csv_file=csv_file, model_name=model_name, **kwargs)
+        self.shortlist_size = shortlist_size
+        self.fusion = fusion
+        self.semantic_weight = semantic_weight
+        self.rrf_k = rrf_k
+        self.tfidf_index_path = tfidf_index_path
+        # Kết quả được lưu ở bộ nhớ đệm của ChatbotHybrid, TF-IDF không cần bộ nhớ đệm riêng
+        self.sparse = Chatbot(csv_file=csv_file, result_cache_size=0, corpus_store=self.corpus_store)
+
+    def initialize(self):
+        """Huấn luyện (hoặc đọc chỉ mục) TF-IDF, khởi tạo mô hình và encode dữ liệu"""
+        if self.initialized:
+            return True
+
+        if not self.sparse.load_or_train(self.tfidf_index_path):
+            return False
+        self.startup.record('tfidf', self.sparse.startup.total())
+        if not super().initialize():
+            return False
+
+        # Hai engine phải đánh chỉ số câu hỏi giống nhau
+        if list(self.sparse.questions) != list(self.questions):
+            print("✗ Dữ liệu TF-IDF và Semantic Search không khớp nhau")
+            self.initialized = False
+            return False
+        return True
+
+    def _cache_scope(self):
+        """Trạng thái mà kết quả truy vấn phụ thuộc vào (gồm cả TF-IDF và tham số fusion)"""
+        return super()._cache_scope() + (self.sparse.corpus_version, self.shortlist_size,
+                                         self.fusion, self.semantic_weight, self.rrf_k)
+
+    def _top_matches(self, query_embeddings, top_k, user_questions=None):
+        """
+        Tìm top_k cặp (index, cosine score ngữ nghĩa) cho mỗi câu hỏi: lấy danh sách
+        ngắn từ TF-IDF, chấm điểm lại bằng embeddings và xếp hạng theo điểm kết hợp
+
+        Câu hỏi không có chung từ nào với corpus (danh sách ngắn rỗng) được tìm
+        trên toàn bộ corpus như ChatbotPro.
+        """
+        if query_embeddings.dim() == 1:
+            query_embeddings = query_embeddings.unsqueeze(0)
+        if user_questions is None:
+            return super()._top_matches(query_embeddings, top_k)
+
+        with stage(self.metrics, self.engine_name, 'shortlist'):
+            shortlists = self.sparse.shortlist(user_questions, max(self.shortlist_size, top_k))
+        results = []
+        for query_embedding, shortlist in zip(query_embeddings, shortlists):
+            if not shortlist:
+                results.append(self.index.search(query_embedding.unsqueeze(0), top_k)[0])
+                continue
+
+            ids = np.array([idx for idx, _ in shortlist], dtype=np.int64)
+            sparse_scores = np.array([score for _, score in shortlist], dtype=np.float64)
+            candidates = self.corpus_embeddings[torch.from_numpy(ids).to(self.corpus_embeddings.device)]
+            # corpus_embeddings có thể là float16 (embedding_dtype float16/int8 + cache float16)
+            candidates = candidates.to(device=query_embedding.device, dtype=query_embedding.dtype)
+            semantic_scores = util.cos_sim(query_embedding, candidates)[0].cpu().numpy()
+
+            fused = self._fuse(sparse_scores, semantic_scores)
+            # Điểm kết hợp giảm dần, bằng điểm thì ưu tiên chỉ số nhỏ
+            order = np.lexsort((ids, -fused))[:top_k]
+            results.append([(int(ids[position]), semantic_scores[position]) for position in order])
+        return results
+
+    def _fuse(self, sparse_scores, semantic_scores):
+        """Điểm kết hợp của các ứng viên (sparse_scores đã theo thứ tự giảm dần)"""
+        if self.fusion == 'weighted':
+            return self.semantic_weight * semantic_scores + (1.0 - self.semantic_weight) * sparse_scores
+
+        # Reciprocal rank fusion: thứ hạng (từ 1) trong từng danh sách
+        sparse_ranks = np.arange(1, len(sparse_scores) + 1)
+        semantic_ranks = np.empty(len(semantic_scores), dtype=np.int64)
+        semantic_ranks[np.argsort(-semantic_scores, kind='stable')] = np.arange(1, len(semantic_scores) + 1)
+        return 1.0 / (self.rrf_k + sparse_ranks) + 1.0 / (self.rrf_k + semantic_ranks)
+
+    def add_pairs(self, pairs):
+        """Thêm các cặp câu hỏi-đáp vào cả hai engine (xem ChatbotPro.add_pairs)"""
+        # Đọc hết một lần: generator chỉ duyệt được một lần nhưng cần cho cả hai engine
+        pairs = list(pairs)
+        with self._lock:
+            indices = super().add_pairs(pairs)
+            if indices:
+                self._check_aligned('add_pairs', indices, self.sparse.add_pairs(pairs))
+            return indices
+
+    def remove_pairs(self, indices):
+        """Xóa các cặp câu hỏi-đáp khỏi cả hai engine (xem ChatbotPro.remove_pairs)"""
+        indices = list(indices)
+        with self._lock:
+            removed = super().remove_pairs(indices)
+            if removed:
+                self._check_aligned('remove_pairs', removed, self.sparse.remove_pairs(indices))
+            return removed
+
+    def update_pair(self, index, question=None, answer=None):
+        """Sửa một cặp câu hỏi-đáp trong cả hai engine (xem ChatbotPro.update_pair)"""
+        with self._lock:
+            updated = super().update_pair(index, question=question, answer=answer)
+            if updated:
+                self._check_aligned('update_pair', updated,
+                                    self.sparse.update_pair(index, question=question, answer=answer))
+            return updated
+
+    def _check_aligned(self, operation, dense_result, sparse_result):
+        """Hai engine phải cho cùng kết quả để các dòng TF-IDF và semantic vẫn khớp nhau"""
+        if sparse_result != dense_result or len(self.sparse.questions) != len(self.questions):
+            raise RuntimeError(f"{operation}: engine TF-IDF và semantic không còn khớp nhau "
+                               f"({sparse_result!r} != {dense_result!r}); cần khởi tạo lại chatbot")
+
+    def compact(self):
+        """Build lại chỉ mục vector và huấn luyện lại TF-IDF"""
+        rebuilt = super().compact()
+        refitted = self.sparse.compact()
+        return rebuilt or refitted
@@ -5,57 +5,170 @@ Chatbot Hỏi-Đáp sử dụng Semantic Search với sentence-transformers
 Sử dụng mô hình đa ngôn ngữ để tìm kiếm câu trả lời dựa trên ngữ nghĩa
 """
 
-import csv
-from sentence_transformers import SentenceTransformer, util
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
 import torch
 
+from corpus_loader import load_corpus, select_rows
+from embedding_cache import EmbeddingCache
+from encode_pipeline import DEFAULT_BATCH_SIZE, CorpusEncoder, load_encoder
+from incremental import BackgroundCompactor, check_indices, clean_pairs
+from metrics import StartupReport, count_answer, count_cache, request, stage, startup_phase
+from query_cache import QueryCache, QueryEmbeddingCache
+from retrieval import DEFAULT_CHUNK_SIZE
+import vector_index
+
+# Cách chạy mô hình khi encode: PyTorch (sentence-transformers) hoặc ONNX Runtime (onnx_encoder.py)
+ENCODER_BACKENDS = ('torch', 'onnx')
+
+# Số câu hỏi ứng viên của mỗi lượt được giữ trong ngữ cảnh hội thoại (answer_stream)
+CONTEXT_CANDIDATES = 5
+
+
+def normalize_query(text):
+    """
+    Khóa bộ nhớ đệm cho câu hỏi của ChatbotPro: chỉ chuẩn hóa khoảng trắng
+    
+    Không bỏ dấu/chữ hoa như preprocess_vietnamese vì mô hình phân biệt
+    "AI là gì" với "ai la gi" (embedding khác nhau).
+    """
+    return ' '.join(text.split())
+
 
 class ChatbotPro:
     """
     Chatbot hỏi-đáp sử dụng Semantic Search với sentence-transformers
     """
     
-    def __init__(self, csv_file='data_converted.csv', model_name='paraphrase-multilingual-MiniLM-L12-v2'):
+    engine_name = 'semantic'
+    
+    def __init__(self, csv_file='data_converted.csv', model_name='paraphrase-multilingual-MiniLM-L12-v2',
+                 cache_dir=None, cache_dtype='float32', chunk_size=DEFAULT_CHUNK_SIZE,
+                 index_backend='exact', index_params=None, index_path=None,
+                 high_threshold=0.75, low_threshold=0.45, result_cache_size=1024, result_cache_ttl=300.0,
+                 embedding_dtype='float32', metrics=None, encoder_backend='torch', encoder_params=None,
+                 query_embedding_bytes=16 * 2**20, query_embedding_path=None, encode_batch_size=DEFAULT_BATCH_SIZE,
+                 encode_workers=1, encode_checkpoint_dir=None, corpus_store=None):
         """
         Khởi tạo ChatbotPro
         
         Args:
             csv_file: Đường dẫn đến file CSV chứa dữ liệu
             model_name: Tên mô hình sentence-transformers
+            cache_dir: Thư mục lưu embeddings trên đĩa (None = không dùng bộ nhớ đệm)
+            cache_dtype: Kiểu lưu embeddings trên đĩa: 'float32' hoặc 'float16'
+            chunk_size: Số câu hỏi mẫu được chấm điểm mỗi khối khi tìm top-k (backend 'exact')
+            index_backend: Chỉ mục vector: 'exact' (duyệt toàn bộ), 'ivf' hoặc 'hnsw' (xấp xỉ),
+                'cluster' (gom cụm câu hỏi diễn đạt lại, chấm điểm tâm cụm trước),
+                'sharded' (duyệt toàn bộ song song trên nhiều tiến trình)
+            index_params: Tham số của chỉ mục (vd. {'n_lists': 256, 'n_probe': 8}), xem vector_index.py
+            index_path: File lưu chỉ mục đã build (None = build lại mỗi lần khởi tạo)
+            high_threshold: Ngưỡng độ tin cậy cao (trả lời trực tiếp)
+            low_threshold: Ngưỡng độ tin cậy thấp (dưới ngưỡng này thì xin lỗi)
+            result_cache_size: Số kết quả truy vấn được giữ trong bộ nhớ đệm (0 = tắt)
+            result_cache_ttl: Thời gian sống (giây) của mỗi kết quả trong bộ nhớ đệm
+            embedding_dtype: Kiểu lưu corpus khi tìm kiếm (backend 'exact'): 'float32',
+                'float16' hoặc 'int8'. Với float16/int8, embeddings float32 được để trên
+                đĩa (memmap) và chỉ đọc lại để chấm điểm lại các ứng viên tốt nhất
+            metrics: metrics.Metrics ghi thời gian từng bước và các counter (None = tắt)
+            encoder_backend: Cách chạy mô hình: 'torch' (sentence-transformers) hoặc 'onnx'
+                (export ra ONNX và chạy bằng onnxruntime, cần pip install onnxruntime)
+            encoder_params: Tham số của OnnxEncoder (vd. {'quantize': True, 'intra_op_threads': 'auto'})
+            query_embedding_bytes: Dung lượng tối đa (byte) của bộ nhớ đệm embedding câu hỏi
+                người dùng (0 = tắt)
+            query_embedding_path: File .npz lưu bộ nhớ đệm embedding câu hỏi giữa các lần
+                khởi động (đọc khi initialize(), ghi bằng save_query_embeddings())
+            encode_batch_size: Số câu mỗi lô khi encode corpus (câu hỏi được sắp xếp theo độ
+                dài, lô câu ngắn lớn hơn) hoặc 'auto' (đo và chọn), xem encode_pipeline.py
+            encode_workers: Số tiến trình encode corpus song song (1 = trong tiến trình hiện tại)
+            encode_checkpoint_dir: Thư mục checkpoint khi encode corpus, để encode bị dừng giữa
+                chừng tiếp tục từ khối đã xong (mặc định: <cache_dir>/.checkpoint nếu có cache_dir)
+            corpus_store: corpus_loader.CorpusStore để dùng chung dữ liệu đã đọc với các engine
+                khác trong tiến trình (None = tự đọc file CSV)
         """
+        if encoder_backend not in ENCODER_BACKENDS:
+            raise ValueError(f"encoder_backend không hợp lệ: {encoder_backend} "
+                             f"(chọn một trong {list(ENCODER_BACKENDS)})")
+        if embedding_dtype not in vector_index.STORAGES:
+            raise ValueError(f"embedding_dtype không hợp lệ: {embedding_dtype} "
+                             f"(chọn một trong {list(vector_index.STORAGES)})")
+        if embedding_dtype != 'float32' and index_backend != 'exact':
+            raise ValueError("embedding_dtype float16/int8 chỉ dùng được với index_backend='exact'")
         self.csv_file = csv_file
+        self.corpus_store = corpus_store
         self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.cache_dtype = cache_dtype
+        self.chunk_size = chunk_size
+        self.index_backend = index_backend
+        self.index_params = index_params
+        self.index_path = index_path
+        self.high_threshold = high_threshold
+        self.low_threshold = low_threshold
+        self.embedding_dtype = embedding_dtype
+        self.encoder_backend = encoder_backend
+        self.encoder_params = encoder_params
+        self.encode_batch_size = encode_batch_size
+        self.encode_workers = encode_workers
+        if encode_checkpoint_dir is None and cache_dir:
+            encode_checkpoint_dir = os.path.join(cache_dir, '.checkpoint')
+        self.encode_checkpoint_dir = encode_checkpoint_dir
+        self.index = None
         self.model = None
         self.questions = []
         self.answers = []
+        # Số dòng đã đọc/bỏ qua của file CSV (corpus_loader.CorpusStats)
+        self.corpus_stats = None
+        # Corpus dùng chung của corpus_store (giữ để store không giải phóng nó khi engine còn dùng)
+        self.corpus = None
         self.corpus_embeddings = None
         self.initialized = False
+        # Tăng mỗi khi dữ liệu thay đổi (khởi tạo, thêm/xóa/sửa câu hỏi)
+        self.corpus_version = 0
+        # Số thay đổi tăng dần chưa được compact() (chỉ mục vector chưa được build lại)
+        self.pending_changes = 0
+        # Vùng nhớ dư phía sau corpus_embeddings để thêm câu hỏi không phải sao chép cả ma trận
+        self._embedding_buffer = None
+        self._lock = threading.RLock()
+        self._compactor = None
+        # Kết quả theo câu hỏi (chuẩn hóa khoảng trắng); tự xóa khi dữ liệu hoặc ngưỡng thay đổi
+        self.result_cache = QueryCache(result_cache_size, result_cache_ttl) if result_cache_size else None
+        # Embedding theo câu hỏi (chuẩn hóa khoảng trắng): không phụ thuộc corpus nên không bị xóa
+        # khi dữ liệu thay đổi; có thể gán cùng một QueryEmbeddingCache cho các engine cùng mô hình
+        self.query_embeddings = QueryEmbeddingCache(query_embedding_bytes) if query_embedding_bytes else None
+        self.query_embedding_path = query_embedding_path
+        self.metrics = metrics
+        # Thời gian các giai đoạn khởi động (load_model, load_data, encode, build_index)
+        self.startup = StartupReport()
     
+    @startup_phase('load_data')
     def load_data(self):
-        """Đọc dữ liệu từ file CSV"""
-        questions = []
-        answers = []
+        """
+        Đọc dữ liệu từ file CSV theo từng khối, câu trả lời để lại trên đĩa (xem corpus_loader.py)
         
+        Với corpus_store, câu hỏi và câu trả lời là bản dùng chung (chỉ đọc) của store;
+        các thao tác sửa dữ liệu luôn tạo list/CsvAnswers mới thay vì sửa tại chỗ.
+        """
+        corpus = None
         try:
-            with open(self.csv_file, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                
-                for row in reader:
-                    question = row['question'].strip()
-                    answer = row['answer'].strip()
-                    
-                    if question and answer:
-                        questions.append(question)
-                        answers.append(answer)
-            
-            self.questions = questions
-            self.answers = answers
-            return True
-            
+            if self.corpus_store is not None:
+                corpus = self.corpus_store.get(self.csv_file)
+                questions, answers, self.corpus_stats = corpus.questions, corpus.answers, corpus.stats
+            else:
+                questions, answers, self.corpus_stats = load_corpus(self.csv_file)
         except FileNotFoundError:
             return False
         except Exception as e:
             return False
+        
+        self.questions = questions
+        self.answers = answers
+        self.corpus = corpus
+        return True
     
     def initialize(self):
         """Khởi tạo mô hình và encode dữ liệu"""
@@ -63,7 +176,7 @@ class ChatbotPro:
             return True
         
         # Load mô hình
-        self.model = SentenceTransformer(self.model_name)
+        self._load_model()
         
         # Load dữ liệu
         if not self.load_data():
@@ -73,15 +186,328 @@ class ChatbotPro:
             return False
         
         # Encode câu hỏi mẫu
-        self.corpus_embeddings = self.model.encode(
-            self.questions,
-            convert_to_tensor=True,
-            show_progress_bar=False
-        )
+        self._encode_corpus()
+        
+        # Xây (hoặc đọc lại) chỉ mục vector
+        self._build_index()
         
+        if self.query_embedding_path and self.query_embeddings is not None and not len(self.query_embeddings):
+            self.query_embeddings.load(self.query_embedding_path)
+        
+        self.corpus_version += 1
         self.initialized = True
         return True
     
+    @property
+    def encoder_id(self):
+        """Mô hình + cách chạy: embeddings của các bộ encode khác nhau không được dùng lẫn"""
+        if self.encoder_backend == 'torch':
+            return self.model_name
+        quantized = (self.encoder_params or {}).get('quantize', False)
+        return f"{self.model_name}@onnx{'-int8' if quantized else ''}"
+    
+    @startup_phase('load_model')
+    def _load_model(self):
+        """Tải mô hình sentence-transformers hoặc bản ONNX của nó (bỏ qua nếu đã được gán, vd. bởi EngineRegistry)"""
+        if self.model is not None:
+            return
+        self.model = load_encoder(self.model_name, self.encoder_backend, self.encoder_params)
+    
+    @startup_phase('encode')
+    def _encode_corpus(self):
+        """Tạo corpus_embeddings: từ bộ nhớ đệm trên đĩa hoặc encode toàn bộ câu hỏi"""
+        if self.cache_dir:
+            self.corpus_embeddings = self._load_cached_embeddings()
+        else:
+            self.corpus_embeddings = torch.from_numpy(self._encode_batches(self.questions))
+        
+        if self.embedding_dtype != 'float32' and not self.cache_dir:
+            # Chỉ giữ bản lượng tử hóa trong RAM, bản float32 nằm trong file tạm
+            self.corpus_embeddings = self._spill_embeddings(self.corpus_embeddings)
+    
+    def _load_cached_embeddings(self):
+        """Lấy embeddings từ bộ nhớ đệm trên đĩa, chỉ encode các câu hỏi mới hoặc đã sửa"""
+        cache = EmbeddingCache(self.cache_dir, self.encoder_id, dtype=self.cache_dtype)
+        embeddings, _ = cache.get_embeddings(self.questions, self._encode_batches)
+        if embeddings.dtype != 'float32' and self.embedding_dtype == 'float32':
+            # Query embedding là float32, cos_sim cần cùng kiểu dữ liệu
+            # (với float16/int8, chỉ mục tự chuyển kiểu các dòng cần chấm điểm lại)
+            embeddings = embeddings.astype('float32')
+        return torch.from_numpy(embeddings)
+    
+    def _encode_batches(self, questions):
+        """
+        Encode câu hỏi của corpus theo lô (sắp xếp theo độ dài, song song, có checkpoint)
+        
+        Returns:
+            np.ndarray float32 (len(questions), dim)
+        """
+        encoder = CorpusEncoder(self.model, self.encoder_id, batch_size=self.encode_batch_size,
+                                workers=self.encode_workers, checkpoint_dir=self.encode_checkpoint_dir,
+                                worker_model=(self.model_name, self.encoder_backend, self.encoder_params))
+        embeddings = encoder.encode(questions)
+        if self.encode_batch_size == 'auto' and encoder.batch_size != 'auto':
+            # Giữ số câu mỗi lô đã chọn cho các lần encode sau
+            self.encode_batch_size = encoder.batch_size
+        if encoder.last_run['resumed_rows']:
+            print(f"✓ Tiếp tục encode từ checkpoint: {encoder.last_run['resumed_rows']}/{len(questions)} "
+                  f"câu hỏi đã có sẵn")
+        return embeddings
+    
+    @staticmethod
+    def _spill_embeddings(embeddings):
+        """Ghi embeddings ra file tạm (tự xóa) và trả về tensor memory-map của file đó"""
+        array = embeddings.detach().cpu().numpy()
+        with tempfile.TemporaryFile() as file:
+            file.write(array.tobytes())
+            file.flush()
+            # Vùng map vẫn hợp lệ sau khi file được đóng
+            mapped = np.memmap(file, dtype=array.dtype, mode='c', shape=array.shape)
+        return torch.from_numpy(mapped)
+    
+    def corpus_fingerprint(self):
+        """Dấu vân tay của mô hình + danh sách câu hỏi (dùng để kiểm tra chỉ mục đã lưu)"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.encoder_id.encode('utf-8'))
+        for question in self.questions:
+            digest.update(b'\x00')
+            digest.update(question.encode('utf-8'))
+        return digest.hexdigest()
+    
+    @startup_phase('build_index')
+    def _build_index(self):
+        """Tạo chỉ mục vector trên corpus_embeddings, dùng lại file đã lưu nếu còn khớp"""
+        vectors = self.corpus_embeddings.detach().cpu().numpy()
+        
+        self.index = self._create_index()
+        if self.index_path and os.path.exists(self.index_path):
+            # Chỉ dùng lại file có cùng backend và tham số build; tham số tìm kiếm theo index_params
+            loaded = vector_index.load_index(self.index_path, vectors, self.corpus_fingerprint(), index=self.index)
+            if loaded is not None and getattr(loaded, 'storage', 'float32') == self.embedding_dtype:
+                return
+        
+        self.index.build(vectors)
+        
+        if self.index_path:
+            try:
+                vector_index.save_index(self.index, self.index_path, self.corpus_fingerprint())
+            except OSError as e:
+                print(f"✗ Không lưu được chỉ mục vector: {e}")
+    
+    def save_query_embeddings(self):
+        """
+        Ghi bộ nhớ đệm embedding câu hỏi ra query_embedding_path
+        
+        Returns:
+            True nếu ghi thành công
+        """
+        if not self.query_embedding_path or self.query_embeddings is None:
+            return False
+        return self.query_embeddings.save(self.query_embedding_path)
+    
+    def _encode_queries(self, texts):
+        """
+        Encode câu hỏi người dùng (đã chuẩn hóa khoảng trắng), dùng bộ nhớ đệm embedding nếu bật
+        
+        Tokenizer của mô hình vốn bỏ qua khoảng trắng thừa, nên embedding của câu đã
+        chuẩn hóa giống câu gốc và các cách gõ chỉ khác khoảng trắng dùng chung một mục.
+        
+        Returns:
+            Tensor float32 (len(texts), dim)
+        """
+        with stage(self.metrics, self.engine_name, 'encode'):
+            if self.query_embeddings is None:
+                return self.model.encode(texts, convert_to_tensor=True, show_progress_bar=False)
+            embeddings = self.query_embeddings.get_or_encode(
+                self.encoder_id, texts,
+                lambda missing: self.model.encode(missing, convert_to_numpy=True, show_progress_bar=False)
+            )
+            return torch.from_numpy(embeddings)
+    
+    def _encode_questions(self, questions):
+        """Encode câu hỏi mới cùng kiểu dữ liệu và thiết bị với corpus_embeddings"""
+        embeddings = self.model.encode(questions, convert_to_tensor=True, show_progress_bar=False)
+        return embeddings.to(device=self.corpus_embeddings.device, dtype=self.corpus_embeddings.dtype)
+    
+    def add_pairs(self, pairs):
+        """
+        Thêm các cặp câu hỏi-đáp: chỉ encode các câu hỏi mới và ghi vào cuối corpus_embeddings
+        
+        Args:
+            pairs: Danh sách cặp (question, answer)
+            
+        Returns:
+            List chỉ số của các câu hỏi mới, hoặc None nếu chưa khởi tạo
+        """
+        if not self.initialized:
+            return None
+        
+        pairs = clean_pairs(pairs)
+        if not pairs:
+            return []
+        embeddings = self._encode_questions([question for question, _ in pairs])
+        
+        with self._lock:
+            start = len(self.questions)
+            end = start + len(pairs)
+            buffer = self._writable_embeddings(end)
+            buffer[start:end] = embeddings
+            
+            self.corpus_embeddings = buffer[:end]
+            self.questions = list(self.questions) + [question for question, _ in pairs]
+            self.answers = self.answers + [answer for _, answer in pairs]
+            self.index.add(self.corpus_embeddings.detach().cpu().numpy(), len(pairs))
+            self._mark_changed(len(pairs))
+        return list(range(start, end))
+    
+    def remove_pairs(self, indices):
+        """
+        Xóa các cặp câu hỏi-đáp theo chỉ số (các câu hỏi phía sau bị dịch chỉ số)
+        
+        Args:
+            indices: Danh sách chỉ số cần xóa
+            
+        Returns:
+            Số cặp đã xóa, hoặc None nếu chưa khởi tạo
+        """
+        if not self.initialized:
+            return None
+        
+        with self._lock:
+            removed = check_indices(indices, len(self.questions))
+            if len(removed) == 0:
+                return 0
+            keep = torch.ones(len(self.questions), dtype=torch.bool)
+            keep[torch.from_numpy(removed)] = False
+            
+            self.corpus_embeddings = self.corpus_embeddings[keep.to(self.corpus_embeddings.device)]
+            self._embedding_buffer = None
+            self.questions = [q for q, kept in zip(self.questions, keep.tolist()) if kept]
+            self.answers = select_rows(self.answers, keep.numpy())
+            self.index.remove(self.corpus_embeddings.detach().cpu().numpy(), removed)
+            self._mark_changed(len(removed))
+        return len(removed)
+    
+    def update_pair(self, index, question=None, answer=None):
+        """
+        Sửa một cặp câu hỏi-đáp tại chỗ (giữ nguyên chỉ số); chỉ encode lại câu hỏi nếu nó đổi
+        
+        Args:
+            index: Chỉ số cặp cần sửa
+            question: Câu hỏi mới (None = giữ nguyên)
+            answer: Câu trả lời mới (None = giữ nguyên)
+            
+        Returns:
+            True nếu đã sửa
+        """
+        if not self.initialized:
+            return False
+        
+        question = question.strip() if question is not None else None
+        answer = answer.strip() if answer is not None else None
+        if question == '' or answer == '':
+            return False
+        embedding = self._encode_questions([question]) if question is not None else None
+        
+        with self._lock:
+            index = int(check_indices([index], len(self.questions))[0])
+            questions = list(self.questions)
+            answers = self.answers.copy()
+            if question is not None:
+                n = len(self.questions)
+                buffer = self._writable_embeddings(n)
+                buffer[index] = embedding[0]
+                self.corpus_embeddings = buffer[:n]
+                questions[index] = question
+                self.index.replace(self.corpus_embeddings.detach().cpu().numpy(), [index])
+            if answer is not None:
+                answers[index] = answer
+            self.questions = questions
+            self.answers = answers
+            self._mark_changed(1 if question is not None else 0)
+        return True
+    
+    def _writable_embeddings(self, n_rows):
+        """
+        Vùng nhớ riêng chứa corpus_embeddings ở đầu và đủ chỗ cho n_rows dòng
+        
+        Lần đầu (hoặc khi hết chỗ) corpus được sao chép sang vùng nhớ mới dư 50%,
+        vì corpus_embeddings có thể là memmap của bộ nhớ đệm trên đĩa; các lần
+        thêm/sửa sau chỉ ghi vào đúng các dòng thay đổi.
+        """
+        n = len(self.corpus_embeddings)
+        buffer = self._embedding_buffer
+        if buffer is None or len(buffer) < n_rows or buffer.data_ptr() != self.corpus_embeddings.data_ptr():
+            buffer = self.corpus_embeddings.new_empty((max(n_rows, n + n // 2), self.corpus_embeddings.shape[1]))
+            buffer[:n] = self.corpus_embeddings
+            self._embedding_buffer = buffer
+        return buffer
+    
+    def _mark_changed(self, n_changes):
+        """Đánh dấu dữ liệu đã thay đổi (n_changes câu hỏi chưa được đưa vào chỉ mục build lại)"""
+        self.corpus_version += 1
+        self.pending_changes += n_changes
+    
+    def compact(self):
+        """
+        Build lại chỉ mục vector trên corpus hiện tại (vd. huấn luyện lại các cụm ivf/cluster)
+        
+        Việc build chạy ngoài lock; chỉ mục mới chỉ được thay vào nếu dữ liệu
+        không bị sửa trong lúc build.
+        
+        Returns:
+            True nếu chỉ mục mới đã được thay vào
+        """
+        if not self.initialized:
+            return False
+        
+        with self._lock:
+            if self.index_backend in ('exact', 'sharded'):
+                # Cập nhật tăng dần của chỉ mục chính xác đã đúng hoàn toàn, không cần build lại
+                self.pending_changes = 0
+                return False
+            version = self.corpus_version
+            pending = self.pending_changes
+            vectors = self.corpus_embeddings.detach().cpu().numpy()
+        
+        index = self._create_index()
+        index.build(vectors)
+        
+        with self._lock:
+            if self.corpus_version != version:
+                return False
+            self.index = index
+            self.corpus_version += 1
+            self.pending_changes -= pending
+        return True
+    
+    def start_compaction(self, interval=300.0, min_changes=1):
+        """
+        Chạy compact() định kỳ trong thread nền khi có thay đổi đang chờ
+        
+        Args:
+            interval: Số giây giữa hai lần kiểm tra
+            min_changes: Số thay đổi tối thiểu để chạy compaction
+        """
+        self.stop_compaction()
+        self._compactor = BackgroundCompactor(self, interval, min_changes)
+        self._compactor.start()
+    
+    def stop_compaction(self):
+        """Dừng thread compaction nền (nếu có)"""
+        if self._compactor is not None:
+            self._compactor.stop()
+            self._compactor = None
+    
+    def _create_index(self):
+        """Tạo chỉ mục vector (chưa build) theo index_backend và index_params"""
+        params = dict(self.index_params or {})
+        if self.index_backend in ('exact', 'sharded'):
+            params.setdefault('chunk_size', self.chunk_size)
+        if self.index_backend == 'exact':
+            params.setdefault('storage', self.embedding_dtype)
+        return vector_index.create_index(self.index_backend, **params)
+    
     def answer(self, user_question):
         """
         Trả lời câu hỏi của người dùng
@@ -95,32 +521,267 @@ class ChatbotPro:
         if not self.initialized:
             return "Chatbot chưa được khởi tạo", 0.0, ""
         
+        if self.metrics is None:
+            return self._answer(user_question)
+        with request(self.metrics, self.engine_name, 'answer'):
+            result = self._answer(user_question)
+        count_answer(self.metrics, self.engine_name, self.confidence_tier(result[1]))
+        return result
+    
+    def _answer(self, user_question):
+        """answer() khi chatbot đã được khởi tạo"""
+        text = normalize_query(user_question)
+        cache_key = ('answer', text)
+        if self.result_cache is not None:
+            cached = self.result_cache.get(self._cache_scope(), cache_key)
+            count_cache(self.metrics, self.engine_name, cached is not QueryCache.MISS)
+            if cached is not QueryCache.MISS:
+                return cached
+        
         # Encode câu hỏi người dùng
-        query_embedding = self.model.encode(user_question, convert_to_tensor=True)
+        query_embedding = self._encode_queries([text])[0]
+        
+        with self._lock:
+            scope = self._cache_scope()
+            # Tính cosine similarity theo từng khối và tìm câu hỏi tốt nhất
+            with stage(self.metrics, self.engine_name, 'similarity'):
+                best_idx, best_score = self._best_match(self._top_matches(query_embedding, 1, [user_question])[0])
+            
+            with stage(self.metrics, self.engine_name, 'format'):
+                result = self._format_answer(best_idx, float(best_score))
+        
+        if self.result_cache is not None:
+            self.result_cache.put(scope, cache_key, result)
+        return result
+    
+    def answer_stream(self, user_question, context=None):
+        """
+        Trả lời câu hỏi dạng luồng (generator) để giao diện hiển thị ngay khi có kết quả
         
-        # Tính cosine similarity
-        cosine_scores = util.cos_sim(query_embedding, self.corpus_embeddings)[0]
+        Câu trả lời khớp nhất được yield trước, mức độ tin cậy sau; nối các phần lại
+        được đúng answer_text của answer(). Nếu có context và lượt trước ở mức trung
+        bình ("Có phải ý bạn là..."), câu hỏi này được xếp hạng lại theo cả embedding
+        của lượt trước (lấy từ context, không encode lại), xem _rerank_with_context.
         
-        # Tìm câu hỏi tốt nhất
-        best_idx = cosine_scores.argmax().item()
-        best_score = float(cosine_scores[best_idx])
+        Args:
+            user_question: Câu hỏi của người dùng
+            context: query_cache.ConversationContext của phiên chat (None = không dùng ngữ cảnh)
+            
+        Yields:
+            Các phần (str) của câu trả lời
+            
+        Returns:
+            Tuple (answer_text, confidence_score, matched_question) như answer(), là giá trị
+            của generator (nhận được qua yield from)
+        """
+        if not self.initialized:
+            yield "Chatbot chưa được khởi tạo"
+            return "Chatbot chưa được khởi tạo", 0.0, ""
         
+        with request(self.metrics, self.engine_name, 'answer_stream'):
+            best_idx, best_score, questions, answers = self._match_in_context(user_question, context)
+        tier = self.confidence_tier(best_score)
+        count_answer(self.metrics, self.engine_name, tier)
+        
+        # Đọc và định dạng câu trả lời ngoài lock, trên bản chụp questions/answers lúc chọn
+        chunks = []
+        for chunk in self._answer_chunks(best_idx, best_score, questions, answers):
+            chunks.append(chunk)
+            yield chunk
+        return ''.join(chunks), best_score, questions[best_idx] if tier != 'fallback' else ""
+    
+    def _match_in_context(self, user_question, context):
+        """
+        Câu hỏi khớp nhất cho answer_stream(), có xét ngữ cảnh hội thoại, và ghi lượt này vào context
+        
+        Returns:
+            Tuple (best_idx, best_score, questions, answers): questions/answers là các
+            danh sách lúc chọn (không bị thay đổi bởi add_pairs/update_pair sau đó)
+        """
+        text = normalize_query(user_question)
+        n_candidates = CONTEXT_CANDIDATES if context is not None else 1
+        cache_key = ('matches', n_candidates, text)
+        query_embedding = self._encode_queries([text])[0]
+        
+        with self._lock:
+            scope = self._cache_scope()
+            matches = QueryCache.MISS
+            if self.result_cache is not None:
+                matches = self.result_cache.get(scope, cache_key)
+                count_cache(self.metrics, self.engine_name, matches is not QueryCache.MISS)
+            if matches is QueryCache.MISS:
+                with stage(self.metrics, self.engine_name, 'similarity'):
+                    matches = tuple(self._top_matches(query_embedding, n_candidates, [user_question])[0])
+                if self.result_cache is not None:
+                    self.result_cache.put(scope, cache_key, matches)
+            
+            best_idx, best_score = self._best_match(matches)
+            if context is None:
+                return best_idx, float(best_score), self.questions, self.answers
+            
+            embedding = query_embedding.detach().cpu().numpy().astype(np.float32)
+            embedding /= max(float(np.linalg.norm(embedding)), 1e-12)
+            previous = context.clarifying(scope)
+            if previous is not None and matches and self.confidence_tier(best_score) != 'high':
+                with stage(self.metrics, self.engine_name, 'context'):
+                    best_idx, best_score, embedding = self._rerank_with_context(
+                        embedding, matches, previous, context.weight)
+            context.add(scope, embedding, [idx for idx, _ in matches], self.confidence_tier(best_score))
+            return best_idx, float(best_score), self.questions, self.answers
+    
+    def _rerank_with_context(self, embedding, matches, previous, weight):
+        """
+        Xếp hạng lại câu nói rõ ý theo lượt trước (gọi khi đang giữ lock)
+        
+        Các ứng viên của câu hỏi mới và của lượt trước được chấm điểm bằng cosine với
+        query ngữ cảnh = chuẩn hóa(embedding + weight * embedding lượt trước). Kết quả
+        theo ngữ cảnh chỉ được dùng khi điểm cao hơn điểm của câu hỏi mới đứng một mình.
+        Điểm trả về (quyết định mức độ tin cậy và được hiển thị) luôn là cosine của câu
+        hỏi được chọn với câu hỏi mới, không phải điểm theo query ngữ cảnh.
+        
+        Args:
+            embedding: Embedding đã chuẩn hóa của câu hỏi mới
+            matches: Các cặp (index, score) tốt nhất của câu hỏi mới
+            previous: query_cache.ContextTurn của lượt trước
+            weight: Trọng số của embedding lượt trước
+            
+        Returns:
+            Tuple (best_idx, best_score, embedding đã dùng để chọn)
+        """
+        combined = embedding + weight * previous.embedding
+        combined /= max(float(np.linalg.norm(combined)), 1e-12)
+        # np.unique sắp theo chỉ số: bằng điểm thì ưu tiên chỉ số nhỏ như khi tìm kiếm
+        ids = np.unique(np.concatenate([np.array([idx for idx, _ in matches], dtype=np.int64),
+                                        previous.candidates]))
+        rows = self.corpus_embeddings[torch.from_numpy(ids)].detach().cpu().numpy().astype(np.float32)
+        norms = np.maximum(np.linalg.norm(rows, axis=1), 1e-12)
+        scores = (rows @ combined) / norms
+        best = int(np.argmax(scores))
+        if scores[best] > matches[0][1]:
+            return int(ids[best]), float((rows[best] @ embedding) / norms[best]), combined
+        return matches[0][0], float(matches[0][1]), embedding
+    
+    def _best_match(self, matches):
+        """Cặp (index, score) đầu tiên của matches; (-1, 0.0) (mức xin lỗi) nếu không có ứng viên nào"""
+        if not matches:
+            return -1, 0.0
+        return matches[0]
+    
+    def _cache_scope(self):
+        """Trạng thái mà kết quả truy vấn phụ thuộc vào (khóa phạm vi của result_cache)"""
+        return (self.engine_name, self.encoder_id, self.corpus_version, self.high_threshold, self.low_threshold)
+    
+    def _top_matches(self, query_embeddings, top_k, user_questions=None):
+        """
+        Tìm top_k cặp (index, score) cho mỗi query embedding qua chỉ mục vector
+        
+        user_questions (câu hỏi gốc tương ứng) không dùng ở đây, dành cho các lớp con
+        cần cả văn bản (xem chatbot_hybrid.py)
+        """
+        if query_embeddings.dim() == 1:
+            query_embeddings = query_embeddings.unsqueeze(0)
+        return self.index.search(query_embeddings, top_k)
+    
+    def answer_many(self, user_questions, top_k=1, batch_size=256):
+        """
+        Trả lời nhiều câu hỏi cùng lúc
+        
+        Mỗi lô batch_size câu hỏi được encode bằng một lần gọi model.encode
+        và chấm điểm bằng một phép nhân ma trận duy nhất.
+        
+        Args:
+            user_questions: Danh sách câu hỏi của người dùng
+            top_k: Số lượng kết quả tốt nhất cho mỗi câu hỏi
+            batch_size: Số câu hỏi được encode và chấm điểm mỗi lô
+            
+        Returns:
+            List cùng độ dài với user_questions, mỗi phần tử là list top_k tuple
+            (answer_text, confidence_score, matched_question) như answer()
+        """
+        if not self.initialized:
+            return [[("Chatbot chưa được khởi tạo", 0.0, "")] for _ in user_questions]
+        
+        if self.metrics is None:
+            return self._answer_many(user_questions, top_k, batch_size)
+        with request(self.metrics, self.engine_name, 'answer_many'):
+            all_results = self._answer_many(user_questions, top_k, batch_size)
+        for results in all_results:
+            count_answer(self.metrics, self.engine_name,
+                         self.confidence_tier(results[0][1]) if results else 'fallback')
+        return all_results
+    
+    def _answer_many(self, user_questions, top_k, batch_size):
+        """answer_many() khi chatbot đã được khởi tạo"""
+        # Chỉ encode các câu hỏi (không trùng) chưa có trong bộ nhớ đệm
+        all_results = [None] * len(user_questions)
+        pending = {}
+        scope = self._cache_scope()
+        for position, question in enumerate(user_questions):
+            text = normalize_query(question)
+            if self.result_cache is not None:
+                cached = self.result_cache.get(scope, ('many', top_k, text))
+                count_cache(self.metrics, self.engine_name, cached is not QueryCache.MISS)
+                if cached is not QueryCache.MISS:
+                    all_results[position] = list(cached)
+                    continue
+            pending.setdefault(text, []).append(position)
+        
+        texts = list(pending)
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            # Câu hỏi gốc (lần xuất hiện đầu tiên) cho các lớp con cần văn bản (TF-IDF của hybrid)
+            originals = [user_questions[pending[text][0]] for text in batch]
+            query_embeddings = self._encode_queries(batch)
+            with self._lock:
+                scope = self._cache_scope()
+                with stage(self.metrics, self.engine_name, 'similarity'):
+                    all_matches = self._top_matches(query_embeddings, top_k, originals)
+                with stage(self.metrics, self.engine_name, 'format'):
+                    batch_results = [[self._format_answer(idx, float(score)) for idx, score in top_matches]
+                                     for top_matches in all_matches]
+            for text, results in zip(batch, batch_results):
+                if self.result_cache is not None:
+                    self.result_cache.put(scope, ('many', top_k, text), tuple(results))
+                for position in pending[text]:
+                    all_results[position] = list(results)
+        
+        return all_results
+    
+    def confidence_tier(self, score):
+        """Mức độ tin cậy của điểm score: 'high', 'medium' hoặc 'fallback' (xin lỗi)"""
+        if score >= self.high_threshold:
+            return 'high'
+        if score > self.low_threshold:
+            return 'medium'
+        return 'fallback'
+    
+    def _format_answer(self, best_idx, best_score):
+        """Tạo câu trả lời theo mức độ tin cậy của câu hỏi khớp nhất"""
+        answer_text = ''.join(self._answer_chunks(best_idx, best_score, self.questions, self.answers))
+        if self.confidence_tier(best_score) == 'fallback':
+            return answer_text, best_score, ""
+        return answer_text, best_score, self.questions[best_idx]
+    
+    def _answer_chunks(self, best_idx, best_score, questions, answers):
+        """Các phần của câu trả lời theo thứ tự hiển thị: nội dung trước, mức độ tin cậy sau"""
         # Logic trả lời dựa trên độ tin cậy
-        if best_score >= 0.75:
+        tier = self.confidence_tier(best_score)
+        if tier == 'high':
             # Độ tin cậy cao: Trả lời trực tiếp
             confidence_percent = best_score * 100
-            answer_text = f"{self.answers[best_idx]}\n\n*(Độ tin cậy: {confidence_percent:.1f}%)*"
-            return answer_text, best_score, self.questions[best_idx]
+            yield answers[best_idx]
+            yield f"\n\n*(Độ tin cậy: {confidence_percent:.1f}%)*"
             
-        elif best_score > 0.45:
+        elif tier == 'medium':
             # Độ tin cậy trung bình: Hỏi lại kèm câu trả lời
-            answer_text = f"Có phải ý bạn là: **\"{self.questions[best_idx]}\"**?\n\n**Trả lời:** {self.answers[best_idx]}\n\n*(Độ tương đồng: {best_score:.2f})*"
-            return answer_text, best_score, self.questions[best_idx]
+            yield f"Có phải ý bạn là: **\"{questions[best_idx]}\"**?\n\n**Trả lời:** "
+            yield answers[best_idx]
+            yield f"\n\n*(Độ tương đồng: {best_score:.2f})*"
             
         else:
             # Độ tin cậy thấp: Xin lỗi
-            answer_text = f"Xin lỗi, tôi chưa hiểu ý bạn, vui lòng diễn đạt lại.\n\n*(Độ tương đồng tốt nhất: {best_score:.2f})*"
-            return answer_text, best_score, ""
+            yield "Xin lỗi, tôi chưa hiểu ý bạn, vui lòng diễn đạt lại."
+            yield f"\n\n*(Độ tương đồng tốt nhất: {best_score:.2f})*"
 
 
 def load_data(csv_file='data_converted.csv'):
@@ -132,25 +793,13 @@ def load_data(csv_file='data_converted.csv'):
         
     Returns:
         questions: Danh sách câu hỏi mẫu
-        answers: Danh sách câu trả lời tương ứng
+        answers: Câu trả lời tương ứng (corpus_loader.CsvAnswers, đọc từ file khi cần)
     """
-    questions = []
-    answers = []
-    
     try:
-        with open(csv_file, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            
-            for row in reader:
-                question = row['question'].strip()
-                answer = row['answer'].strip()
-                
-                # Chỉ thêm các cặp câu hỏi-đáp hợp lệ
-                if question and answer:
-                    questions.append(question)
-                    answers.append(answer)
-        
+        questions, answers, stats = load_corpus(csv_file)
         print(f"✓ Đã tải {len(questions)} cặp câu hỏi-đáp từ {csv_file}")
+        if stats.skipped:
+            print(f"  {stats}")
         return questions, answers
         
     except FileNotFoundError:
@@ -174,6 +823,7 @@ def main():
     # Sử dụng mô hình đa ngôn ngữ hỗ trợ tiếng Việt
     model_name = 'paraphrase-multilingual-MiniLM-L12-v2'
     print(f"Đang tải mô hình: {model_name}")
+    from sentence_transformers import SentenceTransformer, util
     model = SentenceTransformer(model_name)
     print("✓ Mô hình đã được tải thành công!\n")
     
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Đọc file CSV câu hỏi-đáp theo từng khối (streaming) cho các chatbot
+
+File CSV được đọc tuần tự từng khối chunk_rows dòng: dòng thiếu cột hoặc có câu
+hỏi/câu trả lời rỗng bị bỏ qua, câu hỏi trùng với câu hỏi đã đọc bị loại (giữ
+lần xuất hiện đầu tiên). Mỗi khối được chuyển ngay cho engine (tiền xử lý,
+encode...) nên bộ nhớ tạm chỉ tỉ lệ với kích thước khối.
+
+Câu trả lời không được giữ trong RAM: CsvAnswers chỉ lưu vị trí (byte) của từng
+dòng trong file và đọc lại câu trả lời khi cần, tương tự TextColumn của
+tfidf_index.py với file chỉ mục. File bị ghi đè tại chỗ sau khi đọc thì việc đọc
+câu trả lời báo CorpusChangedError thay vì trả về nhầm câu trả lời.
+
+CorpusStore giữ một bản Corpus (chỉ đọc) cho mỗi file CSV để các engine trong
+cùng tiến trình (xem engines.EngineRegistry) dùng chung thay vì mỗi engine đọc
+lại file vào list riêng.
+"""
+
+import csv
+import hashlib
+import io
+import os
+import sys
+import threading
+import weakref
+from array import array
+
+import numpy as np
+
+
+REQUIRED_COLUMNS = ('question', 'answer')
+
+# Tăng khi quy tắc chọn dòng thay đổi để các chỉ mục đã lưu bị huấn luyện lại
+# (phiên bản 1: bỏ dòng thiếu cột/rỗng, loại câu hỏi trùng)
+LOADER_VERSION = 1
+
+# Số dòng mỗi khối khi đọc file CSV
+DEFAULT_CHUNK_ROWS = 10000
+
+
+class CorpusChangedError(RuntimeError):
+    """File CSV bị sửa tại chỗ sau khi đọc: vị trí byte của các câu trả lời không còn đúng"""
+
+
+class CorpusStats:
+    """
+    Số dòng đã đọc/bỏ qua khi đọc một file CSV
+    """
+
+    __slots__ = ('rows', 'loaded', 'empty', 'malformed', 'duplicates')
+
+    def __init__(self):
+        self.rows = 0
+        self.loaded = 0
+        self.empty = 0
+        self.malformed = 0
+        self.duplicates = 0
+
+    @property
+    def skipped(self):
+        """Số dòng bị bỏ qua"""
+        return self.rows - self.loaded
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self):
+        return (f"bỏ qua {self.skipped} dòng: {self.empty} rỗng, {self.malformed} sai định dạng, "
+                f"{self.duplicates} câu hỏi trùng")
+
+
+class _ByteLines:
+    """Đọc file nhị phân theo dòng (giải mã UTF-8) và ghi nhớ số byte đã đọc"""
+
+    def __init__(self, file):
+        self.file = file
+        self.position = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.file.readline()
+        if not line:
+            raise StopIteration
+        self.position += len(line)
+        return line.decode('utf-8')
+
+
+class _RecordReader:
+    """Đọc lại một dòng CSV theo vị trí byte (dùng chung giữa các bản sao của CsvAnswers)"""
+
+    def __init__(self, csv_file):
+        # Giữ file mở: file bị thay thế (ghi file mới rồi đổi tên) vẫn đọc được bản đã nạp
+        self.csv_file = csv_file
+        self.file = open(csv_file, 'rb')
+        # File bị ghi đè tại chỗ (cùng inode) thì kích thước/thời điểm sửa thay đổi
+        self.signature = self._signature()
+        header = next(csv.reader(_ByteLines(self.file)), [])
+        self.column = header.index('answer') if 'answer' in header else None
+        self._lock = threading.Lock()
+
+    def _signature(self):
+        stat = os.fstat(self.file.fileno())
+        return stat.st_size, stat.st_mtime_ns
+
+    def read(self, start, end):
+        with self._lock:
+            if self._signature() != self.signature:
+                raise CorpusChangedError(f"File {self.csv_file} đã bị sửa sau khi đọc; cần đọc lại dữ liệu")
+            self.file.seek(start)
+            record = self.file.read(end - start)
+        row = next(csv.reader(io.StringIO(record.decode('utf-8'), newline='')))
+        return row[self.column].strip()
+
+
+class CsvAnswers:
+    """
+    Danh sách câu trả lời đọc theo yêu cầu từ file CSV (chỉ giữ vị trí byte của mỗi dòng)
+
+    Câu trả lời được thêm/sửa sau khi đọc (add_pairs, update_pair) được giữ trong
+    bộ nhớ; các phần còn lại vẫn nằm trên đĩa. Đọc một câu trả lời trên đĩa báo
+    CorpusChangedError nếu file CSV đã bị ghi đè tại chỗ (kích thước hoặc thời
+    điểm sửa khác lúc đọc); file được thay bằng cách đổi tên vẫn đọc được bản cũ.
+    """
+
+    __slots__ = ('_reader', '_starts', '_ends', '_texts')
+
+    def __init__(self, reader, starts, ends, texts=None):
+        """
+        Args:
+            reader: _RecordReader của file CSV
+            starts, ends: Vị trí byte đầu/cuối của dòng chứa mỗi câu trả lời; start = -1
+                nghĩa là câu trả lời nằm trong bộ nhớ ở texts[end]
+            texts: Các câu trả lời trong bộ nhớ
+        """
+        self._reader = reader
+        self._starts = starts
+        self._ends = ends
+        self._texts = texts if texts is not None else []
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('CsvAnswers index out of range')
+        start, end = int(self._starts[idx]), int(self._ends[idx])
+        if start < 0:
+            return self._texts[end]
+        return self._reader.read(start, end)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __setitem__(self, idx, text):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('CsvAnswers index out of range')
+        self._starts[idx] = -1
+        self._ends[idx] = len(self._texts)
+        self._texts.append(text)
+
+    def __add__(self, texts):
+        answers = self.copy()
+        answers.extend(texts)
+        return answers
+
+    def extend(self, texts):
+        texts = list(texts)
+        self._starts = np.concatenate([self._starts, np.full(len(texts), -1, dtype=np.int64)])
+        self._ends = np.concatenate([self._ends, np.arange(len(self._texts), len(self._texts) + len(texts),
+                                                           dtype=np.int64)])
+        self._texts.extend(texts)
+
+    def copy(self):
+        """Bản sao (sửa bản sao không ảnh hưởng bản gốc; file CSV được dùng chung)"""
+        return CsvAnswers(self._reader, self._starts.copy(), self._ends.copy(), list(self._texts))
+
+    def select(self, keep):
+        """CsvAnswers mới chỉ gồm các dòng có keep[i] = True"""
+        keep = np.asarray(keep, dtype=bool)
+        return CsvAnswers(self._reader, self._starts[keep], self._ends[keep], list(self._texts))
+
+
+def select_rows(values, keep):
+    """Các phần tử của values (list, CsvAnswers...) có keep[i] = True"""
+    if isinstance(values, CsvAnswers):
+        return values.select(keep)
+    return [value for value, kept in zip(values, keep) if kept]
+
+
+def read_chunks(csv_file, chunk_rows=DEFAULT_CHUNK_ROWS, stats=None):
+    """
+    Đọc file CSV theo từng khối các cặp câu hỏi-đáp hợp lệ, không trùng câu hỏi
+
+    Args:
+        csv_file: Đường dẫn file CSV (có các cột question, answer)
+        chunk_rows: Số cặp tối đa mỗi khối
+        stats: CorpusStats để ghi số dòng đã đọc/bỏ qua (tùy chọn)
+
+    Yields:
+        Tuple (questions, answers, starts, ends): các list câu hỏi, câu trả lời
+        và vị trí byte đầu/cuối của từng dòng trong file
+
+    Raises:
+        FileNotFoundError: Không có file
+        ValueError: File không có đủ các cột question, answer
+    """
+    stats = stats if stats is not None else CorpusStats()
+    # Chỉ giữ digest blake2b (128 bit) của mỗi câu hỏi để loại câu trùng, không giữ cả chuỗi.
+    # Không dùng hash(): hash của str đổi theo từng tiến trình và 64 bit có thể trùng,
+    # khi đó các engine (TF-IDF, semantic) có thể bỏ những câu hỏi khác nhau
+    seen = set()
+
+    with open(csv_file, 'rb') as file:
+        lines = _ByteLines(file)
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        missing = [name for name in REQUIRED_COLUMNS if header is None or name not in header]
+        if missing:
+            raise ValueError(f"File {csv_file} thiếu cột: {', '.join(missing)}")
+        question_column = header.index('question')
+        answer_column = header.index('answer')
+        min_columns = max(question_column, answer_column) + 1
+
+        questions, answers, starts, ends = [], [], [], []
+        start = lines.position
+        for row in reader:
+            end = lines.position
+            if not row:
+                # Dòng trống (như csv.DictReader)
+                start = end
+                continue
+            stats.rows += 1
+            if len(row) < min_columns:
+                stats.malformed += 1
+            else:
+                question = row[question_column].strip()
+                answer = row[answer_column].strip()
+                if not question or not answer:
+                    stats.empty += 1
+                else:
+                    key = hashlib.blake2b(question.encode('utf-8'), digest_size=16).digest()
+                    if key in seen:
+                        stats.duplicates += 1
+                    else:
+                        seen.add(key)
+                        stats.loaded += 1
+                        questions.append(question)
+                        answers.append(answer)
+                        starts.append(start)
+                        ends.append(end)
+                        if len(questions) >= chunk_rows:
+                            yield questions, answers, starts, ends
+                            questions, answers, starts, ends = [], [], [], []
+            start = end
+        if questions:
+            yield questions, answers, starts, ends
+
+
+def load_corpus(csv_file, chunk_rows=DEFAULT_CHUNK_ROWS, on_chunk=None, answers_in_memory=False):
+    """
+    Đọc toàn bộ câu hỏi của file CSV theo từng khối, câu trả lời để lại trên đĩa
+
+    Args:
+        csv_file: Đường dẫn file CSV (có các cột question, answer)
+        chunk_rows: Số cặp mỗi khối
+        on_chunk: Hàm được gọi với list câu hỏi của mỗi khối ngay khi đọc xong khối
+            (vd. tiền xử lý hoặc encode theo từng khối)
+        answers_in_memory: Giữ câu trả lời trong một list thay vì CsvAnswers (các câu
+            trả lời giống hệt nhau dùng chung một chuỗi)
+
+    Returns:
+        Tuple (questions, answers, stats)
+
+    Raises:
+        FileNotFoundError: Không có file
+        ValueError: File không có đủ các cột question, answer
+    """
+    stats = CorpusStats()
+    questions = []
+    answers = [] if answers_in_memory else None
+    unique_answers = {}
+    # Mở trước khi đọc để vị trí byte ứng với đúng bản file được đọc
+    record_reader = None if answers_in_memory else _RecordReader(csv_file)
+    starts = array('q')
+    ends = array('q')
+    for chunk_questions, chunk_answers, chunk_starts, chunk_ends in read_chunks(csv_file, chunk_rows, stats):
+        questions.extend(chunk_questions)
+        if answers_in_memory:
+            answers.extend(unique_answers.setdefault(answer, answer) for answer in chunk_answers)
+        else:
+            starts.extend(chunk_starts)
+            ends.extend(chunk_ends)
+        if on_chunk is not None:
+            on_chunk(chunk_questions)
+
+    if not answers_in_memory:
+        answers = CsvAnswers(record_reader, np.frombuffer(starts, dtype=np.int64).copy(),
+                             np.frombuffer(ends, dtype=np.int64).copy())
+    return questions, answers, stats
+
+
+class Corpus:
+    """
+    Một lần đọc file CSV, dùng chung (chỉ đọc) giữa các engine
+
+    questions là tuple các chuỗi đã intern, answers là CsvAnswers dùng chung:
+    engine sửa dữ liệu (add_pairs, update_pair...) phải sao chép trước khi sửa.
+    """
+
+    __slots__ = ('csv_file', 'questions', 'answers', 'stats', 'signature', '__weakref__')
+
+    def __init__(self, csv_file, questions, answers, stats, signature):
+        self.csv_file = csv_file
+        self.questions = questions
+        self.answers = answers
+        self.stats = stats
+        self.signature = signature
+
+    def __len__(self):
+        return len(self.questions)
+
+
+def file_signature(csv_file):
+    """(đường dẫn tuyệt đối, thời điểm sửa, kích thước) của file; FileNotFoundError nếu không có file"""
+    stat = os.stat(csv_file)
+    return os.path.abspath(csv_file), stat.st_mtime_ns, stat.st_size
+
+
+class CorpusStore:
+    """
+    Các Corpus đã đọc trong tiến trình, một bản cho mỗi file CSV
+
+    Corpus chỉ được giữ khi còn engine dùng nó (tham chiếu yếu) và được đọc lại
+    khi file thay đổi (thời điểm sửa hoặc kích thước khác).
+    """
+
+    def __init__(self, chunk_rows=DEFAULT_CHUNK_ROWS):
+        self.chunk_rows = chunk_rows
+        self.loads = 0
+        self.hits = 0
+        self._corpora = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, csv_file):
+        """
+        Corpus của csv_file, đọc file ở lần đầu hoặc khi file đã thay đổi
+
+        Raises:
+            FileNotFoundError: Không có file
+            ValueError: File không có đủ các cột question, answer
+        """
+        signature = file_signature(csv_file)
+        with self._lock:
+            corpus = self._corpora.get(signature[0])
+            if corpus is not None and corpus.signature == signature:
+                self.hits += 1
+                return corpus
+            questions, answers, stats = load_corpus(csv_file, self.chunk_rows)
+            corpus = Corpus(csv_file, tuple(sys.intern(question) for question in questions), answers, stats,
+                            signature)
+            self._corpora[signature[0]] = corpus
+            self.loads += 1
+            return corpus
+
+    def __len__(self):
+        return len(self._corpora)
+
+    def stats(self):
+        """Số file đang giữ, số lần đọc file và số lần dùng lại"""
+        with self._lock:
+            return {'corpora': len(self._corpora), 'loads': self.loads, 'hits': self.hits}
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bộ nhớ đệm embedding trên đĩa cho ChatbotPro
+Mỗi câu hỏi được định danh bằng hash của (model_name, nội dung câu hỏi),
+embeddings được lưu thành file .npy có thể memory-map giữa các tiến trình
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+
+import numpy as np
+
+
+MANIFEST_FILE = 'manifest.json'
+KEY_DTYPE = 'S32'
+# File dữ liệu của kho (keys.<token>.npy, embeddings.<token>.npy)
+DATA_FILE = re.compile(r'^(keys|embeddings)\.[0-9a-f]{32}\.npy$')
+# File không còn được manifest trỏ tới chỉ bị xóa khi đã cũ hơn chừng này giây: tiến trình
+# vừa đọc manifest cũ vẫn kịp mở file, writer khác vẫn kịp thay manifest trỏ tới file của nó
+STALE_SECONDS = 300.0
+# Số dòng tối đa của các câu hỏi không còn trong corpus được giữ lại khi ghi kho
+# (sửa ngược lại hoặc corpus khác dùng chung thư mục không phải encode lại)
+MAX_STALE_ROWS = 10000
+
+
+def question_key(model_name, question):
+    """
+    Tính khóa nội dung cho một câu hỏi
+
+    Args:
+        model_name: Tên mô hình sentence-transformers
+        question: Nội dung câu hỏi
+
+    Returns:
+        Chuỗi bytes hex 32 ký tự
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(model_name.encode('utf-8'))
+    digest.update(b'\x00')
+    digest.update(question.encode('utf-8'))
+    return digest.hexdigest().encode('ascii')
+
+
+class EmbeddingCache:
+    """
+    Kho embedding định danh theo nội dung (content-addressed)
+
+    Thư mục của mỗi mô hình chứa:
+        manifest.json: Trỏ tới cặp file keys/embeddings hiện hành
+        keys.<token>.npy: Mảng khóa (S32), dòng i ứng với embedding dòng i
+        embeddings.<token>.npy: Ma trận float32/float16 (n, dim)
+
+    Các câu hỏi đã bị sửa/xóa khỏi corpus được giữ sau corpus hiện tại, tối đa
+    max_stale_rows dòng (dòng của lần ghi gần nhất trước), nên kho không lớn dần
+    theo số lần sửa CSV.
+
+    Khi ghi, file mới được tạo trước rồi manifest được thay thế nguyên tử,
+    nên nhiều worker có thể đọc/ghi cùng lúc mà không thấy dữ liệu dở dang.
+    File cũ chỉ bị xóa khi manifest hiện hành không trỏ tới và đã cũ hơn
+    STALE_SECONDS (xem _remove_stale_files).
+    """
+
+    def __init__(self, cache_dir, model_name, dtype='float32', max_stale_rows=MAX_STALE_ROWS):
+        """
+        Args:
+            cache_dir: Thư mục gốc của bộ nhớ đệm
+            model_name: Tên mô hình (mỗi mô hình một thư mục con)
+            dtype: Kiểu lưu trữ trên đĩa: 'float32' hoặc 'float16'
+            max_stale_rows: Số dòng tối đa của các câu hỏi không còn trong corpus
+                được giữ lại khi ghi (0 = chỉ giữ corpus hiện tại)
+        """
+        if dtype not in ('float32', 'float16'):
+            raise ValueError(f"dtype không hợp lệ: {dtype}")
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.max_stale_rows = max_stale_rows
+        slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)
+        self.directory = os.path.join(cache_dir, slug)
+
+    def load(self):
+        """
+        Memory-map kho hiện tại
+
+        Returns:
+            Tuple (keys, embeddings) hoặc (None, None) nếu chưa có kho hợp lệ
+        """
+        try:
+            with open(os.path.join(self.directory, MANIFEST_FILE), 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+            keys = np.load(os.path.join(self.directory, manifest['keys']))
+            # mode 'c' (copy-on-write): các trang được chia sẻ giữa các tiến trình
+            # nhưng mảng vẫn ghi được nên torch.from_numpy không cảnh báo
+            embeddings = np.load(os.path.join(self.directory, manifest['embeddings']), mmap_mode='c')
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+        if embeddings.ndim != 2 or len(keys) != len(embeddings):
+            return None, None
+        return keys, embeddings
+
+    def get_embeddings(self, questions, encode_fn):
+        """
+        Lấy embeddings cho danh sách câu hỏi, chỉ encode các câu hỏi mới hoặc đã thay đổi
+
+        Args:
+            questions: Danh sách câu hỏi theo thứ tự của corpus
+            encode_fn: Hàm nhận list câu hỏi, trả về np.ndarray (k, dim)
+
+        Returns:
+            Tuple (embeddings, n_encoded): ma trận (n, dim) memory-map từ kho
+            và số câu hỏi đã phải encode lại
+        """
+        keys = np.array([question_key(self.model_name, q) for q in questions], dtype=KEY_DTYPE)
+        stored_keys, stored = self.load()
+
+        # Trường hợp phổ biến nhất: corpus không đổi, kho đã đúng thứ tự
+        if stored is not None and stored.dtype == self.dtype and len(stored_keys) >= len(keys) \
+                and np.array_equal(stored_keys[:len(keys)], keys):
+            return stored[:len(keys)], 0
+
+        row_of = {}
+        if stored is not None:
+            row_of = {key: row for row, key in enumerate(stored_keys.tolist())}
+
+        missing = []
+        seen = set()
+        for i, key in enumerate(keys.tolist()):
+            if key not in row_of and key not in seen:
+                seen.add(key)
+                missing.append(i)
+
+        new_rows = {}
+        if missing:
+            new_vectors = np.asarray(encode_fn([questions[i] for i in missing]))
+            for i, vector in zip(missing, new_vectors):
+                new_rows[keys[i]] = vector
+            dim = new_vectors.shape[1]
+        else:
+            dim = stored.shape[1]
+
+        if stored is not None and stored.shape[1] != dim:
+            # Kích thước embedding đổi (mô hình khác cùng tên): bỏ kho cũ
+            return self._rebuild(questions, keys, encode_fn), len(keys)
+
+        # Sắp xếp lại kho để corpus hiện tại là tiền tố: lần sau chỉ cần mmap. Kho đã
+        # xếp corpus của lần ghi trước lên đầu nên max_stale_rows dòng đầu là gần nhất
+        corpus_keys = set(keys.tolist())
+        extra = [row for key, row in row_of.items() if key not in corpus_keys][:self.max_stale_rows]
+        out_keys = np.concatenate([keys, stored_keys[extra]]) if extra else keys
+        out = np.empty((len(out_keys), dim), dtype=self.dtype)
+        for i, key in enumerate(keys.tolist()):
+            out[i] = new_rows[key] if key in new_rows else stored[row_of[key]]
+        if extra:
+            out[len(keys):] = stored[extra]
+
+        self._write(out_keys, out)
+        _, embeddings = self.load()
+        if embeddings is None:
+            # Không ghi được (thư mục chỉ đọc...): dùng bản trong bộ nhớ
+            return out[:len(keys)], len(missing)
+        return embeddings[:len(keys)], len(missing)
+
+    def _rebuild(self, questions, keys, encode_fn):
+        """Encode lại toàn bộ corpus và ghi đè kho"""
+        out = np.asarray(encode_fn(list(questions))).astype(self.dtype)
+        self._write(keys, out)
+        _, embeddings = self.load()
+        return out if embeddings is None else embeddings[:len(keys)]
+
+    def _write(self, keys, embeddings):
+        """Ghi file mới rồi thay manifest nguyên tử, dọn các file cũ"""
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            token = uuid.uuid4().hex
+            keys_file = f'keys.{token}.npy'
+            embeddings_file = f'embeddings.{token}.npy'
+            np.save(os.path.join(self.directory, keys_file), keys)
+            np.save(os.path.join(self.directory, embeddings_file), embeddings)
+
+            manifest_tmp = os.path.join(self.directory, f'{MANIFEST_FILE}.{token}.tmp')
+            with open(manifest_tmp, 'w', encoding='utf-8') as file:
+                json.dump({'keys': keys_file, 'embeddings': embeddings_file,
+                           'model_name': self.model_name, 'dtype': self.dtype.name}, file)
+            previous = self._read_manifest()
+            os.replace(manifest_tmp, manifest_path)
+        except OSError as e:
+            print(f"✗ Không ghi được bộ nhớ đệm embedding: {e}")
+            return
+
+        # Đánh dấu thời điểm các file cũ thôi được dùng: chúng chỉ bị xóa sau STALE_SECONDS nữa
+        for name in (previous.get('keys'), previous.get('embeddings')):
+            if name and name not in (keys_file, embeddings_file):
+                try:
+                    os.utime(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        self._remove_stale_files()
+
+    def _read_manifest(self):
+        """Nội dung manifest hiện hành ({} nếu chưa có hoặc không đọc được)"""
+        try:
+            with open(os.path.join(self.directory, MANIFEST_FILE), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _remove_stale_files(self):
+        """
+        Xóa các file dữ liệu mà manifest hiện hành không trỏ tới và cũ hơn STALE_SECONDS
+
+        Thời điểm sửa của file là lúc nó được ghi hoặc lúc bị manifest mới thay thế
+        (_write chạm lại file cũ), nên tiến trình vừa đọc manifest cũ vẫn kịp mở
+        file. Manifest được đọc lại sau khi thay: writer khác có thể đã thay nó
+        trong lúc ghi, khi đó file của writer đó được giữ lại. Các tiến trình đang
+        mmap file cũ vẫn đọc được sau khi file bị xóa (POSIX).
+        """
+        manifest = self._read_manifest()
+        if not manifest:
+            return
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        live = {manifest.get('keys'), manifest.get('embeddings')}
+        now = time.time()
+        for name in names:
+            if name in live or not DATA_FILE.match(name):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > STALE_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Encode câu hỏi của corpus theo lô, song song nhiều tiến trình, có checkpoint
+
+Các câu hỏi được sắp xếp theo độ dài (dài trước) rồi chia thành các khối
+unit_rows câu liên tiếp: câu trong cùng một lô có độ dài gần nhau nên ít phải
+padding, và số câu mỗi lô tỉ lệ nghịch với độ dài câu dài nhất của khối để mỗi
+lô có số token gần bằng nhau. Các khối được encode bởi mô hình của tiến trình
+hiện tại hoặc bởi một nhóm tiến trình worker (mỗi worker tải mô hình một lần
+và dùng cpu_count // workers thread), kết quả được ghi thẳng vào ma trận
+cấp phát trước theo thứ tự gốc của corpus.
+
+Với checkpoint_dir, ma trận là một file .npy memory-map và mỗi khối xong được
+ghi vào progress.json (sau khi dữ liệu đã được flush): lần chạy sau với cùng
+mô hình và cùng danh sách câu hỏi chỉ encode các khối còn thiếu. Mỗi thư mục
+checkpoint dành cho một lần encode tại một thời điểm.
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import numpy as np
+
+PROGRESS_FILE = 'progress.json'
+EMBEDDINGS_FILE = 'embeddings.npy'
+
+DEFAULT_BATCH_SIZE = 32
+# Số câu hỏi mỗi khối (đơn vị chia việc cho worker và đơn vị checkpoint)
+DEFAULT_UNIT_ROWS = 4096
+# Các số câu mỗi lô được thử khi batch_size='auto'
+BATCH_CANDIDATES = (16, 32, 64, 128)
+# Số câu hỏi của mẫu dùng để đo khi batch_size='auto'
+TUNING_ROWS = 256
+
+# Mô hình của tiến trình worker (tải một lần trong _init_worker)
+_worker_state = {'model': None}
+
+
+def load_encoder(model_name, encoder_backend='torch', encoder_params=None, device=None):
+    """
+    Tải mô hình sentence-transformers hoặc bản ONNX của nó (import thư viện ở lần đầu)
+
+    Args:
+        model_name: Tên mô hình sentence-transformers
+        encoder_backend: 'torch' hoặc 'onnx' (xem onnx_encoder.py)
+        encoder_params: Tham số của OnnxEncoder
+        device: Thiết bị của mô hình torch (None = mặc định của sentence-transformers)
+    """
+    if encoder_backend == 'onnx':
+        from onnx_encoder import OnnxEncoder
+
+        return OnnxEncoder(model_name, **(encoder_params or {}))
+
+    from sentence_transformers import SentenceTransformer
+
+    if device is None:
+        return SentenceTransformer(model_name)
+    return SentenceTransformer(model_name, device=device)
+
+
+def _init_worker(model_name, encoder_backend, encoder_params, threads):
+    """Chạy một lần trong mỗi worker: tải mô hình trên CPU với threads thread"""
+    if encoder_backend == 'onnx':
+        encoder_params = dict(encoder_params or {}, intra_op_threads=threads)
+    else:
+        import torch
+
+        torch.set_num_threads(threads)
+    _worker_state['model'] = load_encoder(model_name, encoder_backend, encoder_params, device='cpu')
+
+
+def _encode_task(texts, batch_size):
+    """Encode một khối câu hỏi bằng mô hình của worker"""
+    return encode_batch(_worker_state['model'], texts, batch_size)
+
+
+def encode_batch(model, texts, batch_size):
+    """Encode texts bằng model, trả về np.ndarray float32 (len(texts), dim)"""
+    embeddings = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def corpus_fingerprint(encoder_id, texts, unit_rows):
+    """Dấu vân tay của mô hình + danh sách câu hỏi + cách chia khối (để kiểm tra checkpoint)"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{encoder_id}\x00{unit_rows}'.encode('utf-8'))
+    for text in texts:
+        digest.update(b'\x00')
+        digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def unit_batch_sizes(units, lengths, batch_size, reference_length):
+    """
+    Số câu mỗi lô của từng khối: giữ số token mỗi lô gần batch_size * reference_length
+
+    Args:
+        units: Các mảng chỉ số câu hỏi của từng khối
+        lengths: Độ dài (ký tự) của từng câu hỏi
+        batch_size: Số câu mỗi lô với câu có độ dài reference_length
+        reference_length: Độ dài câu hỏi trung vị của corpus
+
+    Returns:
+        List số câu mỗi lô, trong khoảng [batch_size // 4, batch_size * 4]
+    """
+    budget = batch_size * max(reference_length, 1)
+    low, high = max(batch_size // 4, 1), batch_size * 4
+    return [int(min(max(budget // max(int(lengths[unit].max()), 1), low), high)) for unit in units]
+
+
+class EncodeCheckpoint:
+    """
+    Ma trận embeddings đang encode dở (file .npy memory-map) và danh sách khối đã xong
+    """
+
+    def __init__(self, directory, fingerprint, shape):
+        """
+        Args:
+            directory: Thư mục checkpoint
+            fingerprint: corpus_fingerprint() của lần encode
+            shape: Kích thước ma trận embeddings (n, dim)
+        """
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.shape = tuple(shape)
+        self.done = set()
+        self.embeddings = None
+
+    def open(self):
+        """
+        Mở lại checkpoint nếu khớp (cùng mô hình, câu hỏi, kích thước), ngược lại tạo mới
+
+        Returns:
+            Tuple (embeddings memmap, tập chỉ số các khối đã encode)
+        """
+        try:
+            with open(os.path.join(self.directory, PROGRESS_FILE), 'r', encoding='utf-8') as file:
+                progress = json.load(file)
+            if progress['fingerprint'] == self.fingerprint and tuple(progress['shape']) == self.shape:
+                embeddings = np.load(os.path.join(self.directory, EMBEDDINGS_FILE), mmap_mode='r+')
+                if embeddings.shape == self.shape and embeddings.dtype == np.float32:
+                    self.embeddings = embeddings
+                    self.done = set(progress['done'])
+                    return self.embeddings, set(self.done)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        self.remove()
+        os.makedirs(self.directory, exist_ok=True)
+        self.embeddings = np.lib.format.open_memmap(os.path.join(self.directory, EMBEDDINGS_FILE), mode='w+',
+                                                    dtype=np.float32, shape=self.shape)
+        self.done = set()
+        self._write_progress()
+        return self.embeddings, set()
+
+    def mark_done(self, unit):
+        """Ghi nhận khối unit đã xong (flush dữ liệu trước, rồi mới cập nhật progress.json)"""
+        self.embeddings.flush()
+        self.done.add(unit)
+        self._write_progress()
+
+    def _write_progress(self):
+        path = os.path.join(self.directory, PROGRESS_FILE)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as file:
+            json.dump({'fingerprint': self.fingerprint, 'shape': list(self.shape),
+                       'done': sorted(self.done)}, file)
+        os.replace(tmp, path)
+
+    def remove(self):
+        """Xóa checkpoint (sau khi encode xong)"""
+        self.embeddings = None
+        for name in (EMBEDDINGS_FILE, PROGRESS_FILE, f'{PROGRESS_FILE}.tmp'):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            # Thư mục còn file khác hoặc không tồn tại
+            pass
+
+
+class CorpusEncoder:
+    """
+    Encode toàn bộ câu hỏi của corpus: sắp xếp theo độ dài, chia khối, song song, có checkpoint
+    """
+
+    def __init__(self, model, encoder_id, batch_size=DEFAULT_BATCH_SIZE, workers=1, checkpoint_dir=None,
+                 unit_rows=DEFAULT_UNIT_ROWS, worker_model=None, start_method='spawn'):
+        """
+        Args:
+            model: Mô hình đã tải (SentenceTransformer, OnnxEncoder...) dùng khi workers=1,
+                để chọn batch_size và lấy số chiều
+            encoder_id: Định danh mô hình + cách chạy (ChatbotPro.encoder_id) cho checkpoint
+            batch_size: Số câu mỗi lô (với câu có độ dài trung vị) hoặc 'auto' (đo và chọn,
+                xem tune_batch_size)
+            workers: Số tiến trình encode song song (1 = encode trong tiến trình hiện tại)
+            checkpoint_dir: Thư mục checkpoint để tiếp tục sau khi bị dừng (None = không dùng)
+            unit_rows: Số câu hỏi mỗi khối
+            worker_model: Tuple (model_name, encoder_backend, encoder_params) để worker tự tải
+                mô hình; bắt buộc khi workers > 1
+            start_method: Cách tạo tiến trình của multiprocessing ('spawn' an toàn khi
+                tiến trình cha đã nạp torch)
+        """
+        if batch_size != 'auto' and (not isinstance(batch_size, int) or batch_size < 1):
+            raise ValueError(f"batch_size không hợp lệ: {batch_size} (số nguyên dương hoặc 'auto')")
+        if workers > 1 and worker_model is None:
+            raise ValueError("workers > 1 cần worker_model để các worker tự tải mô hình")
+        self.model = model
+        self.encoder_id = encoder_id
+        self.batch_size = batch_size
+        self.workers = max(int(workers), 1)
+        self.checkpoint_dir = checkpoint_dir
+        self.unit_rows = unit_rows
+        self.worker_model = worker_model
+        self.start_method = start_method
+        # Thông tin lần encode gần nhất: số câu, số câu lấy từ checkpoint, batch_size, số giây
+        self.last_run = None
+
+    def tune_batch_size(self, texts, candidates=BATCH_CANDIDATES, sample_rows=TUNING_ROWS):
+        """
+        Chọn số câu mỗi lô cho throughput cao nhất trên một mẫu câu hỏi độ dài trung bình
+
+        Args:
+            texts: Các câu hỏi đã sắp xếp theo độ dài
+            candidates: Các số câu mỗi lô cần thử
+            sample_rows: Số câu hỏi của mẫu (lấy ở giữa danh sách)
+
+        Returns:
+            Dict số câu mỗi lô -> số câu/giây; số được chọn ở self.batch_size
+        """
+        middle = max(len(texts) // 2 - sample_rows // 2, 0)
+        sample = list(texts[middle:middle + sample_rows])
+        encode_batch(self.model, sample[:min(candidates)], min(candidates))
+
+        throughput = {}
+        for candidate in candidates:
+            start = time.perf_counter()
+            encode_batch(self.model, sample, candidate)
+            throughput[candidate] = len(sample) / max(time.perf_counter() - start, 1e-9)
+        self.batch_size = max(throughput, key=throughput.get)
+        return throughput
+
+    def encode(self, texts):
+        """
+        Encode danh sách câu hỏi
+
+        Returns:
+            np.ndarray float32 (len(texts), dim) theo thứ tự của texts
+        """
+        start_time = time.perf_counter()
+        dim = self.model.get_sentence_embedding_dimension()
+        n = len(texts)
+        if n == 0:
+            self.last_run = {'rows': 0, 'resumed_rows': 0, 'batch_size': self.batch_size, 'seconds': 0.0}
+            return np.empty((0, dim), dtype=np.float32)
+
+        lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=n)
+        # Dài trước: lỗi thiếu bộ nhớ (nếu có) xuất hiện ngay ở khối đầu tiên
+        order = np.argsort(-lengths, kind='stable')
+        units = [order[start:start + self.unit_rows] for start in range(0, n, self.unit_rows)]
+
+        checkpoint = None
+        if self.checkpoint_dir:
+            checkpoint = EncodeCheckpoint(self.checkpoint_dir,
+                                          corpus_fingerprint(self.encoder_id, texts, self.unit_rows), (n, dim))
+            embeddings, done = checkpoint.open()
+        else:
+            embeddings, done = np.empty((n, dim), dtype=np.float32), set()
+        pending = [unit for unit in range(len(units)) if unit not in done]
+
+        def store(unit, unit_embeddings):
+            embeddings[units[unit]] = unit_embeddings
+            if checkpoint is not None:
+                checkpoint.mark_done(unit)
+
+        if pending:
+            batch_size = self.batch_size
+            if batch_size == 'auto':
+                # Quá ít câu để đo: dùng số mặc định và chưa chọn
+                if n >= TUNING_ROWS:
+                    self.tune_batch_size([texts[i] for i in order], sample_rows=TUNING_ROWS)
+                    batch_size = self.batch_size
+                else:
+                    batch_size = DEFAULT_BATCH_SIZE
+            batch_sizes = unit_batch_sizes(units, lengths, batch_size, int(np.median(lengths)))
+            if self.workers == 1 or len(pending) == 1:
+                for unit in pending:
+                    store(unit, encode_batch(self.model, [texts[i] for i in units[unit]], batch_sizes[unit]))
+            else:
+                self._encode_parallel(texts, units, pending, batch_sizes, store)
+
+        if checkpoint is not None:
+            # Đọc vào bộ nhớ rồi mới xóa file checkpoint
+            embeddings = np.array(embeddings)
+            checkpoint.remove()
+        self.last_run = {
+            'rows': n,
+            'resumed_rows': int(sum(len(units[unit]) for unit in done)),
+            'batch_size': self.batch_size,
+            'seconds': time.perf_counter() - start_time,
+        }
+        return embeddings
+
+    def _encode_parallel(self, texts, units, pending, batch_sizes, store):
+        """Encode các khối pending bằng một nhóm worker, ghi kết quả theo thứ tự hoàn thành"""
+        model_name, encoder_backend, encoder_params = self.worker_model
+        threads = max((os.cpu_count() or 1) // self.workers, 1)
+        executor = ProcessPoolExecutor(max_workers=min(self.workers, len(pending)),
+                                       mp_context=get_context(self.start_method), initializer=_init_worker,
+                                       initargs=(model_name, encoder_backend, encoder_params, threads))
+        try:
+            futures = {executor.submit(_encode_task, [texts[i] for i in units[unit]], batch_sizes[unit]): unit
+                       for unit in pending}
+            for future in as_completed(futures):
+                store(futures[future], future.result())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
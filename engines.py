@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tạo chatbot theo tên engine, chỉ import module của engine khi thực sự dùng
+
+Module TF-IDF (chatbot.py) không kéo theo torch/sentence-transformers, nên một
+tiến trình chỉ phục vụ TF-IDF khởi động trong vài trăm mili giây. Thời gian
+import được ghi vào StartupReport (engine.startup) cùng các giai đoạn khác.
+
+EngineRegistry giữ các engine của tiến trình (tạo ở lần dùng đầu tiên, giải
+phóng khi lâu không dùng) cùng những gì chúng dùng chung được: một bản dữ liệu
+cho mỗi file CSV (corpus_loader.CorpusStore), một mô hình và một bộ nhớ đệm
+embedding câu hỏi cho mỗi encoder_id.
+"""
+
+import importlib
+import sys
+import threading
+import time
+import weakref
+
+from corpus_loader import CorpusStore
+
+# Tên engine -> (module, class)
+ENGINES = {
+    'tfidf': ('chatbot', 'Chatbot'),
+    'semantic': ('chatbot_pro', 'ChatbotPro'),
+    'hybrid': ('chatbot_hybrid', 'ChatbotHybrid'),
+}
+
+# Thời gian (giây) không được dùng trước khi engine bị giải phóng (get_registry())
+DEFAULT_IDLE_SECONDS = 900.0
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def engine_class(name):
+    """
+    Class của engine name, import module ở lần gọi đầu tiên
+
+    Returns:
+        Tuple (class, số giây đã dùng để import module trong lần gọi này; 0 nếu
+        module đã được import trước đó)
+
+    Raises:
+        ValueError: Tên engine không hợp lệ
+    """
+    if name not in ENGINES:
+        raise ValueError(f"Engine không hợp lệ: {name} (chọn một trong {list(ENGINES)})")
+    module_name, class_name = ENGINES[name]
+    import_seconds = 0.0
+    if module_name not in sys.modules:
+        start = time.perf_counter()
+        importlib.import_module(module_name)
+        import_seconds = time.perf_counter() - start
+    return getattr(sys.modules[module_name], class_name), import_seconds
+
+
+def create_engine(name, **kwargs):
+    """
+    Tạo (chưa khởi tạo/huấn luyện) một chatbot theo tên engine
+
+    Args:
+        name: 'tfidf', 'semantic' hoặc 'hybrid'
+        **kwargs: Tham số của class engine (csv_file, cache_dir, metrics...)
+    """
+    cls, import_seconds = engine_class(name)
+    engine = cls(**kwargs)
+    engine.startup.record('import', import_seconds)
+    return engine
+
+
+def _freeze(value):
+    """Dạng hashable của tham số engine (dict/list thành tuple, đối tượng không hash được theo id)"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    try:
+        hash(value)
+    except TypeError:
+        return ('id', id(value))
+    return value
+
+
+def _start(engine):
+    """Huấn luyện/đọc chỉ mục (TF-IDF) hoặc khởi tạo (semantic, hybrid) engine; True nếu sẵn sàng"""
+    if hasattr(engine, 'load_or_train'):
+        if not engine.load_or_train():
+            return False
+        # Dựng bộ vector hóa câu hỏi trong thread nền, engine trả lời được ngay
+        engine.warm_up()
+        return True
+    return engine.initialize()
+
+
+def _release_engine(engine):
+    """Dừng các thread/tiến trình nền của engine bị loại (phần còn lại được thu hồi khi hết tham chiếu)"""
+    for name in ('stop_compaction', 'stop_sharding'):
+        stop = getattr(engine, name, None)
+        if stop is not None:
+            stop()
+
+
+class _Entry:
+    """Một engine trong registry (engine = None khi đang được tạo)"""
+
+    __slots__ = ('engine', 'last_used', 'lock')
+
+    def __init__(self, now):
+        self.engine = None
+        self.last_used = now
+        self.lock = threading.Lock()
+
+
+class EngineRegistry:
+    """
+    Các engine dùng chung trong một tiến trình (vd. mọi phiên Streamlit)
+
+    Mỗi tổ hợp (tên engine, file CSV, tham số) được tạo một lần ở lần get() đầu
+    tiên; các engine dùng chung một CorpusStore, và các engine semantic/hybrid
+    cùng encoder_id dùng chung mô hình và bộ nhớ đệm embedding câu hỏi. Engine
+    không được get() trong idle_seconds bị loại khỏi registry; dữ liệu, mô hình
+    dùng chung được giải phóng khi không còn engine nào dùng.
+    """
+
+    def __init__(self, idle_seconds=DEFAULT_IDLE_SECONDS, max_engines=None, corpus_store=None):
+        """
+        Args:
+            idle_seconds: Thời gian (giây) không dùng trước khi engine bị loại (None = không loại)
+            max_engines: Số engine tối đa được giữ, engine ít dùng gần đây nhất bị loại
+                trước (None = không giới hạn)
+            corpus_store: CorpusStore dùng chung (mặc định: tạo mới)
+        """
+        self.idle_seconds = idle_seconds
+        self.max_engines = max_engines
+        self.corpus_store = corpus_store if corpus_store is not None else CorpusStore()
+        self.builds = 0
+        self.hits = 0
+        self.evictions = 0
+        self._entries = {}
+        # encoder_id -> mô hình / QueryEmbeddingCache, giữ khi còn engine dùng
+        self._models = weakref.WeakValueDictionary()
+        self._query_embeddings = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, name, csv_file='data_converted.csv', **kwargs):
+        """
+        Engine đã sẵn sàng trả lời, tạo và khởi tạo ở lần gọi đầu tiên
+
+        Args:
+            name: 'tfidf', 'semantic' hoặc 'hybrid'
+            csv_file: File CSV của engine
+            **kwargs: Tham số khác của class engine (cùng tham số thì dùng chung engine)
+
+        Returns:
+            Engine, hoặc None nếu không khởi tạo được (lần gọi sau sẽ thử lại)
+
+        Raises:
+            ValueError: Tên engine không hợp lệ
+        """
+        key = (name, csv_file, _freeze(kwargs))
+        with self._lock:
+            now = time.monotonic()
+            evicted = self._evict(now, keep=key)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(now)
+            entry.last_used = now
+        for stale in evicted:
+            _release_engine(stale)
+
+        with entry.lock:
+            if entry.engine is None:
+                engine = self._build(name, csv_file, kwargs)
+                if engine is None:
+                    with self._lock:
+                        if self._entries.get(key) is entry:
+                            del self._entries[key]
+                    return None
+                entry.engine = engine
+                with self._lock:
+                    self.builds += 1
+            else:
+                with self._lock:
+                    self.hits += 1
+            engine = entry.engine
+
+        with self._lock:
+            # Thời gian tạo engine không tính là thời gian không dùng
+            entry.last_used = time.monotonic()
+            evicted = self._evict(entry.last_used, keep=key)
+        for stale in evicted:
+            _release_engine(stale)
+        return engine
+
+    def _build(self, name, csv_file, kwargs):
+        """Tạo engine với các phần dùng chung của registry rồi khởi tạo"""
+        engine = create_engine(name, csv_file=csv_file, corpus_store=self.corpus_store, **kwargs)
+        encoder_id = getattr(engine, 'encoder_id', None)
+        if encoder_id is not None:
+            with self._lock:
+                model = self._models.get(encoder_id)
+                query_embeddings = self._query_embeddings.get(encoder_id)
+            if model is not None:
+                engine.model = model
+            if query_embeddings is not None and engine.query_embeddings is not None:
+                engine.query_embeddings = query_embeddings
+
+        if not _start(engine):
+            return None
+
+        if encoder_id is not None:
+            with self._lock:
+                self._models.setdefault(encoder_id, engine.model)
+                if engine.query_embeddings is not None:
+                    self._query_embeddings.setdefault(encoder_id, engine.query_embeddings)
+        return engine
+
+    def _evict(self, now, keep=None):
+        """
+        Bỏ khỏi registry các engine không dùng quá idle_seconds và engine thừa so với max_engines
+
+        Gọi khi đang giữ lock; trả về các engine bị loại để dừng chúng sau khi nhả lock.
+        """
+        built = sorted((entry.last_used, key) for key, entry in self._entries.items()
+                       if entry.engine is not None and key != keep)
+        n_kept = len(built) + (keep in self._entries and self._entries[keep].engine is not None)
+        evicted = []
+        for last_used, key in built:
+            idle = self.idle_seconds is not None and now - last_used > self.idle_seconds
+            excess = self.max_engines is not None and n_kept > self.max_engines
+            if idle or excess:
+                evicted.append(self._entries.pop(key).engine)
+                n_kept -= 1
+        self.evictions += len(evicted)
+        return evicted
+
+    def evict_idle(self):
+        """
+        Loại ngay các engine đã quá idle_seconds không dùng
+
+        Returns:
+            Số engine bị loại
+        """
+        with self._lock:
+            evicted = self._evict(time.monotonic())
+        for engine in evicted:
+            _release_engine(engine)
+        return len(evicted)
+
+    def clear(self):
+        """Loại mọi engine"""
+        with self._lock:
+            evicted = [entry.engine for entry in self._entries.values() if entry.engine is not None]
+            self._entries = {key: entry for key, entry in self._entries.items() if entry.engine is None}
+            self.evictions += len(evicted)
+        for engine in evicted:
+            _release_engine(engine)
+
+    def stats(self):
+        """Các engine đang giữ và số lần tạo/dùng lại/loại"""
+        with self._lock:
+            return {
+                'engines': [key[0] for key, entry in self._entries.items() if entry.engine is not None],
+                'builds': self.builds,
+                'hits': self.hits,
+                'evictions': self.evictions,
+                'models': len(self._models),
+                'corpora': len(self.corpus_store),
+            }
+
+
+def get_registry():
+    """EngineRegistry dùng chung của tiến trình (tạo ở lần gọi đầu tiên)"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = EngineRegistry()
+        return _registry
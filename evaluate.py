@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Đánh giá offline và hiệu chỉnh ngưỡng của các chatbot trên một file câu hỏi có nhãn
+
+File nhãn là CSV có các cột query (câu hỏi người dùng) và question (câu hỏi
+mẫu đúng trong corpus; để trống nếu corpus không có câu trả lời cho query).
+Mỗi engine chấm điểm toàn bộ query với toàn bộ corpus bằng một phép nhân ma
+trận (chia theo khối query nếu ma trận điểm quá lớn), sau đó mọi chỉ số được
+tính vector hóa trên điểm top-1 và thứ hạng của câu hỏi đúng:
+
+- accuracy@k và MRR (thứ hạng đầy đủ, bằng điểm thì chỉ số nhỏ đứng trước
+  như khi chatbot chọn top-k)
+- Precision/recall khi trả lời với mọi ngưỡng trong một dải (sweep), tỉ lệ query
+  không có câu trả lời bị trả lời nhầm
+- Precision/recall của từng mức độ tin cậy với ngưỡng hiện tại, và ngưỡng đề xuất
+  (ngưỡng nhỏ nhất đạt precision mục tiêu)
+
+Điểm giống điểm chatbot dùng để xét ngưỡng (TF-IDF: cosine similarity; Semantic
+Search: cosine similarity với tìm kiếm chính xác) tới sai số làm tròn.
+
+Chạy:
+    python3 evaluate.py labelled.csv --engines tfidf semantic --output report.json
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+
+import numpy as np
+
+from engines import EngineRegistry
+
+# Số phần tử tối đa của một khối ma trận điểm (query x corpus)
+BLOCK_ELEMENTS = 2 ** 25
+DEFAULT_KS = (1, 3, 5, 10)
+
+
+def load_labels(path):
+    """
+    Đọc file câu hỏi có nhãn
+
+    Returns:
+        Tuple (queries, expected): expected[i] là câu hỏi mẫu đúng hoặc '' nếu không có
+
+    Raises:
+        ValueError: File thiếu cột query hoặc question
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        reader = csv.DictReader(file)
+        missing = [name for name in ('query', 'question') if name not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"File {path} thiếu cột: {', '.join(missing)}")
+        queries, expected = [], []
+        for row in reader:
+            query = (row['query'] or '').strip()
+            if query:
+                queries.append(query)
+                expected.append((row['question'] or '').strip())
+    return queries, expected
+
+
+def gold_indices(questions, expected):
+    """
+    Chỉ số câu hỏi đúng trong corpus của mỗi query
+
+    Returns:
+        np.ndarray int64: chỉ số, -1 nếu query không có câu trả lời, -2 nếu câu hỏi
+        đúng không có trong corpus (bị bỏ qua khi đánh giá)
+    """
+    index_of = {}
+    for i, question in enumerate(questions):
+        index_of.setdefault(question, i)
+    return np.array([index_of.get(label, -2) if label else -1 for label in expected], dtype=np.int64)
+
+
+def score_blocks(score_fn, n_queries, n_rows, gold, ties='lowest'):
+    """
+    Chấm điểm theo khối query và giữ điểm/chỉ số top-1 và thứ hạng câu hỏi đúng
+
+    Args:
+        score_fn: Hàm score_fn(start, end) trả về ma trận điểm (end - start, n_rows)
+        n_queries: Số query
+        n_rows: Số câu hỏi của corpus
+        gold: Chỉ số câu hỏi đúng của mỗi query (< 0 nếu không có)
+        ties: Bằng điểm thì chỉ số nhỏ ('lowest') hay lớn ('highest') xếp trước, như engine
+
+    Returns:
+        Tuple (top1_scores, top1_indices, ranks); ranks = 0 nếu query không có câu hỏi đúng
+    """
+    top1_scores = np.empty(n_queries, dtype=np.float64)
+    top1_indices = np.empty(n_queries, dtype=np.int64)
+    ranks = np.zeros(n_queries, dtype=np.int64)
+    block_rows = max(BLOCK_ELEMENTS // max(n_rows, 1), 1)
+    columns = np.arange(n_rows)
+    for start in range(0, n_queries, block_rows):
+        end = min(start + block_rows, n_queries)
+        scores = np.asarray(score_fn(start, end))
+        # argmax chọn chỉ số nhỏ nhất khi bằng điểm; 'highest': argmax trên các cột đảo ngược
+        if ties == 'highest':
+            top1_indices[start:end] = n_rows - 1 - scores[:, ::-1].argmax(axis=1)
+        else:
+            top1_indices[start:end] = scores.argmax(axis=1)
+        top1_scores[start:end] = scores[np.arange(end - start), top1_indices[start:end]]
+
+        block_gold = gold[start:end]
+        labelled = np.flatnonzero(block_gold >= 0)
+        if len(labelled):
+            rows = scores[labelled]
+            gold_scores = rows[np.arange(len(labelled)), block_gold[labelled]][:, None]
+            gold_columns = block_gold[labelled][:, None]
+            tied_ahead = columns > gold_columns if ties == 'highest' else columns < gold_columns
+            ahead = (rows > gold_scores) | ((rows == gold_scores) & tied_ahead)
+            ranks[start + labelled] = ahead.sum(axis=1) + 1
+    return top1_scores, top1_indices, ranks
+
+
+def _ratio(numerator, denominator):
+    """numerator / denominator theo từng phần tử, 0 khi mẫu số bằng 0"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+class ScoreTable:
+    """
+    Điểm top-1 đã sắp xếp cùng số câu đúng/không có câu trả lời cộng dồn từ điểm cao xuống
+
+    at_least() và above() nhận một mảng ngưỡng và trả kết quả cho
+    mọi ngưỡng bằng một lần searchsorted.
+    """
+
+    def __init__(self, top1_scores, correct, negative):
+        order = np.argsort(top1_scores, kind='stable')
+        self.scores = top1_scores[order]
+        # suffix[i] = số phần tử từ vị trí i tới cuối (điểm >= scores[i])
+        self.correct = np.concatenate([np.cumsum(correct[order][::-1])[::-1], [0]])
+        self.negative = np.concatenate([np.cumsum(negative[order][::-1])[::-1], [0]])
+        self.n = len(top1_scores)
+
+    def at_least(self, thresholds):
+        """(số query, số đúng, số không có câu trả lời) có điểm >= mỗi ngưỡng"""
+        position = np.searchsorted(self.scores, thresholds, side='left')
+        return self.n - position, self.correct[position], self.negative[position]
+
+    def above(self, thresholds):
+        """(số query, số đúng, số không có câu trả lời) có điểm > mỗi ngưỡng"""
+        position = np.searchsorted(self.scores, thresholds, side='right')
+        return self.n - position, self.correct[position], self.negative[position]
+
+
+def threshold_sweep(table, thresholds, n_answerable, n_negative):
+    """
+    Precision/recall khi chỉ trả lời các query có điểm top-1 >= ngưỡng, cho mọi ngưỡng
+
+    Returns:
+        Dict các mảng theo ngưỡng: answered_rate, precision, recall, negative_accept_rate
+    """
+    answered, correct, negative = table.at_least(thresholds)
+    return {
+        'thresholds': thresholds,
+        'answered_rate': _ratio(answered, table.n),
+        'precision': _ratio(correct, answered),
+        'recall': _ratio(correct, n_answerable),
+        'negative_accept_rate': _ratio(negative, n_negative),
+    }
+
+
+def tier_report(table, tiers, n_answerable, n_negative):
+    """
+    Số query, precision (top-1 đúng), recall và số query không có câu trả lời của từng mức
+
+    Args:
+        tiers: List (tên, điều kiện, điều kiện loại trừ); mỗi điều kiện là None (mọi
+            query), ('>=', ngưỡng) hoặc ('>', ngưỡng). Một query thuộc mức nếu thỏa
+            điều kiện và không thỏa điều kiện loại trừ
+    """
+    def count(condition):
+        if condition is None:
+            return table.n, table.correct[0], table.negative[0]
+        operator, threshold = condition
+        counts = (table.at_least if operator == '>=' else table.above)(np.array([threshold]))
+        return tuple(value[0] for value in counts)
+
+    report = {}
+    for name, condition, excluded in tiers:
+        queries, correct, negative = count(condition)
+        if excluded is not None:
+            queries, correct, negative = np.subtract((queries, correct, negative), count(excluded))
+        report[name] = {
+            'queries': int(queries),
+            'precision': float(_ratio(correct, queries)),
+            'recall': float(_ratio(correct, n_answerable)),
+            'negatives': int(negative),
+            'negative_rate': float(_ratio(negative, n_negative)),
+        }
+    return report
+
+
+def recommend(sweep, target_precision):
+    """Ngưỡng nhỏ nhất có precision >= target_precision (None nếu không có)"""
+    reached = np.flatnonzero((sweep['precision'] >= target_precision) & (sweep['answered_rate'] > 0))
+    if not len(reached):
+        return None
+    return float(sweep['thresholds'][reached[0]])
+
+
+def tfidf_scorer(chatbot, queries):
+    """Hàm chấm điểm theo khối của Chatbot (TF-IDF): cosine = tích vô hướng các vector đã chuẩn hóa L2"""
+    from chatbot import preprocess_vietnamese_batch
+
+    query_vectors = chatbot.query_vectorizer.transform(preprocess_vietnamese_batch(queries))
+    corpus_t = chatbot.question_vectors.T.tocsr()
+
+    def score_fn(start, end):
+        return (query_vectors[start:end] @ corpus_t).toarray()
+    return score_fn, len(chatbot.questions)
+
+
+def semantic_scorer(chatbot_pro, queries, batch_size=4096):
+    """Hàm chấm điểm theo khối của ChatbotPro: cosine với toàn bộ corpus (như ExactIndex)"""
+    from chatbot_pro import normalize_query
+
+    texts = [normalize_query(query) for query in queries]
+    # Encode theo lô qua bộ nhớ đệm embedding câu hỏi: lần chạy lại chỉ encode query mới
+    embeddings = np.concatenate([
+        chatbot_pro._encode_queries(texts[start:start + batch_size]).numpy()
+        for start in range(0, len(texts), batch_size)
+    ]) if texts else np.empty((0, 1), dtype=np.float32)
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    corpus = chatbot_pro.corpus_embeddings.detach().cpu().numpy().astype(np.float32, copy=False)
+    inverse_norms = 1.0 / np.maximum(np.linalg.norm(corpus, axis=1), 1e-12)
+
+    def score_fn(start, end):
+        return (embeddings[start:end] @ corpus.T) * inverse_norms
+    return score_fn, len(chatbot_pro.questions)
+
+
+def evaluate_engine(name, chatbot, queries, expected, thresholds, ks=DEFAULT_KS, target_precision=(0.95, 0.6),
+                    n_errors=10):
+    """
+    Đánh giá một engine trên các query có nhãn
+
+    Args:
+        name: 'tfidf' hoặc 'semantic'
+        chatbot: Engine đã khởi tạo
+        queries, expected: Các query và câu hỏi đúng (xem load_labels)
+        thresholds: Dải ngưỡng cần quét
+        ks: Các k của accuracy@k
+        target_precision: Precision mục tiêu cho (ngưỡng cao, ngưỡng thấp) đề xuất
+        n_errors: Số lỗi tự tin nhất (sai với điểm cao nhất) ghi vào báo cáo
+
+    Returns:
+        Dict báo cáo
+    """
+    start = time.perf_counter()
+    score_fn, n_rows = (tfidf_scorer if name == 'tfidf' else semantic_scorer)(chatbot, queries)
+    encode_seconds = time.perf_counter() - start
+
+    gold = gold_indices(chatbot.questions, expected)
+    start = time.perf_counter()
+    # Phá hòa như engine: Chatbot ưu tiên chỉ số lớn, ChatbotPro chỉ số nhỏ
+    ties = 'highest' if name == 'tfidf' else 'lowest'
+    top1_scores, top1_indices, ranks = score_blocks(score_fn, len(queries), n_rows, gold, ties)
+    score_seconds = time.perf_counter() - start
+
+    # Query có nhãn không tìm thấy trong corpus bị bỏ qua
+    valid = gold != -2
+    answerable = gold >= 0
+    negative = gold == -1
+    correct = answerable & (top1_indices == gold)
+    n_answerable = int(answerable.sum())
+    n_negative = int(negative.sum())
+    table = ScoreTable(top1_scores[valid], correct[valid], negative[valid])
+
+    labelled_ranks = ranks[answerable]
+    sweep = threshold_sweep(table, thresholds, n_answerable, n_negative)
+    high_target, low_target = target_precision
+    if name == 'tfidf':
+        current = {'similarity_threshold': chatbot.similarity_threshold}
+        tiers = [('answer', ('>=', chatbot.similarity_threshold), None),
+                 ('fallback', None, ('>=', chatbot.similarity_threshold))]
+        recommended = {'similarity_threshold': recommend(sweep, low_target)}
+    else:
+        current = {'high_threshold': chatbot.high_threshold, 'low_threshold': chatbot.low_threshold}
+        # Như ChatbotPro.confidence_tier: cao >= high, trung bình > low, còn lại xin lỗi
+        tiers = [('high', ('>=', chatbot.high_threshold), None),
+                 ('medium', ('>', chatbot.low_threshold), ('>=', chatbot.high_threshold)),
+                 ('fallback', None, ('>', chatbot.low_threshold))]
+        recommended = {'high_threshold': recommend(sweep, high_target),
+                       'low_threshold': recommend(sweep, low_target)}
+
+    wrong = np.flatnonzero(valid & ~correct)
+    confident = wrong[np.argsort(-top1_scores[wrong], kind='stable')[:n_errors]]
+    return {
+        'engine': name,
+        'queries': len(queries),
+        'answerable': n_answerable,
+        'negatives': n_negative,
+        'unknown_labels': int((~valid).sum()),
+        'accuracy_at_k': {str(k): float(np.mean(labelled_ranks <= k)) if n_answerable else 0.0 for k in ks},
+        'mrr': float(np.mean(1.0 / labelled_ranks)) if n_answerable else 0.0,
+        'current_thresholds': current,
+        'tiers': tier_report(table, tiers, n_answerable, n_negative),
+        'target_precision': {'high': high_target, 'low': low_target},
+        'recommended_thresholds': recommended,
+        'sweep': {key: np.round(values, 6).tolist() for key, values in sweep.items()},
+        'confident_errors': [{
+            'query': queries[i],
+            'expected': expected[i],
+            'matched': chatbot.questions[top1_indices[i]],
+            'score': float(top1_scores[i]),
+        } for i in confident],
+        'encode_seconds': encode_seconds,
+        'score_seconds': score_seconds,
+    }
+
+
+def print_report(report):
+    """In tóm tắt báo cáo của một engine"""
+    print(f"\n=== {report['engine']}: {report['queries']} query ({report['answerable']} có câu trả lời, "
+          f"{report['negatives']} không có, {report['unknown_labels']} nhãn không có trong corpus)")
+    print(f"encode {report['encode_seconds']:.2f}s, chấm điểm {report['score_seconds']:.2f}s")
+    accuracy = ', '.join(f"@{k} {value:.3f}" for k, value in report['accuracy_at_k'].items())
+    print(f"Accuracy: {accuracy}; MRR {report['mrr']:.3f}")
+    print(f"Ngưỡng hiện tại {report['current_thresholds']}:")
+    for tier, stats in report['tiers'].items():
+        print(f"  {tier:>9}: {stats['queries']:>7} query, precision {stats['precision']:.3f}, "
+              f"recall {stats['recall']:.3f}, không có câu trả lời {stats['negatives']}")
+    print(f"Ngưỡng đề xuất (precision {report['target_precision']}): {report['recommended_thresholds']}")
+    if report['confident_errors']:
+        print("Sai với điểm cao nhất:")
+        for error in report['confident_errors'][:5]:
+            print(f"  {error['score']:.3f} {error['query']!r} -> {error['matched']!r} "
+                  f"(đúng: {error['expected'] or '(không có)'!r})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đánh giá offline và hiệu chỉnh ngưỡng của chatbot")
+    parser.add_argument('labels', help="File CSV có các cột query, question (để trống nếu không có câu trả lời)")
+    parser.add_argument('--csv', default='data_converted.csv')
+    parser.add_argument('--engines', nargs='+', choices=['tfidf', 'semantic'], default=['tfidf', 'semantic'])
+    parser.add_argument('--k', type=int, nargs='+', default=list(DEFAULT_KS), help="Các k của accuracy@k")
+    parser.add_argument('--step', type=float, default=0.01, help="Bước của dải ngưỡng [0, 1]")
+    parser.add_argument('--target-precision', type=float, nargs=2, default=[0.95, 0.6], metavar=('HIGH', 'LOW'),
+                        help="Precision mục tiêu của ngưỡng cao (trả lời trực tiếp) và ngưỡng thấp (trả lời)")
+    parser.add_argument('--cache-dir', default='.embedding_cache')
+    parser.add_argument('--query-embeddings', default='.embedding_cache/eval_query_embeddings.npz',
+                        help="File lưu embedding các query giữa các lần đánh giá (semantic)")
+    parser.add_argument('--output', help="Ghi báo cáo JSON ra file")
+    args = parser.parse_args()
+
+    try:
+        queries, expected = load_labels(args.labels)
+    except (OSError, ValueError) as e:
+        print(f"✗ Không đọc được file nhãn: {e}")
+        sys.exit(1)
+    thresholds = np.round(np.arange(0.0, 1.0 + args.step / 2, args.step), 6)
+
+    registry = EngineRegistry(idle_seconds=None)
+    reports = []
+    for name in args.engines:
+        if name == 'tfidf':
+            chatbot = registry.get('tfidf', csv_file=args.csv, result_cache_size=0)
+        else:
+            # Đủ chỗ cho embedding mọi query (384 chiều float32 ~ 1.5 KB)
+            chatbot = registry.get('semantic', csv_file=args.csv, cache_dir=args.cache_dir, result_cache_size=0,
+                                   query_embedding_bytes=max(len(queries), 1) * 4096,
+                                   query_embedding_path=args.query_embeddings)
+        if chatbot is None:
+            print(f"✗ Không khởi tạo được engine {name} từ {args.csv}")
+            sys.exit(1)
+        report = evaluate_engine(name, chatbot, queries, expected, thresholds, ks=args.k,
+                                 target_precision=tuple(args.target_precision))
+        if name == 'semantic':
+            chatbot.save_query_embeddings()
+        print_report(report)
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'labels': args.labels, 'csv': args.csv, 'engines': reports}, file, ensure_ascii=False,
+                      indent=2)
+        print(f"\n✓ Đã ghi báo cáo vào {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cập nhật tăng dần dữ liệu của chatbot và compaction chạy nền
+
+add_pairs/remove_pairs/update_pair chỉ cập nhật phần bị thay đổi (rẻ nhưng xấp
+xỉ: Chatbot giữ nguyên vocabulary/IDF cũ, chỉ mục IVF giữ nguyên các cụm cũ).
+Thread nền định kỳ gọi engine.compact() khi có thay đổi đang chờ để khôi phục
+mô hình chính xác như khi huấn luyện lại từ đầu.
+"""
+
+import threading
+
+import numpy as np
+
+
+def clean_pairs(pairs):
+    """Chuẩn hóa danh sách cặp (question, answer): bỏ khoảng trắng thừa và các cặp rỗng"""
+    cleaned = []
+    for question, answer in pairs:
+        question = question.strip()
+        answer = answer.strip()
+        if question and answer:
+            cleaned.append((question, answer))
+    return cleaned
+
+
+def check_indices(indices, n):
+    """Mảng chỉ số (không trùng, tăng dần) trong [0, n); chỉ số âm tính từ cuối như list"""
+    indices = np.asarray(list(indices), dtype=np.int64)
+    if len(indices) and (indices.min() < -n or indices.max() >= n):
+        raise IndexError(f"Chỉ số câu hỏi nằm ngoài phạm vi [0, {n})")
+    return np.unique(np.where(indices < 0, indices + n, indices))
+
+
+class BackgroundCompactor(threading.Thread):
+    """
+    Thread gọi engine.compact() mỗi interval giây nếu
+    engine.pending_changes >= min_changes
+    """
+
+    def __init__(self, engine, interval=300.0, min_changes=1):
+        """
+        Args:
+            engine: Chatbot hoặc ChatbotPro (có pending_changes và compact())
+            interval: Số giây giữa hai lần kiểm tra
+            min_changes: Số thay đổi tối thiểu để chạy compaction
+        """
+        super().__init__(name='compaction', daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.min_changes = min_changes
+        self.runs = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            if self.engine.pending_changes >= self.min_changes:
+                try:
+                    if self.engine.compact():
+                        self.runs += 1
+                except Exception as e:
+                    print(f"✗ Lỗi khi compaction: {e}")
+
+    def stop(self, timeout=None):
+        """Dừng thread (chờ lần compaction đang chạy, nếu có, kết thúc)"""
+        self._stop_event.set()
+        self.join(timeout)
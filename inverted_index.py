@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chỉ mục ngược (inverted index) cho Chatbot TF-IDF
+
+Mỗi term (từ đơn/cụm 2 từ) trỏ tới danh sách (câu hỏi, trọng số TF-IDF) chứa nó.
+Khi tìm kiếm, chỉ các câu hỏi có chung ít nhất một term với câu hỏi người dùng
+mới được cộng điểm, nên chi phí tỉ lệ với độ dài các posting list thay vì kích
+thước corpus. Với top-1, việc cộng điểm dừng sớm khi câu hỏi đang dẫn đầu không
+thể bị vượt qua bởi phần điểm còn lại.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from retrieval import top_k as select_top_k
+
+
+# Biên an toàn khi so điểm cộng dở dang với cận trên (sai số làm tròn của float64)
+BOUND_SLACK = 1e-9
+
+class InvertedIndex:
+    """
+    Chỉ mục ngược xây từ ma trận TF-IDF (các dòng đã chuẩn hóa L2)
+
+    Posting list của term t là doc_ids[term_ptr[t]:term_ptr[t + 1]] (tăng dần)
+    cùng weights tương ứng, tức chính là ma trận ở dạng CSC; rows giữ chính ma
+    trận đó ở dạng CSR để tra điểm của một câu hỏi.
+    """
+
+    def __init__(self, term_ptr, doc_ids, weights, n_docs, rows):
+        """
+        Args:
+            term_ptr: Mảng (n_terms + 1,) vị trí bắt đầu posting list của từng term
+            doc_ids: Chỉ số câu hỏi trong các posting list
+            weights: Trọng số TF-IDF tương ứng với doc_ids
+            n_docs: Số câu hỏi trong corpus
+            rows: Cùng ma trận ở dạng CSR (n_docs, n_terms), cột tăng dần trong mỗi dòng
+        """
+        self.term_ptr = term_ptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.n_docs = n_docs
+        self.rows = rows
+
+        # Trọng số lớn nhất của mỗi term: cận trên cho phần điểm term đó đóng góp
+        self.max_weights = np.zeros(len(term_ptr) - 1, dtype=weights.dtype)
+        non_empty = np.flatnonzero(np.diff(term_ptr))
+        if len(non_empty):
+            self.max_weights[non_empty] = np.maximum.reduceat(weights, term_ptr[non_empty])
+
+    @classmethod
+    def from_matrix(cls, question_vectors):
+        """
+        Xây chỉ mục ngược từ ma trận TF-IDF của các câu hỏi
+
+        Args:
+            question_vectors: Ma trận thưa (n_docs, n_terms)
+        """
+        rows = csr_matrix(question_vectors)
+        if not rows.has_sorted_indices:
+            rows = rows.sorted_indices()
+        csc = rows.tocsc()
+        csc.sort_indices()
+        return cls(csc.indptr, csc.indices, csc.data, csc.shape[0], rows)
+
+    def search(self, query_vector, top_k=1):
+        """
+        Tìm các câu hỏi có điểm (dot product) cao nhất với câu hỏi người dùng
+
+        Điểm trả về được cộng theo thứ tự cột tăng dần như phép nhân ma trận thưa
+        query_vector @ ma_trận.T, nên giống hệt phép nhân đó đến từng bit.
+
+        Args:
+            query_vector: Vector TF-IDF (1, n_terms) của câu hỏi người dùng, đã chuẩn hóa L2
+            top_k: Số kết quả cần lấy
+
+        Returns:
+            List cặp (index, score) theo điểm giảm dần, bằng điểm thì chỉ số lớn trước
+            như find_answer() trước đây; chỉ gồm các câu hỏi có chung ít nhất một
+            term với câu hỏi người dùng
+        """
+        query = csr_matrix(query_vector)
+        return self.search_terms(query.indices, query.data, top_k)
+
+    def search_terms(self, terms, query_weights, top_k=1):
+        """
+        Như search() nhưng câu hỏi người dùng cho dưới dạng các term và trọng số của nó
+
+        Args:
+            terms: Mảng chỉ số term (cột) của câu hỏi người dùng
+            query_weights: Trọng số TF-IDF (đã chuẩn hóa L2) tương ứng với terms
+            top_k: Số kết quả cần lấy
+        """
+        if len(terms) == 0 or top_k <= 0:
+            return []
+        # Thứ tự cột tăng dần: thứ tự cộng của phép nhân ma trận thưa
+        order = np.argsort(terms, kind='stable')
+        terms = np.asarray(terms)[order]
+        query_weights = np.asarray(query_weights, dtype=np.float64)[order]
+
+        if top_k == 1:
+            best = self._early_best(terms, query_weights)
+            if best is not None:
+                return [(best, self._exact_score(best, terms, query_weights))]
+
+        # Cộng điểm mọi câu hỏi theo thứ tự cột (bincount cộng tuần tự theo thứ tự phần tử)
+        starts, ends = self.term_ptr[terms], self.term_ptr[terms + 1]
+        docs, inverse = np.unique(
+            np.concatenate([self.doc_ids[start:end] for start, end in zip(starts, ends)]),
+            return_inverse=True
+        )
+        scores = np.bincount(inverse, weights=np.concatenate([
+            self.weights[start:end] * query_weight
+            for start, end, query_weight in zip(starts, ends, query_weights)
+        ]))
+        return [(int(docs[position]), score) for position, score in select_top_k(scores, top_k, ties='highest')]
+
+    def _early_best(self, terms, query_weights):
+        """
+        Câu hỏi top-1 nếu xác định được trước khi cộng hết các term, ngược lại None
+
+        Các term có đóng góp tiềm năng lớn nhất được cộng trước vào một mảng điểm
+        của cả corpus; câu hỏi dẫn đầu và câu hỏi thứ hai được cập nhật chỉ từ các
+        câu hỏi vừa được cộng điểm (điểm chỉ tăng). Dừng khi câu hỏi dẫn đầu hơn mọi
+        câu hỏi khác cả khi chúng nhận hết phần điểm còn lại. Điểm ở đây chỉ dùng để
+        quyết định, điểm trả về do _exact_score tính lại.
+        """
+        bounds = query_weights * self.max_weights[terms]
+        order = np.argsort(-bounds, kind='stable')
+        # remaining[i]: cận trên tổng điểm từ các term order[i:]
+        remaining = np.concatenate([np.cumsum(bounds[order][::-1])[::-1], [0.0]])
+
+        scores = np.zeros(self.n_docs, dtype=np.float64)
+        # Hai câu hỏi điểm cao nhất: doc -> điểm. Điểm chỉ tăng nên hai câu hỏi dẫn đầu
+        # mới nằm trong hai câu hỏi dẫn đầu cũ và hai câu hỏi cao nhất vừa được cộng điểm
+        leaders = {}
+        for step, position in enumerate(order[:-1]):
+            term = terms[position]
+            start, end = self.term_ptr[term], self.term_ptr[term + 1]
+            if start == end:
+                continue
+            docs = self.doc_ids[start:end]
+            # doc_ids trong một posting list không trùng nhau nên += không bị mất phần cộng
+            scores[docs] += self.weights[start:end] * query_weights[position]
+
+            leaders = {doc: scores[doc] for doc in leaders}
+            touched = scores[docs]
+            first = int(touched.argmax())
+            leaders[int(docs[first])] = touched[first]
+            if len(docs) > 1:
+                touched[first] = -np.inf
+                second = int(touched.argmax())
+                leaders[int(docs[second])] = touched[second]
+            ranked = sorted(leaders.items(), key=lambda item: item[1], reverse=True)[:2]
+            leaders = dict(ranked)
+
+            # Câu hỏi khác (đã thấy hoặc chưa) tối đa đạt điểm thứ hai + phần còn lại;
+            # BOUND_SLACK bù sai số làm tròn của thứ tự cộng khác thứ tự cột
+            runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+            if ranked[0][1] > runner_up + remaining[step + 1] + BOUND_SLACK:
+                return ranked[0][0]
+        return None
+
+    def _exact_score(self, doc, terms, query_weights):
+        """Điểm đầy đủ của một câu hỏi: các term chung với dòng của doc, cộng tuần tự theo thứ tự của terms"""
+        start, end = self.rows.indptr[doc], self.rows.indptr[doc + 1]
+        row_terms = self.rows.indices[start:end]
+        if len(row_terms) == 0:
+            return np.float64(0.0)
+        positions = np.minimum(np.searchsorted(row_terms, terms), len(row_terms) - 1)
+        shared = row_terms[positions] == terms
+        products = self.rows.data[start:end][positions[shared]] * query_weights[shared]
+        # cumsum cộng tuần tự (np.sum cộng theo cặp nên có thể lệch bit cuối)
+        return np.cumsum(products)[-1] if len(products) else np.float64(0.0)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Đo thời gian các bước xử lý và đếm sự kiện của chatbot (metrics)
+
+Các chatbot nhận một đối tượng Metrics (mặc định None = tắt) và ghi lại:
+- chatbot_stage_seconds{engine, stage}: thời gian từng bước (preprocess,
+  transform, encode, shortlist, similarity, format)
+- chatbot_request_seconds{engine, method}: tổng thời gian find_answer/answer/answer_many
+- chatbot_cache_total{engine, result}: số lần tra bộ nhớ đệm kết quả (hit/miss)
+- chatbot_answers_total{engine, tier}: số câu trả lời theo mức độ tin cậy
+
+Metrics chuyển mỗi phép đo tới các sink: InMemorySink (giữ counter và histogram
+trong bộ nhớ), PrometheusSink (như InMemorySink, xuất dạng text của Prometheus)
+và JsonLogSink (ghi mỗi phép đo thành một dòng JSON). Khi metrics là None các
+hàm stage()/request() trả về NULL_SPAN nên chi phí chỉ là một lời gọi hàm.
+
+StartupReport ghi thời gian các giai đoạn khởi động của từng engine (import,
+đọc dữ liệu, tải mô hình, build chỉ mục), luôn bật vì chỉ đo vài lần.
+"""
+
+import bisect
+import functools
+import json
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+STAGE_SECONDS = 'chatbot_stage_seconds'
+REQUEST_SECONDS = 'chatbot_request_seconds'
+CACHE_TOTAL = 'chatbot_cache_total'
+ANSWERS_TOTAL = 'chatbot_answers_total'
+
+# Các mốc (giây) của histogram độ trễ
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Context manager không làm gì, dùng khi metrics bị tắt
+NULL_SPAN = nullcontext()
+
+
+class _Span:
+    """Đo thời gian của khối with và ghi vào histogram name"""
+
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.emit_observation(self.name, self.labels, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    Điểm ghi metrics của các chatbot: chuyển counter và phép đo thời gian tới các sink
+    """
+
+    def __init__(self, *sinks):
+        """
+        Args:
+            *sinks: Các sink nhận phép đo (InMemorySink, PrometheusSink, JsonLogSink...)
+        """
+        self.sinks = list(sinks)
+
+    def add_sink(self, sink):
+        """Thêm một sink"""
+        self.sinks.append(sink)
+
+    def span(self, name, **labels):
+        """Context manager đo thời gian khối with (giây) vào histogram name"""
+        return _Span(self, name, tuple(sorted(labels.items())))
+
+    def observe(self, name, value, **labels):
+        """Ghi một giá trị vào histogram name"""
+        self.emit_observation(name, tuple(sorted(labels.items())), value)
+
+    def increment(self, name, amount=1, **labels):
+        """Tăng counter name"""
+        labels = tuple(sorted(labels.items()))
+        for sink in self.sinks:
+            sink.record_counter(name, labels, amount)
+
+    def emit_observation(self, name, labels, value):
+        """Gửi một giá trị (labels là tuple các cặp (tên, giá trị) đã sắp xếp) tới các sink"""
+        for sink in self.sinks:
+            sink.record_observation(name, labels, value)
+
+
+def stage(metrics, engine, name):
+    """Span đo một bước xử lý của engine (NULL_SPAN nếu metrics là None)"""
+    if metrics is None:
+        return NULL_SPAN
+    return metrics.span(STAGE_SECONDS, engine=engine, stage=name)
+
+
+def request(metrics, engine, method):
+    """Span đo tổng thời gian một lời gọi của engine (NULL_SPAN nếu metrics là None)"""
+    if metrics is None:
+        return NULL_SPAN
+    return metrics.span(REQUEST_SECONDS, engine=engine, method=method)
+
+
+def count_cache(metrics, engine, hit):
+    """Đếm một lần tra bộ nhớ đệm kết quả"""
+    if metrics is not None:
+        metrics.increment(CACHE_TOTAL, engine=engine, result='hit' if hit else 'miss')
+
+
+def count_answer(metrics, engine, tier):
+    """Đếm một câu trả lời theo mức độ tin cậy"""
+    if metrics is not None:
+        metrics.increment(ANSWERS_TOTAL, engine=engine, tier=tier)
+
+
+class StartupReport:
+    """
+    Thời gian (giây) các giai đoạn khởi động của một engine, theo thứ tự chạy
+    """
+
+    def __init__(self):
+        self.phases = {}
+
+    def record(self, name, seconds):
+        """Ghi thời gian của giai đoạn name (chạy lại thì ghi đè)"""
+        self.phases[name] = seconds
+
+    def total(self):
+        """Tổng thời gian khởi động"""
+        return sum(self.phases.values())
+
+    def as_dict(self):
+        return dict(self.phases, total=self.total())
+
+    def __str__(self):
+        phases = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in self.phases.items())
+        return f'{phases} (tổng {self.total():.2f}s)'
+
+
+def startup_phase(name):
+    """Decorator: ghi thời gian chạy của method vào self.startup (StartupReport) với tên name"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.startup.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class InMemorySink:
+    """
+    Giữ counter và histogram trong bộ nhớ, an toàn khi dùng từ nhiều thread
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            buckets: Các mốc tăng dần của histogram
+        """
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record_counter(self, name, labels, amount):
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def record_observation(self, name, labels, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                # Số lần theo từng mốc (phần tử cuối: lớn hơn mọi mốc), tổng, số lần
+                histogram = self._histograms[(name, labels)] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][position] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def counter(self, name, **labels):
+        """Giá trị hiện tại của counter (0 nếu chưa có)"""
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def snapshot(self):
+        """
+        Ảnh chụp các metrics (dạng JSON được)
+
+        Returns:
+            Dict {'counters': {name: [{'labels', 'value'}]},
+                  'histograms': {name: [{'labels', 'count', 'sum', 'buckets': {mốc: số lần tích lũy}}]}}
+        """
+        with self._lock:
+            counters = {}
+            for (name, labels), value in sorted(self._counters.items()):
+                counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            histograms = {}
+            for (name, labels), (counts, total, count) in sorted(self._histograms.items()):
+                cumulative = 0
+                buckets = {}
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    buckets['+Inf' if bound == float('inf') else repr(bound)] = cumulative
+                histograms.setdefault(name, []).append({'labels': dict(labels), 'count': count,
+                                                        'sum': total, 'buckets': buckets})
+        return {'counters': counters, 'histograms': histograms}
+
+    def reset(self):
+        """Xóa toàn bộ counter và histogram"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def _format_labels(labels):
+    """{a="1",b="2"} theo cú pháp Prometheus (labels là các cặp (tên, giá trị))"""
+    if not labels:
+        return ''
+    escaped = ((name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class PrometheusSink(InMemorySink):
+    """
+    InMemorySink xuất được dạng text của Prometheus (dùng cho GET /metrics)
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def render(self):
+        """Toàn bộ metrics theo định dạng text exposition của Prometheus"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, series in snapshot['counters'].items():
+            lines.append(f'# TYPE {name} counter')
+            for row in series:
+                lines.append(f"{name}{_format_labels(list(row['labels'].items()))} {row['value']}")
+        for name, series in snapshot['histograms'].items():
+            lines.append(f'# TYPE {name} histogram')
+            for row in series:
+                labels = list(row['labels'].items())
+                for bound, count in row['buckets'].items():
+                    lines.append(f"{name}_bucket{_format_labels(labels + [('le', bound)])} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {row['sum']!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {row['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+class JsonLogSink:
+    """
+    Ghi mỗi phép đo thành một dòng JSON (để đưa vào hệ thống log)
+    """
+
+    def __init__(self, stream=None):
+        """
+        Args:
+            stream: File (text) để ghi (mặc định: sys.stderr)
+        """
+        self.stream = stream if stream is not None else sys.stderr
+        self._lock = threading.Lock()
+
+    def _write(self, kind, name, labels, value):
+        line = json.dumps({'time': time.time(), 'kind': kind, 'name': name, 'labels': dict(labels),
+                           'value': value}, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def record_counter(self, name, labels, amount):
+        self._write('counter', name, labels, amount)
+
+    def record_observation(self, name, labels, value):
+        self._write('observation', name, labels, value)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bộ encode câu hỏi chạy bằng ONNX Runtime trên CPU (thay cho PyTorch)
+
+Mô hình sentence-transformers được export một lần ra file ONNX (transformer +
+pooling trong cùng một đồ thị), có thể lượng tử hóa động sang int8, rồi chạy
+bằng onnxruntime với số thread tùy chỉnh. OnnxEncoder có cùng giao diện encode()
+với SentenceTransformer nên ChatbotPro dùng được trực tiếp
+(ChatbotPro(encoder_backend='onnx')).
+
+Thư mục export của mỗi mô hình chứa:
+    model.onnx, model.int8.onnx (nếu lượng tử hóa)
+    các file tokenizer (tokenizer.save_pretrained)
+    encoder.json: max_seq_length, pooling, normalize, số chiều
+
+Cần thư viện tùy chọn onnxruntime (pip install onnxruntime); export cần thêm
+sentence-transformers và torch như backend mặc định.
+"""
+
+import json
+import os
+import re
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+META_FILE = 'encoder.json'
+MODEL_FILE = 'model.onnx'
+QUANTIZED_FILE = 'model.int8.onnx'
+OPSET_VERSION = 17
+
+# Câu hỏi mẫu dùng để đo khi chọn số thread
+TUNING_SENTENCES = [
+    "AI là gì?",
+    "Làm sao để tránh Overfitting khi huấn luyện mô hình học máy?",
+    "Chatbot có thể trả lời những loại câu hỏi nào và hoạt động như thế nào?",
+]
+
+
+class _PooledEncoder(torch.nn.Module):
+    """Transformer + pooling (+ chuẩn hóa) của sentence-transformers trong một module để export"""
+
+    def __init__(self, transformer, pooling, normalize):
+        super().__init__()
+        self.transformer = transformer
+        self.pooling = pooling
+        self.normalize = normalize
+
+    def forward(self, input_ids, attention_mask):
+        token_embeddings = self.transformer(input_ids=input_ids, attention_mask=attention_mask)[0]
+        if self.pooling == 'cls':
+            embeddings = token_embeddings[:, 0]
+        else:
+            mask = attention_mask.unsqueeze(-1).to(token_embeddings.dtype)
+            embeddings = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        if self.normalize:
+            embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+        return embeddings
+
+
+def model_directory(export_dir, model_name):
+    """Thư mục export của mô hình model_name"""
+    return os.path.join(export_dir, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+
+
+def export_model(model_name, directory, quantize=False):
+    """
+    Export mô hình sentence-transformers ra ONNX
+
+    Args:
+        model_name: Tên (hoặc đường dẫn) mô hình sentence-transformers
+        directory: Thư mục đích (được thay thế nguyên tử khi export xong)
+        quantize: Tạo thêm bản lượng tử hóa động int8 (model.int8.onnx)
+
+    Raises:
+        ValueError: Mô hình có module không hỗ trợ (chỉ hỗ trợ Transformer +
+            Pooling mean/cls + Normalize)
+    """
+    from sentence_transformers import SentenceTransformer
+
+    st_model = SentenceTransformer(model_name, device='cpu')
+    modules = list(st_model)
+    names = [type(module).__name__ for module in modules]
+    if names[:2] != ['Transformer', 'Pooling'] or any(name != 'Normalize' for name in names[2:]):
+        raise ValueError(f"Không export được mô hình {model_name}: chỉ hỗ trợ Transformer + Pooling "
+                         f"(+ Normalize), mô hình có {names}")
+    # sentence-transformers >= 6 lưu tên chế độ pooling trực tiếp, bản cũ hơn dùng get_pooling_mode_str()
+    pooling = getattr(modules[1], 'pooling_mode', None)
+    if not isinstance(pooling, str):
+        pooling = modules[1].get_pooling_mode_str()
+    if pooling not in ('mean', 'cls'):
+        raise ValueError(f"Không export được mô hình {model_name}: pooling '{pooling}' chưa được hỗ trợ")
+
+    transformer = modules[0]
+    encoder = _PooledEncoder(transformer.auto_model, pooling, 'Normalize' in names).eval()
+    sample = transformer.tokenizer(TUNING_SENTENCES, padding=True, return_tensors='pt')
+
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix='.export-')
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                encoder, (sample['input_ids'], sample['attention_mask']),
+                os.path.join(staging, MODEL_FILE),
+                input_names=['input_ids', 'attention_mask'],
+                output_names=['sentence_embedding'],
+                dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                              'attention_mask': {0: 'batch', 1: 'sequence'},
+                              'sentence_embedding': {0: 'batch'}},
+                opset_version=OPSET_VERSION,
+                dynamo=False,
+            )
+        transformer.tokenizer.save_pretrained(staging)
+        if quantize:
+            quantize_model(staging)
+        with open(os.path.join(staging, META_FILE), 'w', encoding='utf-8') as file:
+            json.dump({
+                'model_name': model_name,
+                'max_seq_length': st_model.max_seq_length,
+                'do_lower_case': bool(getattr(transformer, 'do_lower_case', False)),
+                'pooling': pooling,
+                'normalize': 'Normalize' in names,
+                'dimension': st_model.get_sentence_embedding_dimension(),
+            }, file, indent=2)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(staging, directory)
+    finally:
+        if os.path.isdir(staging):
+            shutil.rmtree(staging)
+
+
+def quantize_model(directory):
+    """Lượng tử hóa động (trọng số int8) model.onnx thành model.int8.onnx"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(os.path.join(directory, MODEL_FILE), os.path.join(directory, QUANTIZED_FILE),
+                     weight_type=QuantType.QInt8)
+
+
+class OnnxEncoder:
+    """
+    Encode câu hỏi bằng mô hình sentence-transformers đã export ra ONNX
+    """
+
+    def __init__(self, model_name, export_dir='.onnx_models', quantize=False, intra_op_threads=None,
+                 inter_op_threads=1, batch_size=32):
+        """
+        Args:
+            model_name: Tên mô hình sentence-transformers (export ở lần dùng đầu tiên)
+            export_dir: Thư mục chứa các mô hình đã export
+            quantize: Dùng bản lượng tử hóa động int8 (nhanh hơn, lệch điểm nhiều hơn)
+            intra_op_threads: Số thread cho mỗi phép tính: số nguyên, None (mặc định
+                của onnxruntime) hoặc 'auto' (đo và chọn số thread nhanh nhất, xem tune_threads)
+            inter_op_threads: Số thread chạy song song các nhánh của đồ thị
+            batch_size: Số câu mỗi lần chạy mô hình khi encode nhiều câu
+        """
+        if onnxruntime is None:
+            raise ImportError("Encoder 'onnx' cần thư viện onnxruntime: pip install onnxruntime")
+        self.model_name = model_name
+        self.quantize = quantize
+        self.inter_op_threads = inter_op_threads
+        self.batch_size = batch_size
+        self.directory = model_directory(export_dir, model_name)
+
+        if not os.path.exists(os.path.join(self.directory, META_FILE)):
+            export_model(model_name, self.directory, quantize=quantize)
+        elif quantize and not os.path.exists(os.path.join(self.directory, QUANTIZED_FILE)):
+            quantize_model(self.directory)
+
+        with open(os.path.join(self.directory, META_FILE), 'r', encoding='utf-8') as file:
+            self.meta = json.load(file)
+        self.max_seq_length = self.meta['max_seq_length']
+
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(self.directory)
+
+        self.intra_op_threads = None
+        self.session = None
+        if intra_op_threads == 'auto':
+            self.tune_threads()
+        else:
+            self._create_session(intra_op_threads)
+
+    def _create_session(self, intra_op_threads):
+        """Tạo InferenceSession với số thread intra_op_threads (None = mặc định)"""
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = self.inter_op_threads
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        model_file = QUANTIZED_FILE if self.quantize else MODEL_FILE
+        self.session = onnxruntime.InferenceSession(os.path.join(self.directory, model_file), options,
+                                                    providers=['CPUExecutionProvider'])
+        self.intra_op_threads = intra_op_threads
+
+    def tune_threads(self, candidates=None, sentences=None, repeat=20):
+        """
+        Chọn số thread cho độ trễ encode một câu hỏi thấp nhất
+
+        Args:
+            candidates: Các số thread cần thử (mặc định: 1, 2, 4, ... tới số CPU)
+            sentences: Các câu hỏi mẫu (mặc định: TUNING_SENTENCES)
+            repeat: Số lần đo mỗi câu
+
+        Returns:
+            Dict số thread -> độ trễ trung vị (ms); số thread được chọn ở self.intra_op_threads
+        """
+        if candidates is None:
+            n_cpus = os.cpu_count() or 1
+            candidates = sorted({min(2 ** i, n_cpus) for i in range(n_cpus.bit_length() + 1)})
+        sentences = sentences or TUNING_SENTENCES
+
+        timings = {}
+        for threads in candidates:
+            self._create_session(threads)
+            self.encode(sentences[0])
+            samples = []
+            for _ in range(repeat):
+                for sentence in sentences:
+                    start = time.perf_counter()
+                    self.encode(sentence)
+                    samples.append(time.perf_counter() - start)
+            timings[threads] = statistics.median(samples) * 1000
+        self._create_session(min(timings, key=timings.get))
+        return timings
+
+    def get_sentence_embedding_dimension(self):
+        return self.meta['dimension']
+
+    def encode(self, sentences, batch_size=None, show_progress_bar=False, convert_to_numpy=True,
+               convert_to_tensor=False, normalize_embeddings=False, **kwargs):
+        """
+        Encode một câu hoặc danh sách câu (giống SentenceTransformer.encode)
+
+        Returns:
+            np.ndarray float32 (hoặc torch.Tensor nếu convert_to_tensor=True) kích
+            thước (dim,) cho một câu, (n, dim) cho danh sách câu
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        batch_size = batch_size or self.batch_size
+
+        # Câu dài trước như sentence-transformers: các câu cùng lô có độ dài gần nhau, ít padding
+        order = np.argsort([-len(sentence) for sentence in sentences], kind='stable')
+        embeddings = np.empty((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(sentences), batch_size):
+            rows = order[start:start + batch_size]
+            batch = [sentences[row] for row in rows]
+            if self.meta['do_lower_case']:
+                batch = [sentence.lower() for sentence in batch]
+            tokens = self.tokenizer(batch, padding=True, truncation=True, max_length=self.max_seq_length,
+                                    return_tensors='np')
+            embeddings[rows] = self.session.run(['sentence_embedding'], {
+                'input_ids': tokens['input_ids'].astype(np.int64),
+                'attention_mask': tokens['attention_mask'].astype(np.int64),
+            })[0]
+
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        if single:
+            embeddings = embeddings[0]
+        return torch.from_numpy(embeddings) if convert_to_tensor else embeddings
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bộ nhớ đệm kết quả truy vấn (LRU + TTL) đặt trước các chatbot
+
+Lưu lượng thực tế tập trung vào một số ít câu hỏi phổ biến, nên kết quả của các
+câu hỏi đã chuẩn hóa được giữ lại thay vì encode và chấm điểm lại mỗi lần.
+
+Mỗi chatbot có một QueryCache riêng. Mọi mục trong bộ nhớ đệm thuộc về một
+"scope" (engine, mô hình, phiên bản corpus, các ngưỡng...): khi scope thay đổi
+(dữ liệu được thêm/sửa/huấn luyện lại hoặc đổi ngưỡng) toàn bộ bộ nhớ đệm bị xóa.
+
+QueryEmbeddingCache giữ embedding của câu hỏi người dùng cho ChatbotPro: embedding
+chỉ phụ thuộc vào mô hình (không phụ thuộc corpus hay ngưỡng) nên vẫn dùng được
+sau khi dữ liệu thay đổi, dùng chung được giữa các engine cùng mô hình và lưu
+được ra đĩa để dùng lại sau khi khởi động lại.
+
+ConversationContext giữ embedding và ứng viên của vài lượt hỏi gần nhất trong một
+phiên chat để ChatbotPro.answer_stream() hiểu câu nói rõ ý sau một câu trả lời
+"Có phải ý bạn là..." mà không phải encode lại các lượt trước.
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+class QueryCache:
+    """
+    Bộ nhớ đệm LRU có thời hạn (TTL), an toàn khi dùng từ nhiều thread
+    """
+
+    # Giá trị trả về của get() khi không có trong bộ nhớ đệm (kết quả có thể là None)
+    MISS = object()
+
+    def __init__(self, max_entries=1024, ttl=300.0):
+        """
+        Args:
+            max_entries: Số kết quả tối đa được giữ (mục ít dùng nhất bị loại trước)
+            ttl: Thời gian sống của mỗi kết quả, tính bằng giây (None = không hết hạn)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.scope = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_scope(self, scope):
+        """Xóa toàn bộ bộ nhớ đệm nếu scope khác scope hiện tại (gọi khi đang giữ lock)"""
+        if scope != self.scope:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.scope = scope
+
+    def get(self, scope, key):
+        """
+        Lấy kết quả đã lưu
+
+        Args:
+            scope: Trạng thái của chatbot mà kết quả phụ thuộc vào
+            key: Khóa của truy vấn (câu hỏi đã chuẩn hóa, top_k...)
+
+        Returns:
+            Kết quả đã lưu, hoặc QueryCache.MISS
+        """
+        with self._lock:
+            self._check_scope(scope)
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return self.MISS
+
+    def put(self, scope, key, value):
+        """Lưu kết quả của truy vấn key tính trên trạng thái scope"""
+        if self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._check_scope(scope)
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Xóa toàn bộ kết quả đã lưu (giữ nguyên các bộ đếm)"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Các bộ đếm hit/miss của bộ nhớ đệm"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+class QueryEmbeddingCache:
+    """
+    Bộ nhớ đệm embedding theo câu hỏi (LRU giới hạn theo dung lượng), an toàn khi
+    dùng từ nhiều thread
+
+    Scope là định danh của bộ encode (ChatbotPro.encoder_id): embeddings của mô
+    hình khác bị xóa khi scope thay đổi.
+    """
+
+    def __init__(self, max_bytes=16 * 2**20):
+        """
+        Args:
+            max_bytes: Dung lượng tối đa (embedding + khóa); mục ít dùng nhất bị loại trước
+        """
+        self.max_bytes = max_bytes
+        self.scope = None
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def entry_bytes(key, embedding):
+        """Dung lượng ước tính của một mục"""
+        return sys.getsizeof(key) + embedding.nbytes
+
+    def _check_scope(self, scope):
+        """Xóa toàn bộ bộ nhớ đệm nếu scope khác scope hiện tại (gọi khi đang giữ lock)"""
+        if scope != self.scope:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.nbytes = 0
+            self.scope = scope
+
+    def _put(self, key, embedding):
+        """Lưu một mục rồi loại các mục ít dùng nhất cho tới khi đủ dung lượng (gọi khi đang giữ lock)"""
+        size = self.entry_bytes(key, embedding)
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.nbytes -= self.entry_bytes(key, previous)
+        self._entries[key] = embedding
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            old_key, old_embedding = self._entries.popitem(last=False)
+            self.nbytes -= self.entry_bytes(old_key, old_embedding)
+            self.evictions += 1
+
+    def get_or_encode(self, scope, texts, encode_fn):
+        """
+        Embeddings của danh sách câu hỏi, chỉ encode các câu chưa có trong bộ nhớ đệm
+
+        Các câu trùng nhau trong texts chỉ được encode (và đếm hit/miss) một lần.
+
+        Args:
+            scope: Định danh bộ encode
+            texts: Danh sách câu hỏi (đã chuẩn hóa)
+            encode_fn: Hàm nhận list câu hỏi, trả về np.ndarray (k, dim)
+
+        Returns:
+            np.ndarray float32 (len(texts), dim)
+        """
+        unique = list(dict.fromkeys(texts))
+        found = {}
+        with self._lock:
+            self._check_scope(scope)
+            self.duplicates += len(texts) - len(unique)
+            for text in unique:
+                embedding = self._entries.get(text)
+                if embedding is not None:
+                    self._entries.move_to_end(text)
+                    found[text] = embedding
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+
+        missing = [text for text in unique if text not in found]
+        if missing:
+            # Encode ngoài lock: các thread khác vẫn tra được bộ nhớ đệm
+            encoded = np.asarray(encode_fn(missing), dtype=np.float32)
+            with self._lock:
+                self._check_scope(scope)
+                for text, embedding in zip(missing, encoded):
+                    # Bản sao riêng: không giữ cả ma trận của lô chỉ vì một dòng
+                    found[text] = embedding = embedding.copy()
+                    self._put(text, embedding)
+        if not found:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([found[text] for text in texts])
+
+    def clear(self):
+        """Xóa toàn bộ embeddings đã lưu (giữ nguyên các bộ đếm)"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Các bộ đếm hit/miss và dung lượng (dùng để chọn max_bytes)"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'batch_duplicates': self.duplicates,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def save(self, path):
+        """
+        Ghi bộ nhớ đệm ra file .npz (ghi file tạm rồi thay thế nguyên tử)
+
+        Returns:
+            True nếu ghi thành công
+        """
+        with self._lock:
+            if self.scope is None or not self._entries:
+                return False
+            scope = self.scope
+            keys = list(self._entries)
+            embeddings = np.stack(list(self._entries.values()))
+
+        directory = os.path.dirname(os.path.abspath(path))
+        temporary = os.path.join(directory, f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(temporary, 'wb') as file:
+                # Thứ tự LRU: mục ít dùng nhất trước
+                np.savez(file, scope=np.array(str(scope)), keys=np.array(keys, dtype=str),
+                         embeddings=embeddings)
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f"✗ Không ghi được bộ nhớ đệm embedding câu hỏi: {e}")
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return False
+        return True
+
+    def load(self, path):
+        """
+        Đọc bộ nhớ đệm đã lưu bằng save() (thay cho nội dung hiện tại)
+
+        Returns:
+            Số embeddings đã đọc (0 nếu không có file hợp lệ)
+        """
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                scope = str(data['scope'])
+                keys = data['keys'].tolist()
+                embeddings = np.asarray(data['embeddings'], dtype=np.float32)
+        except (OSError, ValueError, KeyError):
+            return 0
+        if embeddings.ndim != 2 or len(keys) != len(embeddings):
+            return 0
+
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.scope = scope
+            for key, embedding in zip(keys, embeddings):
+                self._put(key, embedding.copy())
+            return len(self._entries)
+
+
+class ContextTurn:
+    """
+    Một lượt hỏi trong ConversationContext
+    """
+
+    __slots__ = ('scope', 'embedding', 'candidates', 'tier', 'created')
+
+    def __init__(self, scope, embedding, candidates, tier, created):
+        self.scope = scope
+        self.embedding = embedding
+        self.candidates = candidates
+        self.tier = tier
+        self.created = created
+
+
+class ConversationContext:
+    """
+    Ngữ cảnh hội thoại của một phiên chat (mỗi phiên một đối tượng, vd. trong
+    st.session_state), dùng với ChatbotPro.answer_stream()
+
+    Giữ max_turns lượt gần nhất: embedding đã chuẩn hóa của câu hỏi, chỉ số các câu
+    hỏi ứng viên và mức độ tin cậy của câu trả lời. Khi lượt trước ở mức trung bình,
+    câu hỏi tiếp theo được xếp hạng lại theo cả embedding của lượt trước.
+    """
+
+    def __init__(self, max_turns=4, weight=0.5, ttl=300.0):
+        """
+        Args:
+            max_turns: Số lượt gần nhất được giữ (lượt cũ nhất bị loại trước)
+            weight: Trọng số của embedding lượt trước khi xếp hạng lại câu hỏi tiếp theo
+            ttl: Số giây một lượt còn được dùng làm ngữ cảnh (None = không hết hạn)
+        """
+        self.max_turns = max_turns
+        self.weight = weight
+        self.ttl = ttl
+        self._turns = deque(maxlen=max_turns)
+
+    def add(self, scope, embedding, candidates, tier):
+        """
+        Ghi một lượt hỏi
+
+        Args:
+            scope: Trạng thái của engine lúc trả lời (chỉ số ứng viên chỉ đúng trong scope này)
+            embedding: Embedding đã chuẩn hóa (np.ndarray float32) dùng để chọn câu trả lời
+            candidates: Chỉ số các câu hỏi ứng viên
+            tier: Mức độ tin cậy của câu trả lời: 'high', 'medium' hoặc 'fallback'
+        """
+        self._turns.append(ContextTurn(scope, embedding, np.asarray(candidates, dtype=np.int64), tier,
+                                       time.monotonic()))
+
+    def last(self):
+        """Lượt gần nhất (None nếu chưa có)"""
+        return self._turns[-1] if self._turns else None
+
+    def clarifying(self, scope):
+        """
+        Lượt gần nhất nếu nó đang chờ người dùng nói rõ ý: câu trả lời ở mức trung
+        bình, cùng scope và chưa hết hạn; ngược lại None
+        """
+        turn = self.last()
+        if turn is None or turn.tier != 'medium' or turn.scope != scope:
+            return None
+        if self.ttl is not None and time.monotonic() - turn.created > self.ttl:
+            return None
+        return turn
+
+    def clear(self):
+        """Xóa mọi lượt đã ghi (vd. khi người dùng xóa lịch sử chat)"""
+        self._turns.clear()
+
+    def __len__(self):
+        return len(self._turns)
+
+    @property
+    def nbytes(self):
+        """Dung lượng các embedding và ứng viên đang giữ"""
+        return sum(turn.embedding.nbytes + turn.candidates.nbytes for turn in self._turns)
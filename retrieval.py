@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lớp chọn top-k dùng chung cho Chatbot (TF-IDF) và ChatbotPro (Semantic Search)
+
+Thay vì sắp xếp toàn bộ corpus (O(n log n)) cho mỗi câu hỏi, điểm số được tính
+theo từng khối (chunk) các dòng của corpus và chỉ giữ lại k ứng viên tốt nhất
+bằng partial selection (np.partition / torch.topk), nên bộ nhớ tạm chỉ phụ
+thuộc vào kích thước khối.
+"""
+
+import numpy as np
+
+
+# Số dòng corpus được chấm điểm trong một khối
+DEFAULT_CHUNK_SIZE = 65536
+
+# Cách phá hòa khi bằng điểm: chỉ số nhỏ trước (như argmax của ChatbotPro trước đây)
+# hoặc chỉ số lớn trước (như argsort()[-top_k:][::-1] của Chatbot.find_answer trước đây)
+TIES = ('lowest', 'highest')
+
+
+def _to_numpy(scores):
+    """Chuyển tensor torch (nếu có) về np.ndarray"""
+    if hasattr(scores, 'detach'):
+        return scores.detach().cpu().numpy()
+    return np.asarray(scores)
+
+
+def _select(scores, k, ties='lowest'):
+    """
+    Chọn k phần tử lớn nhất trên mỗi dòng của ma trận điểm (chưa sắp xếp)
+
+    Args:
+        scores: np.ndarray hoặc torch.Tensor shape (n_queries, n_rows)
+        k: Số phần tử cần giữ (k <= n_rows)
+        ties: 'lowest' hoặc 'highest' (xem TIES)
+
+    Returns:
+        Tuple (indices, values) dạng np.ndarray shape (n_queries, k)
+    """
+    if k == 1:
+        # argmax trả về vị trí xuất hiện đầu tiên khi bằng điểm (giống argmax trước đây);
+        # 'highest': argmax trên các cột đảo ngược
+        n_rows = scores.shape[1]
+        if hasattr(scores, 'topk'):
+            if ties == 'highest':
+                indices = n_rows - 1 - _to_numpy(scores.flip(1).argmax(dim=1, keepdim=True))
+            else:
+                indices = _to_numpy(scores.argmax(dim=1, keepdim=True))
+        elif ties == 'highest':
+            indices = n_rows - 1 - scores[:, ::-1].argmax(axis=1)[:, None]
+        else:
+            indices = scores.argmax(axis=1)[:, None]
+        return indices, np.take_along_axis(_to_numpy(scores), indices, axis=1)
+
+    if hasattr(scores, 'topk') and ties == 'lowest':
+        values, indices = scores.topk(k, dim=1, sorted=False)
+        return _to_numpy(indices), _to_numpy(values)
+
+    return _select_numpy(_to_numpy(scores), k, ties=ties)
+
+
+def _select_numpy(scores, k, ids=None, ties='lowest'):
+    """
+    Partial selection trên np.ndarray, bằng điểm ở biên thì ưu tiên id nhỏ hơn
+    (id lớn hơn nếu ties='highest')
+
+    Args:
+        scores: Ma trận điểm (n_queries, n_rows)
+        k: Số phần tử cần giữ
+        ids: Ma trận id dùng để phá hòa (mặc định: vị trí cột)
+        ties: 'lowest' hoặc 'highest' (xem TIES)
+
+    Returns:
+        Tuple (positions, values) shape (n_queries, k); positions là vị trí cột trong scores
+    """
+    n_rows = scores.shape[1]
+    if k >= n_rows:
+        positions = np.broadcast_to(np.arange(n_rows), scores.shape)
+        return positions, scores
+
+    # O(n) với np.argpartition; giá trị nhỏ nhất được chọn là giá trị lớn thứ k
+    positions = np.argpartition(scores, n_rows - k, axis=1)[:, n_rows - k:]
+    kth_values = np.take_along_axis(scores, positions, axis=1).min(axis=1)
+
+    # Chỉ các dòng có nhiều phần tử bằng điểm ở biên mới cần chọn lại cho ổn định
+    n_candidates = np.count_nonzero(scores >= kth_values[:, None], axis=1)
+    for row in np.flatnonzero(n_candidates > k):
+        row_scores, kth_value = scores[row], kth_values[row]
+        above = np.flatnonzero(row_scores > kth_value)
+        tied = np.flatnonzero(row_scores == kth_value)
+        if ids is not None:
+            tied = tied[np.argsort(ids[row, tied], kind='stable')]
+        if ties == 'highest':
+            tied = tied[::-1]
+        positions[row] = np.concatenate([above, tied[:k - len(above)]])
+    return positions, np.take_along_axis(scores, positions, axis=1)
+
+
+def _sort_candidates(indices, values, ties='lowest'):
+    """Sắp xếp ứng viên của mỗi dòng: điểm giảm dần, bằng điểm thì chỉ số nhỏ trước (lớn trước nếu ties='highest')"""
+    order = np.lexsort((-indices if ties == 'highest' else indices, -values)) if indices.size else indices
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+def top_k(scores, k, ties='lowest'):
+    """
+    Chọn top-k trên một vector hoặc ma trận điểm đã tính sẵn
+
+    Args:
+        scores: Vector (n_rows,) hoặc ma trận (n_queries, n_rows)
+        k: Số kết quả cần lấy
+        ties: Bằng điểm thì chỉ số nhỏ ('lowest') hay lớn ('highest') trước
+
+    Returns:
+        List các cặp (index, score) nếu scores là vector, hoặc list các list
+        như vậy (mỗi dòng một list) nếu scores là ma trận
+    """
+    single = len(scores.shape) == 1
+    if single:
+        scores = scores[None, :]
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        pairs = [[] for _ in range(scores.shape[0])]
+    else:
+        indices, values = _sort_candidates(*_select(scores, k, ties), ties)
+        pairs = [list(zip(row_indices.tolist(), row_values)) for row_indices, row_values in zip(indices, values)]
+    return pairs[0] if single else pairs
+
+
+def chunked_top_k(score_fn, n_rows, k, n_queries=1, chunk_size=DEFAULT_CHUNK_SIZE, ties='lowest'):
+    """
+    Chọn top-k trên toàn corpus bằng cách chấm điểm từng khối dòng
+
+    Args:
+        score_fn: Hàm score_fn(start, end) trả về ma trận điểm (n_queries, end - start)
+                  (np.ndarray hoặc torch.Tensor) của các dòng corpus [start, end)
+        n_rows: Tổng số dòng của corpus
+        k: Số kết quả cần lấy cho mỗi câu hỏi
+        n_queries: Số câu hỏi được chấm điểm cùng lúc
+        chunk_size: Số dòng corpus trong một khối
+        ties: Bằng điểm thì chỉ số nhỏ ('lowest') hay lớn ('highest') trước
+
+    Returns:
+        List (mỗi câu hỏi một phần tử) các list cặp (index, score),
+        sắp xếp theo điểm giảm dần
+    """
+    k = min(k, n_rows)
+    if k <= 0:
+        return [[] for _ in range(n_queries)]
+
+    best_indices = None
+    best_values = None
+    for start in range(0, n_rows, chunk_size):
+        end = min(start + chunk_size, n_rows)
+        indices, values = _select(score_fn(start, end), min(k, end - start), ties)
+        indices = _to_numpy(indices) + start
+        values = _to_numpy(values)
+        if best_indices is None:
+            best_indices, best_values = indices, values
+            continue
+        # Gộp ứng viên của khối mới với top-k hiện tại rồi chọn lại
+        merged_indices = np.concatenate([best_indices, indices], axis=1)
+        merged_values = np.concatenate([best_values, values], axis=1)
+        keep, best_values = _select_numpy(merged_values, k, ids=merged_indices, ties=ties)
+        best_indices = np.take_along_axis(merged_indices, keep, axis=1)
+
+    best_indices, best_values = _sort_candidates(best_indices, best_values, ties)
+    return [list(zip(row_indices.tolist(), row_values)) for row_indices, row_values in zip(best_indices, best_values)]
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP API bất đồng bộ (asyncio) cho Chatbot (TF-IDF) và ChatbotPro (Semantic Search)
+
+Các request đồng thời được gom thành lô nhỏ (micro-batch): lô được gửi đi khi
+đủ max_batch_size câu hỏi hoặc khi hết max_wait_ms kể từ câu hỏi đầu tiên, rồi
+trả lời bằng một lần answer_many() (một lần encode + một phép nhân ma trận).
+
+Endpoints:
+    GET  /health   Trạng thái server, các engine và độ dài hàng đợi
+    GET  /metrics  Thời gian từng bước, counter bộ nhớ đệm/mức độ tin cậy (định dạng Prometheus)
+    POST /answer   Body JSON: {"question": "...", "engine": "tfidf" | "semantic" | "hybrid", "top_k": 1}
+
+Mã lỗi:
+    400 Body không hợp lệ, 404 Sai đường dẫn/engine, 413 Body quá lớn,
+    503 Hàng đợi đầy (backpressure), 504 Quá thời gian chờ
+
+Chạy:
+    python3 server.py --port 8000 --engines tfidf semantic
+"""
+
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from engines import EngineRegistry
+from metrics import JsonLogSink, Metrics, PrometheusSink
+
+
+MAX_BODY_SIZE = 64 * 1024
+MAX_TOP_K = 20
+
+
+class QueueFullError(Exception):
+    """Hàng đợi của MicroBatcher đã đầy"""
+
+
+class MicroBatcher:
+    """
+    Gom các lời gọi submit() đồng thời thành lô và xử lý bằng một hàm batch
+
+    Hàm batch chạy trong một thread riêng (mỗi batcher một thread) nên không
+    chặn event loop, và các lô của cùng một engine được xử lý tuần tự.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=64, max_wait_ms=5, max_queue=1024):
+        """
+        Args:
+            batch_fn: Hàm nhận list item, trả về list kết quả cùng độ dài
+            max_batch_size: Số item tối đa trong một lô
+            max_wait_ms: Thời gian chờ tối đa (ms) để gom thêm item sau item đầu tiên
+            max_queue: Số item tối đa đang chờ; vượt quá thì submit() báo QueueFullError
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.items = 0
+        self._task = None
+
+    def start(self):
+        """Bắt đầu vòng lặp gom lô (gọi bên trong event loop)"""
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Dừng vòng lặp gom lô"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, item, timeout):
+        """
+        Gửi một item và chờ kết quả
+
+        Args:
+            item: Dữ liệu đầu vào của batch_fn
+            timeout: Thời gian chờ tối đa (giây)
+
+        Raises:
+            QueueFullError: Hàng đợi đầy
+            asyncio.TimeoutError: Quá thời gian chờ
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise QueueFullError() from None
+        return await asyncio.wait_for(future, timeout)
+
+    async def _collect(self):
+        """Lấy một lô: chờ item đầu tiên rồi gom thêm cho tới khi đủ lô hoặc hết thời gian"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Bỏ các request đã hết thời gian chờ trong lúc nằm trong hàng đợi
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+def tfidf_batch_fn(chatbot):
+    """Hàm batch cho Chatbot: item là (question, top_k)"""
+    def run(items):
+        top_k = max(k for _, k in items)
+        all_results = chatbot.answer_many([question for question, _ in items], top_k=top_k)
+        responses = []
+        for (_, k), results in zip(items, all_results):
+            results = (results or [])[:k]
+            responses.append({
+                'answer': results[0]['answer'] if results else
+                "Xin lỗi, tôi không hiểu câu hỏi của bạn. Bạn có thể diễn đạt lại không?",
+                'results': [{'answer': r['answer'], 'similarity': float(r['similarity']),
+                             'matched_question': r['matched_question']} for r in results],
+            })
+        return responses
+    return run
+
+
+def semantic_batch_fn(chatbot_pro):
+    """Hàm batch cho ChatbotPro: item là (question, top_k)"""
+    def run(items):
+        top_k = max(k for _, k in items)
+        all_results = chatbot_pro.answer_many([question for question, _ in items], top_k=top_k)
+        responses = []
+        for (_, k), results in zip(items, all_results):
+            answer_text, score, matched = results[0] if results else (
+                "Xin lỗi, tôi không hiểu câu hỏi của bạn. Bạn có thể diễn đạt lại không?", 0.0, "")
+            responses.append({
+                'answer': answer_text,
+                'score': score,
+                'matched_question': matched,
+                'results': [{'answer': text, 'score': s, 'matched_question': q} for text, s, q in results[:k]],
+            })
+        return responses
+    return run
+
+
+class ChatbotServer:
+    """
+    Server HTTP/1.1 tối giản trên asyncio (keep-alive, body JSON)
+    """
+
+    def __init__(self, batchers, request_timeout=10.0, metrics_sink=None):
+        """
+        Args:
+            batchers: Dict tên engine -> MicroBatcher
+            request_timeout: Thời gian chờ tối đa cho mỗi request (giây)
+            metrics_sink: PrometheusSink được xuất ở GET /metrics (None = không có /metrics)
+        """
+        self.batchers = batchers
+        self.request_timeout = request_timeout
+        self.metrics_sink = metrics_sink
+
+    async def handle_connection(self, reader, writer):
+        """Xử lý các request trên một kết nối cho tới khi client đóng"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._send(writer, HTTPStatus.BAD_REQUEST, {'error': 'Request line không hợp lệ'}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    await self._send(writer, HTTPStatus.BAD_REQUEST, {'error': 'Content-Length không hợp lệ'}, False)
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self._send(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': 'Body quá lớn'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self.route(method, path, body)
+                await self._send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        """
+        Định tuyến một request
+
+        Returns:
+            Tuple (HTTPStatus, payload dict)
+        """
+        if method == 'GET' and path == '/health':
+            return HTTPStatus.OK, {
+                'status': 'ok',
+                'engines': {name: {'queued': batcher.queue.qsize(), 'batches': batcher.batches,
+                                   'items': batcher.items}
+                            for name, batcher in self.batchers.items()},
+            }
+
+        if method == 'GET' and path == '/metrics' and self.metrics_sink is not None:
+            return HTTPStatus.OK, self.metrics_sink.render()
+
+        if path != '/answer':
+            return HTTPStatus.NOT_FOUND, {'error': f'Không có đường dẫn {path}'}
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Chỉ hỗ trợ POST'}
+
+        try:
+            request = json.loads(body.decode('utf-8'))
+            question = request['question'].strip()
+            engine = request.get('engine', next(iter(self.batchers)))
+            top_k = int(request.get('top_k', 1))
+        except (ValueError, KeyError, AttributeError, TypeError):
+            return HTTPStatus.BAD_REQUEST, {'error': 'Body phải là JSON có trường "question"'}
+
+        if not question:
+            return HTTPStatus.BAD_REQUEST, {'error': 'Câu hỏi rỗng'}
+        if engine not in self.batchers:
+            return HTTPStatus.NOT_FOUND, {'error': f'Engine không có: {engine}'}
+        top_k = min(max(top_k, 1), MAX_TOP_K)
+
+        try:
+            result = await self.batchers[engine].submit((question, top_k), self.request_timeout)
+        except QueueFullError:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': 'Server đang quá tải, vui lòng thử lại'}
+        except asyncio.TimeoutError:
+            return HTTPStatus.GATEWAY_TIMEOUT, {'error': 'Quá thời gian chờ'}
+        except Exception as e:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f'Lỗi: {e}'}
+
+        return HTTPStatus.OK, dict(result, engine=engine)
+
+    @staticmethod
+    async def _send(writer, status, payload, keep_alive):
+        """Ghi một response JSON (hoặc text nếu payload là chuỗi, vd. /metrics)"""
+        if isinstance(payload, str):
+            body = payload.encode('utf-8')
+            content_type = PrometheusSink.CONTENT_TYPE
+        else:
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+def load_engines(names, csv_file, metrics=None, query_embedding_path=None, encode_workers=1):
+    """
+    Khởi tạo các engine được yêu cầu (cùng ghi vào metrics, nếu có)
+
+    Các engine được tạo qua một EngineRegistry (không loại engine): dùng chung một
+    bản dữ liệu CSV, semantic và hybrid dùng chung mô hình và bộ nhớ đệm embedding
+    câu hỏi (đọc từ query_embedding_path nếu có). Corpus được encode bằng
+    encode_workers tiến trình (có checkpoint trong .embedding_cache nên lần khởi
+    động sau tiếp tục nếu bị dừng giữa chừng).
+
+    Returns:
+        Tuple (dict tên engine -> hàm batch, dict tên engine -> chatbot)
+    """
+    registry = EngineRegistry(idle_seconds=None)
+    engines = {}
+    chatbots = {}
+    if 'tfidf' in names:
+        # Server nhận request ngay, bộ vector hóa câu hỏi được dựng trong thread nền (EngineRegistry gọi warm_up())
+        chatbot = registry.get('tfidf', csv_file=csv_file, similarity_threshold=0.1, metrics=metrics)
+        if chatbot is not None:
+            engines['tfidf'] = tfidf_batch_fn(chatbot)
+            chatbots['tfidf'] = chatbot
+            print(f"✓ tfidf khởi động: {chatbot.startup}")
+    for name in ('semantic', 'hybrid'):
+        if name in names:
+            chatbot_pro = registry.get(name, csv_file=csv_file, cache_dir='.embedding_cache', metrics=metrics,
+                                       query_embedding_path=query_embedding_path, encode_workers=encode_workers)
+            if chatbot_pro is not None:
+                # ChatbotHybrid có cùng answer_many() như ChatbotPro
+                engines[name] = semantic_batch_fn(chatbot_pro)
+                chatbots[name] = chatbot_pro
+                print(f"✓ {name} khởi động: {chatbot_pro.startup}")
+    return engines, chatbots
+
+
+async def serve(args):
+    """Khởi tạo engine, các MicroBatcher và chạy server cho tới khi bị dừng"""
+    metrics_sink = None
+    metrics = None
+    if not args.no_metrics:
+        metrics_sink = PrometheusSink()
+        metrics = Metrics(metrics_sink)
+        if args.metrics_log:
+            metrics.add_sink(JsonLogSink(open(args.metrics_log, 'a', encoding='utf-8')))
+
+    engines, chatbots = load_engines(args.engines, args.csv, metrics, args.query_embeddings,
+                                     args.encode_workers)
+    if not engines:
+        print("✗ Không khởi tạo được engine nào.")
+        return
+
+    batchers = {name: MicroBatcher(batch_fn, max_batch_size=args.max_batch_size,
+                                   max_wait_ms=args.max_wait_ms, max_queue=args.max_queue)
+                for name, batch_fn in engines.items()}
+    for batcher in batchers.values():
+        batcher.start()
+
+    server = ChatbotServer(batchers, request_timeout=args.timeout, metrics_sink=metrics_sink)
+    tcp_server = await asyncio.start_server(server.handle_connection, args.host, args.port)
+    print(f"✓ Server đang chạy tại http://{args.host}:{args.port} (engines: {', '.join(batchers)})")
+    try:
+        async with tcp_server:
+            await tcp_server.serve_forever()
+    finally:
+        for batcher in batchers.values():
+            await batcher.stop()
+        # Semantic và hybrid dùng chung bộ nhớ đệm: ghi một lần là đủ
+        for chatbot in chatbots.values():
+            if hasattr(chatbot, 'save_query_embeddings') and chatbot.save_query_embeddings():
+                print(f"✓ Đã lưu bộ nhớ đệm embedding câu hỏi: {chatbot.query_embeddings.stats()}")
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API cho chatbot hỏi-đáp")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--csv', default='data_converted.csv')
+    parser.add_argument('--engines', nargs='+', choices=['tfidf', 'semantic', 'hybrid'],
+                        default=['tfidf'])
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--max-queue', type=int, default=1024)
+    parser.add_argument('--timeout', type=float, default=10.0, help="Thời gian chờ tối đa mỗi request (giây)")
+    parser.add_argument('--no-metrics', action='store_true', help="Tắt metrics và GET /metrics")
+    parser.add_argument('--metrics-log', help="Ghi thêm mỗi phép đo thành một dòng JSON vào file này")
+    parser.add_argument('--query-embeddings', default='.embedding_cache/query_embeddings.npz',
+                        help="File lưu bộ nhớ đệm embedding câu hỏi giữa các lần chạy (semantic/hybrid)")
+    parser.add_argument('--encode-workers', type=int, default=1,
+                        help="Số tiến trình encode corpus khi khởi động (semantic/hybrid)")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\nĐã dừng server.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chấm điểm song song nhiều tiến trình trên bộ nhớ dùng chung (shared memory)
+
+Corpus (ma trận TF-IDF dạng CSR của Chatbot hoặc embeddings của ChatbotPro)
+được sao chép một lần vào các khối multiprocessing.shared_memory và chia thành
+các shard liên tiếp theo dòng. Mỗi tiến trình worker chỉ gắn (attach) vào các
+khối này - không đọc lại CSV hay mô hình - rồi tính top-k cục bộ của một shard;
+tiến trình điều phối gộp các top-k cục bộ thành kết quả cuối.
+
+Worker không import torch/sentence-transformers và chỉ dùng một luồng BLAS, nên
+throughput tăng gần tuyến tính theo số tiến trình.
+"""
+
+import os
+import uuid
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from retrieval import DEFAULT_CHUNK_SIZE, chunked_top_k, top_k as select_top_k
+
+# Trạng thái trong tiến trình worker: các mảng đang gắn vào và các ma trận shard đã dựng
+_worker_state = {'token': None, 'arrays': None, 'handles': [], 'shards': {}}
+
+
+def _init_worker():
+    """Chạy một lần trong mỗi worker: giới hạn BLAS một luồng để các worker không tranh nhau"""
+    try:
+        from threadpoolctl import threadpool_limits
+        _worker_state['limits'] = threadpool_limits(limits=1)
+    except ImportError:
+        pass
+
+
+def _worker_arrays(spec):
+    """Các mảng dùng chung mô tả bởi spec (gắn lại nếu corpus đã được chia sẻ lại)"""
+    if _worker_state['token'] != spec['token']:
+        for handle in _worker_state['handles']:
+            handle.close()
+        handles = []
+        arrays = {}
+        for name, (block_name, shape, dtype) in spec['arrays'].items():
+            handle = shared_memory.SharedMemory(name=block_name)
+            handles.append(handle)
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=handle.buf)
+        _worker_state.update(token=spec['token'], arrays=arrays, handles=handles, shards={})
+    return _worker_state['arrays']
+
+
+def dense_search_task(spec, start, end, queries, k, chunk_size=DEFAULT_CHUNK_SIZE, ties='lowest'):
+    """
+    Top-k cục bộ của shard [start, end) trên embeddings dùng chung
+
+    Cùng phép tính với vector_index.ExactIndex: (queries đã chuẩn hóa @ vectors.T) * inverse_norms
+    """
+    arrays = _worker_arrays(spec)
+    vectors = arrays['vectors']
+    inverse_norms = arrays['inverse_norms']
+
+    def score_chunk(chunk_start, chunk_end):
+        rows = slice(start + chunk_start, start + chunk_end)
+        return (queries @ vectors[rows].T) * inverse_norms[rows]
+
+    results = chunked_top_k(score_chunk, end - start, k, n_queries=len(queries), chunk_size=chunk_size, ties=ties)
+    return [[(start + idx, score) for idx, score in row] for row in results]
+
+
+def sparse_search_task(spec, start, end, user_vectors, k, chunk_size=DEFAULT_CHUNK_SIZE, ties='lowest'):
+    """
+    Top-k cục bộ của shard [start, end) trên ma trận TF-IDF (CSR) dùng chung
+
+    Cùng phép tính với Chatbot._top_matches: ma trận dùng chung và user_vectors
+    đều đã được chuẩn hóa L2 lại (như cosine_similarity), mỗi khối chỉ còn phép nhân
+    """
+    from scipy.sparse import csr_matrix
+
+    arrays = _worker_arrays(spec)
+    shards = _worker_state['shards']
+    if (start, end) not in shards:
+        indptr = arrays['indptr']
+        low, high = indptr[start], indptr[end]
+        shards[(start, end)] = csr_matrix(
+            (arrays['data'][low:high], arrays['indices'][low:high], indptr[start:end + 1] - low),
+            shape=(end - start, spec['n_columns'])
+        )
+    shard = shards[(start, end)]
+
+    def score_chunk(chunk_start, chunk_end):
+        if chunk_start == 0 and chunk_end == shard.shape[0]:
+            return (user_vectors @ shard.T).toarray()
+        return (user_vectors @ shard[chunk_start:chunk_end].T).toarray()
+
+    results = chunked_top_k(score_chunk, end - start, k, n_queries=user_vectors.shape[0], chunk_size=chunk_size,
+                            ties=ties)
+    return [[(start + idx, score) for idx, score in row] for row in results]
+
+
+def merge_top_k(shard_results, k, ties='lowest'):
+    """
+    Gộp top-k cục bộ của các shard
+
+    Args:
+        shard_results: List (mỗi shard một phần tử) các list (mỗi query) cặp (index, score)
+        k: Số kết quả cần giữ
+        ties: Bằng điểm thì chỉ số nhỏ ('lowest') hay lớn ('highest') trước
+
+    Returns:
+        List (mỗi query một phần tử) các list cặp (index, score); bằng điểm thì thứ
+        tự theo ties như khi chấm điểm trong một tiến trình
+    """
+    merged = []
+    for rows in zip(*shard_results):
+        candidates = [pair for row in rows for pair in row]
+        if not candidates:
+            merged.append([])
+            continue
+        ids = np.array([idx for idx, _ in candidates], dtype=np.int64)
+        scores = np.array([score for _, score in candidates])
+        order = np.argsort(ids, kind='stable')
+        merged.append([(int(ids[order[position]]), score)
+                       for position, score in select_top_k(scores[order], k, ties)])
+    return merged
+
+
+def _release(executor, blocks):
+    """Dừng các worker và giải phóng các khối bộ nhớ dùng chung"""
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+    for block in blocks:
+        block.close()
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ShardPool:
+    """
+    Nhóm tiến trình worker cùng chấm điểm một corpus đặt trong bộ nhớ dùng chung
+    """
+
+    def __init__(self, n_workers=None, n_shards=None, start_method='spawn'):
+        """
+        Args:
+            n_workers: Số tiến trình worker (mặc định: số CPU)
+            n_shards: Số shard chia corpus (mặc định: bằng n_workers)
+            start_method: Cách tạo tiến trình của multiprocessing ('spawn' an toàn khi
+                tiến trình cha đã nạp torch; 'fork' khởi động nhanh hơn)
+        """
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.n_shards = n_shards or self.n_workers
+        self.start_method = start_method
+        self.shards = []
+        self._spec = None
+        self._blocks = []
+        self._executor = ProcessPoolExecutor(max_workers=self.n_workers, mp_context=get_context(start_method),
+                                             initializer=_init_worker)
+        self._finalizer = weakref.finalize(self, _release, self._executor, self._blocks)
+
+    def share(self, arrays, n_rows, **meta):
+        """
+        Sao chép corpus vào bộ nhớ dùng chung và chia shard (thay corpus cũ, nếu có)
+
+        Args:
+            arrays: Dict tên -> np.ndarray cần chia sẻ
+            n_rows: Số dòng của corpus (để chia shard)
+            **meta: Thông tin nhỏ gửi kèm spec cho worker (vd. số cột)
+        """
+        token = uuid.uuid4().hex[:12]
+        blocks = []
+        spec = {'token': token, 'arrays': {}}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1),
+                                               name=f'shard_{token}_{name}')
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            blocks.append(block)
+            spec['arrays'][name] = (block.name, array.shape, array.dtype.str)
+        spec.update(meta)
+
+        bounds = np.linspace(0, n_rows, min(self.n_shards, max(n_rows, 1)) + 1).astype(np.int64)
+        old_blocks = list(self._blocks)
+        self._blocks[:] = blocks
+        self._spec = spec
+        self.shards = [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+        # Worker đang gắn vào khối cũ vẫn đọc được tới khi gắn sang spec mới
+        _release(None, old_blocks)
+
+    def search(self, task, queries, k, *args, ties='lowest'):
+        """
+        Chạy task trên mọi shard song song và gộp kết quả
+
+        Args:
+            task: dense_search_task hoặc sparse_search_task
+            queries: Các query (ma trận dày hoặc thưa), gửi nguyên cho mọi shard
+            k: Số kết quả cho mỗi query
+            ties: Bằng điểm thì chỉ số nhỏ ('lowest') hay lớn ('highest') trước
+
+        Returns:
+            List (mỗi query một phần tử) các list cặp (index, score)
+        """
+        n_queries = queries.shape[0]
+        if not self.shards:
+            return [[] for _ in range(n_queries)]
+        futures = [self._executor.submit(task, self._spec, start, end, queries, k, *args, ties=ties)
+                   for start, end in self.shards]
+        return merge_top_k([future.result() for future in futures], k, ties)
+
+    def close(self):
+        """Dừng các worker và giải phóng bộ nhớ dùng chung"""
+        self._finalizer()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lưu/đọc chỉ mục TF-IDF của Chatbot thành một file duy nhất có thể memory-map
+
+Định dạng file (phiên bản FORMAT_VERSION):
+    8 bytes   magic b'TFIDFIDX'
+    4 bytes   phiên bản định dạng (uint32, little-endian)
+    8 bytes   độ dài header JSON (uint64, little-endian)
+    header    JSON: fingerprint, tham số vectorizer, shape và bảng các mảng
+    các mảng  dữ liệu thô, mỗi mảng căn lề ALIGNMENT bytes
+
+Các câu trả lời giống hệt nhau (nhiều câu hỏi diễn đạt lại cùng một ý) chỉ được
+lưu một lần: answers_ids cho biết câu trả lời của từng câu hỏi.
+
+Các mảng được đọc bằng np.memmap nên nhiều worker cùng đọc một file sẽ dùng
+chung một bản ma trận trong page cache của hệ điều hành. Câu hỏi người dùng được
+vector hóa bằng tfidf_query.QueryVectorizer; TfidfVectorizer (sklearn, import chậm)
+chỉ được dựng lại khi cần: build_vectorizer().
+"""
+
+import json
+import os
+import struct
+import uuid
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+MAGIC = b'TFIDFIDX'
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+_PREFIX = struct.Struct('<8sIQ')
+# Các mảng phải có trong file (answers_ids là tùy chọn của TextColumn nhưng luôn được ghi)
+REQUIRED_ARRAYS = ('data', 'indices', 'indptr', 'idf', 'terms_blob', 'terms_offsets',
+                   'questions_blob', 'questions_offsets', 'processed_blob', 'processed_offsets',
+                   'answers_blob', 'answers_offsets', 'answers_ids')
+
+
+class TextColumn:
+    """
+    Danh sách chuỗi chỉ đọc, giải mã UTF-8 theo yêu cầu từ một blob bytes + offsets
+
+    Nếu có ids, phần tử thứ i là chuỗi thứ ids[i] của blob (các chuỗi trùng nhau
+    chỉ được lưu một lần).
+    """
+
+    __slots__ = ('_blob', '_offsets', '_ids')
+
+    def __init__(self, blob, offsets, ids=None):
+        self._blob = blob
+        self._offsets = offsets
+        self._ids = ids
+
+    def __len__(self):
+        if self._ids is not None:
+            return len(self._ids)
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('TextColumn index out of range')
+        if self._ids is not None:
+            idx = int(self._ids[idx])
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return bytes(self._blob[start:end]).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def _encode_texts(texts):
+    """Nối các chuỗi thành (blob uint8, offsets int64)"""
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def _encode_unique(texts):
+    """Như _encode_texts nhưng mỗi chuỗi khác nhau chỉ lưu một lần: (blob, offsets, ids)"""
+    positions = {}
+    ids = np.fromiter((positions.setdefault(text, len(positions)) for text in texts), dtype=np.int64)
+    blob, offsets = _encode_texts(positions)
+    return blob, offsets, ids
+
+
+def save_index(path, fingerprint, params, vectorizer, question_vectors, questions, answers, processed_questions):
+    """
+    Ghi chỉ mục TF-IDF đã huấn luyện ra file
+
+    Args:
+        path: Đường dẫn file chỉ mục
+        fingerprint: Dấu vân tay của CSV + tham số (dùng để kiểm tra hợp lệ khi đọc)
+        params: Tham số TfidfVectorizer (dict)
+        vectorizer: TfidfVectorizer đã fit
+        question_vectors: Ma trận CSR các câu hỏi
+        questions, answers, processed_questions: Dữ liệu văn bản của corpus
+    """
+    matrix = csr_matrix(question_vectors)
+    terms = [None] * len(vectorizer.vocabulary_)
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term
+
+    arrays = {
+        'data': matrix.data,
+        'indices': matrix.indices,
+        'indptr': matrix.indptr,
+        'idf': np.asarray(vectorizer.idf_),
+    }
+    for name, texts in (('terms', terms), ('questions', questions), ('processed', processed_questions)):
+        arrays[f'{name}_blob'], arrays[f'{name}_offsets'] = _encode_texts(texts)
+    arrays['answers_blob'], arrays['answers_offsets'], arrays['answers_ids'] = _encode_unique(answers)
+
+    # Tính offset của từng mảng (tương đối so với đầu vùng dữ liệu)
+    table = {}
+    position = 0
+    for name, array in arrays.items():
+        position = -(-position // ALIGNMENT) * ALIGNMENT
+        table[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': position}
+        position += array.nbytes
+
+    header = json.dumps({
+        'fingerprint': fingerprint,
+        'params': params,
+        'shape': list(matrix.shape),
+        'arrays': table,
+    }).encode('utf-8')
+    data_start = -(-(_PREFIX.size + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    # Ghi ra file tạm rồi đổi tên để worker khác không đọc phải file dở dang
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(tmp_path, 'wb') as file:
+            file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+            file.write(header)
+            for name, array in arrays.items():
+                file.seek(data_start + table[name]['offset'])
+                file.write(np.ascontiguousarray(array).tobytes())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_header(path):
+    """
+    Đọc header của file chỉ mục
+
+    Returns:
+        Tuple (header dict, vị trí bắt đầu vùng dữ liệu) hoặc (None, None) nếu file
+        không tồn tại, sai định dạng hoặc khác phiên bản
+    """
+    try:
+        with open(path, 'rb') as file:
+            magic, version, header_size = _PREFIX.unpack(file.read(_PREFIX.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return None, None
+            header = json.loads(file.read(header_size).decode('utf-8'))
+    except (OSError, ValueError, struct.error):
+        return None, None
+    data_start = -(-(_PREFIX.size + header_size) // ALIGNMENT) * ALIGNMENT
+    return header, data_start
+
+
+def load_index(path):
+    """
+    Memory-map file chỉ mục
+
+    Returns:
+        Dict gồm fingerprint, params, terms, idf, question_vectors, questions,
+        answers, processed_questions; hoặc None nếu file không hợp lệ
+    """
+    header, data_start = read_header(path)
+    if header is None:
+        return None
+
+    # File bị cắt cụt/hỏng (vd. đĩa đầy khi ghi, bị sửa tay) được coi như không có chỉ mục
+    try:
+        return _map_index(path, header, data_start)
+    except (OSError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _map_index(path, header, data_start):
+    """load_index() sau khi đọc header; ValueError nếu vị trí/độ dài các mảng không khớp file"""
+    file_size = os.path.getsize(path)
+    for name in REQUIRED_ARRAYS:
+        if name not in header['arrays']:
+            raise ValueError(f"Thiếu mảng {name}")
+    for info in header['arrays'].values():
+        count = int(np.prod(info['shape'], dtype=np.int64))
+        start = data_start + int(info['offset'])
+        if info['offset'] < 0 or start + count * np.dtype(info['dtype']).itemsize > file_size:
+            raise ValueError("Vùng dữ liệu bị cắt cụt")
+
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        count = int(np.prod(info['shape'], dtype=np.int64))
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                     offset=data_start + info['offset']).reshape(info['shape'])
+
+    def column(name, length):
+        blob, offsets = arrays[f'{name}_blob'], arrays[f'{name}_offsets']
+        if len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(blob):
+            raise ValueError(f"offsets của {name} không khớp blob")
+        texts = TextColumn(blob, offsets, arrays.get(f'{name}_ids'))
+        if len(texts) != length:
+            raise ValueError(f"{name} có {len(texts)} phần tử, cần {length}")
+        return texts
+
+    params = dict(header['params'])
+    params['ngram_range'] = tuple(params['ngram_range'])
+
+    n_rows, n_columns = header['shape']
+    if len(arrays['idf']) != n_columns:
+        raise ValueError("idf không khớp số cột")
+    # csr_matrix kiểm tra độ dài indptr/indices/data (không duyệt toàn bộ mảng)
+    question_vectors = csr_matrix(
+        (arrays['data'], arrays['indices'], arrays['indptr']),
+        shape=(n_rows, n_columns),
+        copy=False
+    )
+
+    return {
+        'fingerprint': header['fingerprint'],
+        'params': params,
+        'terms': column('terms', n_columns),
+        'idf': arrays['idf'],
+        'question_vectors': question_vectors,
+        'questions': column('questions', n_rows),
+        'answers': column('answers', n_rows),
+        'processed_questions': column('processed', n_rows),
+    }
+
+
+def build_vectorizer(params, terms, idf):
+    """
+    Dựng lại TfidfVectorizer đã fit từ tham số, vocabulary và idf đã lưu
+
+    Args:
+        params: Tham số TfidfVectorizer (như load_index()['params'])
+        terms: Các term theo thứ tự cột
+        idf: Mảng idf theo thứ tự cột
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(**params)
+    vectorizer.vocabulary_ = {term: i for i, term in enumerate(terms)}
+    vectorizer.idf_ = idf
+    return vectorizer
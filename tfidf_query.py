@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vector hóa câu hỏi người dùng cho Chatbot TF-IDF mà không qua sklearn
+
+TfidfVectorizer.transform() và cosine_similarity() tốn phần lớn thời gian của
+một câu hỏi vào việc kiểm tra đầu vào, dựng analyzer và tạo ma trận thưa, không
+phải vào phép tính. QueryVectorizer làm lại đúng các bước của transform() (chữ
+thường, token_pattern mặc định, n-gram, đếm, nhân IDF, chuẩn hóa L2) bằng một
+dict term -> (cột, idf) dựng sẵn; normalize_rows() chuẩn hóa L2 như
+sklearn.preprocessing.normalize. Kết quả giống hệt sklearn đến từng bit.
+"""
+
+import math
+import re
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+# token_pattern mặc định của TfidfVectorizer
+TOKEN_PATTERN = r"(?u)\b\w\w+\b"
+
+# Tham số chỉ dùng khi fit (chọn vocabulary/IDF), không ảnh hưởng tới transform()
+FIT_ONLY_PARAMS = {'max_features', 'min_df', 'max_df', 'dtype'}
+
+
+def normalize_rows(matrix):
+    """
+    Chuẩn hóa L2 từng dòng của ma trận CSR, giống hệt sklearn.preprocessing.normalize
+
+    Tổng bình phương của mỗi dòng được cộng tuần tự theo thứ tự phần tử như
+    sklearn (np.sum cộng theo cặp nên có thể lệch bit cuối); dòng toàn 0 giữ nguyên.
+
+    Args:
+        matrix: Ma trận thưa (n, n_features)
+
+    Returns:
+        Ma trận CSR mới (dùng chung indices/indptr với ma trận vào), hoặc chính
+        ma trận vào nếu chuẩn hóa không làm đổi giá trị nào
+    """
+    matrix = csr_matrix(matrix)
+    indptr = matrix.indptr
+    lengths = np.diff(indptr)
+    squares = matrix.data * matrix.data
+    sums = np.zeros(matrix.shape[0], dtype=np.float64)
+    # Vòng lặp theo vị trí trong dòng (tối đa vài chục), mỗi bước cộng cho mọi dòng còn phần tử
+    rows = np.flatnonzero(lengths)
+    for position in range(int(lengths.max(initial=0))):
+        rows = rows[lengths[rows] > position]
+        sums[rows] += squares[indptr[rows] + position]
+
+    norms = np.sqrt(sums)
+    norms[sums == 0.0] = 1.0
+    data = matrix.data / np.repeat(norms, lengths)
+    if np.array_equal(data, matrix.data):
+        return matrix
+    return csr_matrix((data, matrix.indices, indptr), shape=matrix.shape, copy=False)
+
+
+def normalize_weights(weights):
+    """
+    Chuẩn hóa L2 các trọng số của một dòng, giống hệt normalize_rows() trên dòng đó
+
+    Args:
+        weights: Các trọng số (list hoặc mảng) theo thứ tự cột
+
+    Returns:
+        Mảng float64 mới
+    """
+    if isinstance(weights, np.ndarray):
+        weights = weights.tolist()
+    # Cộng tuần tự rồi chia như sklearn.preprocessing.normalize
+    total = 0.0
+    for value in weights:
+        total += value * value
+    if total != 0.0:
+        norm = math.sqrt(total)
+        weights = [value / norm for value in weights]
+    return np.array(weights, dtype=np.float64)
+
+
+class QueryVectorizer:
+    """
+    Bản "biên dịch" của TfidfVectorizer đã fit, chỉ dùng để vector hóa câu hỏi
+
+    Hỗ trợ các tham số mà Chatbot dùng (TFIDF_PARAMS): analyzer từ với
+    token_pattern, lowercase và ngram_range mặc định hoặc tùy chọn; norm='l2',
+    use_idf=True, không stop words, không sublinear_tf.
+    """
+
+    def __init__(self, terms, idf, ngram_range=(1, 1), token_pattern=TOKEN_PATTERN, lowercase=True):
+        """
+        Args:
+            terms: Các term theo thứ tự cột
+            idf: Mảng idf theo thứ tự cột
+            ngram_range: (min_n, max_n) như TfidfVectorizer
+            token_pattern: Biểu thức tách token như TfidfVectorizer
+            lowercase: Chuyển câu hỏi về chữ thường trước khi tách token
+        """
+        self.idf = np.asarray(idf, dtype=np.float64)
+        self.n_features = len(self.idf)
+        self.ngram_range = tuple(ngram_range)
+        self.lowercase = lowercase
+        self._tokenize = re.compile(token_pattern).findall
+        # term -> (cột, idf): một lần tra dict cho mỗi n-gram
+        self.features = {term: (column, float(weight)) for column, (term, weight) in enumerate(zip(terms, self.idf))}
+        if len(self.features) != self.n_features:
+            raise ValueError("terms và idf không cùng độ dài hoặc terms bị trùng")
+
+    @classmethod
+    def from_params(cls, params, terms, idf):
+        """
+        Dựng từ tham số TfidfVectorizer, vocabulary và idf đã lưu (như tfidf_index.build_vectorizer)
+
+        Raises:
+            ValueError: Nếu params có tham số làm transform() khác các bước được hỗ trợ
+        """
+        params = dict(params)
+        options = {key: params.pop(key) for key in ('ngram_range', 'token_pattern', 'lowercase') if key in params}
+        unsupported = set(params) - FIT_ONLY_PARAMS
+        if unsupported:
+            raise ValueError(f"QueryVectorizer không hỗ trợ tham số: {', '.join(sorted(unsupported))}")
+        return cls(terms, idf, **options)
+
+    @classmethod
+    def from_vectorizer(cls, vectorizer):
+        """Dựng từ một TfidfVectorizer đã fit"""
+        defaults = type(vectorizer)().get_params()
+        params = {key: value for key, value in vectorizer.get_params().items() if value != defaults[key]}
+        terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+        return cls.from_params(params, terms, vectorizer.idf_)
+
+    def _ngrams(self, text):
+        """Các n-gram của câu hỏi như analyzer 'word' của sklearn"""
+        if self.lowercase:
+            text = text.lower()
+        tokens = self._tokenize(text)
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+        features = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            features.extend(' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return features
+
+    def transform_one(self, text):
+        """
+        Vector TF-IDF (đã chuẩn hóa L2) của một câu hỏi ở dạng hai mảng
+
+        Returns:
+            (indices, data): cột tăng dần (int32) và trọng số (float64), giống
+            dòng tương ứng của TfidfVectorizer.transform([text])
+        """
+        lookup = self.features.get
+        counts = {}
+        for feature in self._ngrams(text):
+            entry = lookup(feature)
+            if entry is not None:
+                counts[entry] = counts.get(entry, 0) + 1
+        if not counts:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+
+        entries = sorted(counts.items())
+        return (np.fromiter((column for (column, _), _ in entries), dtype=np.int32, count=len(entries)),
+                normalize_weights([count * weight for (_, weight), count in entries]))
+
+    def transform(self, texts):
+        """
+        Ma trận TF-IDF (CSR, n x n_features) của các câu hỏi, giống TfidfVectorizer.transform(texts)
+
+        Args:
+            texts: Danh sách câu hỏi (đã tiền xử lý)
+        """
+        if isinstance(texts, str):
+            raise ValueError("Iterable over raw text documents expected, string object received.")
+        rows = [self.transform_one(text) for text in texts]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int32)
+        np.cumsum([len(indices) for indices, _ in rows], out=indptr[1:])
+        if rows:
+            indices = np.concatenate([indices for indices, _ in rows])
+            data = np.concatenate([data for _, data in rows])
+        else:
+            indices, data = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+        return csr_matrix((data, indices, indptr), shape=(len(rows), self.n_features), copy=False)
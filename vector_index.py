@@ -0,0 +1,1037 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chỉ mục vector cho ChatbotPro (tìm kiếm theo cosine similarity)
+
+Các backend:
+    exact: Duyệt toàn bộ corpus theo từng khối (hành vi mặc định); có thể duyệt
+           bản lượng tử hóa float16/int8 rồi chấm điểm lại ứng viên bằng vector gốc
+    ivf:   Inverted File - phân cụm k-means cầu, chỉ duyệt n_probe cụm gần nhất
+    cluster: Gom cụm các câu hỏi diễn đạt lại, chấm điểm tâm cụm trước rồi chỉ mở
+           các cụm còn có thể vào top-k (kết quả chính xác)
+    hnsw:  Đồ thị HNSW qua thư viện tùy chọn hnswlib (pip install hnswlib)
+    sharded: Như exact nhưng chia corpus cho nhiều tiến trình qua bộ nhớ dùng chung
+
+Mọi backend trả về điểm cosine chính xác của các ứng viên tìm được, nên các
+ngưỡng độ tin cậy của ChatbotPro áp dụng như nhau; chỉ khác ở chỗ backend xấp xỉ
+có thể bỏ sót câu hỏi tốt nhất (xem recall_report).
+"""
+
+import json
+import os
+import tempfile
+import time
+import uuid
+import zipfile
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from retrieval import DEFAULT_CHUNK_SIZE, chunked_top_k, top_k as select_top_k
+from sharding import ShardPool, dense_search_task
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+# Kiểu lưu trữ của ExactIndex
+STORAGES = ('float32', 'float16', 'int8')
+
+# Số dòng được giải lượng tử hóa mỗi lần khi chấm điểm (giới hạn bộ nhớ tạm)
+DEQUANTIZE_BLOCK = 8192
+
+# Biên cộng thêm vào cận trên điểm của mỗi cụm (ClusterIndex) để bù sai số float32
+BOUND_SLACK = 1e-4
+
+
+def _as_numpy(vectors):
+    """Chuyển tensor torch (nếu có) về np.ndarray float32"""
+    if hasattr(vectors, 'detach'):
+        vectors = vectors.detach().cpu().numpy()
+    vectors = np.asarray(vectors)
+    if vectors.dtype != np.float32:
+        vectors = vectors.astype(np.float32)
+    return vectors
+
+
+def _normalize(vectors):
+    """Chuẩn hóa L2 theo dòng (dòng toàn 0 giữ nguyên)"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize(vectors, storage):
+    """
+    Lượng tử hóa các vector sau khi chuẩn hóa L2
+
+    Args:
+        vectors: Ma trận (n, dim)
+        storage: 'float16' hoặc 'int8'
+
+    Returns:
+        Tuple (codes, scales): với 'float16' scales là None; với 'int8' mỗi vector
+        có một scale riêng, vector đã chuẩn hóa ≈ codes * scale
+    """
+    normalized = _normalize(_as_numpy(vectors))
+    if storage == 'float16':
+        return normalized.astype(np.float16), None
+    scales = np.maximum(np.abs(normalized).max(axis=1), 1e-12) / 127.0
+    codes = np.rint(normalized / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class ExactIndex:
+    """
+    Tìm kiếm chính xác: chấm điểm toàn bộ corpus theo từng khối
+
+    Kiểu lưu trữ khi duyệt (storage):
+        float32: Duyệt trực tiếp các vector gốc (mặc định)
+        float16: Duyệt bản sao float16 đã chuẩn hóa (nhỏ gấp đôi)
+        int8:    Duyệt mã int8 với một scale mỗi vector (nhỏ gấp bốn)
+    Với float16/int8, rescore ứng viên tốt nhất được chấm điểm lại bằng vector
+    gốc (chỉ đọc đúng các dòng đó, vd. từ memmap) nên điểm trả về là cosine chính xác.
+    """
+
+    backend = 'exact'
+    # Tham số quyết định nội dung của state(); các tham số khác chỉ dùng khi tìm kiếm
+    BUILD_PARAMS = ('storage',)
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, storage='float32', rescore=16):
+        """
+        Args:
+            chunk_size: Số vector được chấm điểm mỗi khối
+            storage: Kiểu lưu trữ khi duyệt: 'float32', 'float16' hoặc 'int8'
+            rescore: Số ứng viên được chấm điểm lại bằng vector gốc khi storage
+                là float16/int8 (0 = trả về điểm xấp xỉ)
+        """
+        if storage not in STORAGES:
+            raise ValueError(f"storage không hợp lệ: {storage} (chọn một trong {list(STORAGES)})")
+        self.chunk_size = chunk_size
+        self.storage = storage
+        self.rescore = rescore
+        self.vectors = None
+        self.inverse_norms = None
+        self.codes = None
+        self.scales = None
+
+    def params(self):
+        """Tham số của chỉ mục (được lưu cùng chỉ mục)"""
+        return {'chunk_size': self.chunk_size, 'storage': self.storage, 'rescore': self.rescore}
+
+    def build(self, vectors):
+        """
+        Gắn corpus vào chỉ mục
+
+        Args:
+            vectors: Ma trận (n, dim); có thể là memmap, không bị sao chép
+        """
+        self.vectors = vectors
+        # Chỉ lưu nghịch đảo độ dài từng dòng để không phải chuẩn hóa (sao chép) cả ma trận
+        self.inverse_norms = self._inverse_norms(vectors)
+        if self.storage != 'float32':
+            self.codes, self.scales = self._quantize(vectors)
+
+    def _inverse_norms(self, vectors):
+        """Nghịch đảo độ dài từng dòng, tính theo từng khối"""
+        norms = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), self.chunk_size):
+            chunk = np.asarray(vectors[start:start + self.chunk_size], dtype=np.float32)
+            norms[start:start + len(chunk)] = np.linalg.norm(chunk, axis=1)
+        return 1.0 / np.maximum(norms, 1e-12)
+
+    def _quantize(self, vectors):
+        """quantize() theo từng khối để không tạo bản sao float32 của cả corpus"""
+        parts = [quantize(vectors[start:start + self.chunk_size], self.storage)
+                 for start in range(0, len(vectors), self.chunk_size)]
+        codes = np.concatenate([part[0] for part in parts])
+        scales = np.concatenate([part[1] for part in parts]) if self.storage == 'int8' else None
+        return codes, scales
+
+    def nbytes(self):
+        """Số byte của dữ liệu được duyệt khi tìm kiếm (vector hoặc mã lượng tử hóa + các mảng phụ)"""
+        total = self.inverse_norms.nbytes
+        if self.codes is None:
+            return total + len(self.vectors) * int(np.prod(self.vectors.shape[1:])) * 4
+        total += self.codes.nbytes
+        if self.scales is not None:
+            total += self.scales.nbytes
+        return total
+
+    def add(self, vectors, n_new):
+        """
+        Cập nhật chỉ mục sau khi thêm vector vào cuối corpus
+
+        Args:
+            vectors: Toàn bộ corpus mới (n, dim); n_new dòng cuối là vector mới
+            n_new: Số vector mới
+        """
+        start = len(vectors) - n_new
+        self.inverse_norms = np.concatenate([self.inverse_norms[:start], self._inverse_norms(vectors[start:])])
+        if self.codes is not None:
+            codes, scales = self._quantize(vectors[start:])
+            self.codes = np.concatenate([self.codes[:start], codes])
+            if scales is not None:
+                self.scales = np.concatenate([self.scales[:start], scales])
+        self.vectors = vectors
+
+    def remove(self, vectors, removed):
+        """
+        Cập nhật chỉ mục sau khi xóa các dòng removed (chỉ số cũ) khỏi corpus
+
+        Args:
+            vectors: Corpus sau khi xóa
+            removed: Mảng chỉ số (trong corpus cũ) của các vector bị xóa
+        """
+        self.inverse_norms = np.delete(self.inverse_norms, removed)
+        if self.codes is not None:
+            self.codes = np.delete(self.codes, removed, axis=0)
+            if self.scales is not None:
+                self.scales = np.delete(self.scales, removed)
+        self.vectors = vectors
+
+    def replace(self, vectors, rows):
+        """
+        Cập nhật chỉ mục sau khi các dòng rows của corpus được ghi đè
+
+        Args:
+            vectors: Corpus sau khi ghi đè
+            rows: Mảng chỉ số các dòng bị thay đổi
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        changed = np.asarray(vectors[rows], dtype=np.float32)
+        inverse_norms = self.inverse_norms.copy()
+        inverse_norms[rows] = self._inverse_norms(changed)
+        if self.codes is not None:
+            codes, scales = quantize(changed, self.storage)
+            self.codes = self.codes.copy()
+            self.codes[rows] = codes
+            if scales is not None:
+                self.scales = self.scales.copy()
+                self.scales[rows] = scales
+        self.inverse_norms = inverse_norms
+        self.vectors = vectors
+
+    def search(self, queries, k):
+        """
+        Tìm k vector gần nhất cho mỗi query
+
+        Args:
+            queries: Ma trận (n_queries, dim)
+            k: Số kết quả cho mỗi query
+
+        Returns:
+            List (mỗi query một phần tử) các list cặp (index, cosine score)
+        """
+        queries = _normalize(_as_numpy(queries))
+
+        if self.codes is None:
+            def score_chunk(start, end):
+                chunk = np.asarray(self.vectors[start:end], dtype=np.float32)
+                return (queries @ chunk.T) * self.inverse_norms[start:end]
+
+            return chunked_top_k(score_chunk, len(self.vectors), k, n_queries=len(queries),
+                                 chunk_size=self.chunk_size)
+
+        def score_quantized(start, end):
+            scores = np.empty((len(queries), end - start), dtype=np.float32)
+            # Giải lượng tử hóa từng khối nhỏ để giới hạn bộ nhớ tạm
+            for block in range(start, end, DEQUANTIZE_BLOCK):
+                stop = min(block + DEQUANTIZE_BLOCK, end)
+                part = queries @ self.codes[block:stop].astype(np.float32).T
+                if self.scales is not None:
+                    part *= self.scales[block:stop]
+                scores[:, block - start:stop - start] = part
+            return scores
+
+        n_candidates = max(k, self.rescore) if self.rescore else k
+        candidates = chunked_top_k(score_quantized, len(self.codes), n_candidates, n_queries=len(queries),
+                                   chunk_size=self.chunk_size)
+        if not self.rescore:
+            return candidates
+        return [self._rescore(query, query_candidates, k)
+                for query, query_candidates in zip(queries, candidates)]
+
+    def _rescore(self, query, candidates, k):
+        """Chấm điểm lại các ứng viên bằng vector gốc và giữ k ứng viên tốt nhất"""
+        if not candidates:
+            return []
+        # Sắp theo chỉ số để bằng điểm thì ưu tiên chỉ số nhỏ như khi duyệt toàn bộ
+        ids = np.sort(np.array([idx for idx, _ in candidates], dtype=np.int64))
+        rows = np.asarray(self.vectors[ids], dtype=np.float32)
+        scores = (rows @ query) * self.inverse_norms[ids]
+        return [(int(ids[position]), score) for position, score in select_top_k(scores, k)]
+
+    def state(self):
+        """Các mảng cần lưu để khôi phục chỉ mục (ngoài chính các vector)"""
+        if self.codes is None:
+            return {}
+        # Lưu cả độ dài để khi khôi phục không phải đọc lại toàn bộ vector gốc
+        state = {'codes': self.codes, 'inverse_norms': self.inverse_norms}
+        if self.scales is not None:
+            state['scales'] = self.scales
+        return state
+
+    def restore(self, vectors, state):
+        """Khôi phục chỉ mục từ state() đã lưu và các vector của corpus"""
+        if 'codes' not in state:
+            self.build(vectors)
+            return
+        self.vectors = vectors
+        self.codes = state['codes']
+        self.inverse_norms = state['inverse_norms']
+        self.scales = state.get('scales')
+
+
+class IVFIndex:
+    """
+    Inverted File index: các vector được chia vào n_lists cụm (k-means cầu),
+    khi tìm kiếm chỉ chấm điểm các vector thuộc n_probe cụm (không rỗng) gần query nhất.
+
+    Núm điều chỉnh:
+        n_lists: Nhiều cụm hơn -> mỗi cụm nhỏ hơn, nhanh hơn nhưng dễ sót hơn
+        n_probe: Duyệt nhiều cụm hơn -> recall cao hơn, chậm hơn
+    """
+
+    backend = 'ivf'
+    BUILD_PARAMS = ('n_lists', 'train_iters', 'train_sample', 'seed')
+
+    def __init__(self, n_lists=None, n_probe=8, train_iters=10, train_sample=256, seed=0):
+        """
+        Args:
+            n_lists: Số cụm (mặc định: khoảng sqrt(n))
+            n_probe: Số cụm được duyệt cho mỗi query
+            train_iters: Số vòng lặp k-means
+            train_sample: Số vector mẫu cho mỗi cụm khi huấn luyện k-means
+            seed: Seed ngẫu nhiên cho k-means
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_iters = train_iters
+        self.train_sample = train_sample
+        self.seed = seed
+        self.vectors = None
+        self.centroids = None
+        self.list_ptr = None
+        self.list_ids = None
+        self.list_vectors = None
+
+    def params(self):
+        """Tham số của chỉ mục (được lưu cùng chỉ mục)"""
+        return {'n_lists': self.n_lists, 'n_probe': self.n_probe, 'train_iters': self.train_iters,
+                'train_sample': self.train_sample, 'seed': self.seed}
+
+    def _assign(self, vectors, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Gán mỗi vector (đã chuẩn hóa) vào centroid gần nhất"""
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignment[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assignment
+
+    def build(self, vectors):
+        """
+        Huấn luyện k-means và chia corpus vào các cụm
+
+        Args:
+            vectors: Ma trận (n, dim); có thể là memmap
+        """
+        self.vectors = vectors
+        n = len(vectors)
+        normalized = _normalize(_as_numpy(vectors))
+
+        n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, n)
+        self.n_lists = n_lists
+
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(n, n_lists * self.train_sample)
+        sample = normalized[rng.choice(n, size=sample_size, replace=False)]
+        self.centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+
+        for _ in range(self.train_iters):
+            assignment = self._assign(sample)
+            # Tổng các vector của mỗi cụm = one-hot(assignment) @ sample
+            one_hot = csr_matrix((np.ones(sample_size, dtype=np.float32),
+                                  (assignment, np.arange(sample_size))), shape=(n_lists, sample_size))
+            sums = np.asarray(one_hot @ sample)
+            counts = np.bincount(assignment, minlength=n_lists)
+            empty = counts == 0
+            if empty.any():
+                # Cụm rỗng: khởi tạo lại bằng các vector ngẫu nhiên
+                sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            self.centroids = _normalize(sums)
+
+        self._set_lists(self._assign(normalized), normalized)
+
+    def _set_lists(self, assignment, normalized):
+        """Xếp các vector (đã chuẩn hóa) vào các cụm theo assignment"""
+        list_ids = np.argsort(assignment, kind='stable')
+        list_ptr = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=self.n_lists))])
+        # Vector đã chuẩn hóa được xếp liền nhau theo cụm để mỗi cụm là một lát cắt liên tục
+        self.list_vectors = normalized[list_ids]
+        self.list_ids = list_ids
+        self.list_ptr = list_ptr
+
+    def _lists_by_id(self):
+        """Ngược với _set_lists: (cụm, vector đã chuẩn hóa) của từng vector theo chỉ số"""
+        n = len(self.list_ids)
+        assignment = np.empty(n, dtype=np.int64)
+        assignment[self.list_ids] = np.repeat(np.arange(self.n_lists), np.diff(self.list_ptr))
+        normalized = np.empty_like(self.list_vectors)
+        normalized[self.list_ids] = self.list_vectors
+        return assignment, normalized
+
+    def add(self, vectors, n_new):
+        """
+        Cập nhật chỉ mục sau khi thêm vector vào cuối corpus: các vector mới được
+        gán vào centroid gần nhất, các centroid giữ nguyên (build lại để huấn luyện lại)
+
+        Args:
+            vectors: Toàn bộ corpus mới (n, dim); n_new dòng cuối là vector mới
+            n_new: Số vector mới
+        """
+        assignment, normalized = self._lists_by_id()
+        new_vectors = _normalize(_as_numpy(vectors[len(vectors) - n_new:]))
+        self._set_lists(np.concatenate([assignment, self._assign(new_vectors)]),
+                        np.concatenate([normalized, new_vectors]))
+        self.vectors = vectors
+
+    def remove(self, vectors, removed):
+        """
+        Cập nhật chỉ mục sau khi xóa các dòng removed (chỉ số cũ) khỏi corpus
+
+        Args:
+            vectors: Corpus sau khi xóa
+            removed: Mảng chỉ số (trong corpus cũ) của các vector bị xóa
+        """
+        assignment, normalized = self._lists_by_id()
+        self._set_lists(np.delete(assignment, removed), np.delete(normalized, removed, axis=0))
+        self.vectors = vectors
+
+    def replace(self, vectors, rows):
+        """
+        Cập nhật chỉ mục sau khi các dòng rows của corpus được ghi đè
+
+        Args:
+            vectors: Corpus sau khi ghi đè
+            rows: Mảng chỉ số các dòng bị thay đổi
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        assignment, normalized = self._lists_by_id()
+        normalized[rows] = _normalize(_as_numpy(vectors[rows]))
+        assignment[rows] = self._assign(normalized[rows])
+        self._set_lists(assignment, normalized)
+        self.vectors = vectors
+
+    def search(self, queries, k):
+        """
+        Tìm k vector gần nhất (xấp xỉ) cho mỗi query
+
+        Returns:
+            List (mỗi query một phần tử) các list cặp (index, cosine score)
+        """
+        queries = _normalize(_as_numpy(queries))
+        centroid_scores = queries @ self.centroids.T
+        # Cụm rỗng (mọi thành viên đã bị remove) không được chọn để mở
+        empty = self.list_ptr[1:] == self.list_ptr[:-1]
+        centroid_scores[:, empty] = -np.inf
+        n_probe = min(self.n_probe, self.n_lists - int(empty.sum()))
+        if n_probe <= 0:
+            return [[] for _ in range(len(queries))]
+        probes = select_top_k(centroid_scores, n_probe)
+
+        results = []
+        for query, query_probes in zip(queries, probes):
+            slices = [slice(self.list_ptr[c], self.list_ptr[c + 1]) for c, _ in query_probes]
+            candidates = np.concatenate([self.list_ids[part] for part in slices])
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            scores = np.concatenate([self.list_vectors[part] @ query for part in slices])
+            # Sắp theo chỉ số câu hỏi để bằng điểm thì ưu tiên chỉ số nhỏ như exact
+            order = np.argsort(candidates, kind='stable')
+            candidates, scores = candidates[order], scores[order]
+            results.append([(int(candidates[position]), score)
+                            for position, score in select_top_k(scores, k)])
+        return results
+
+    def state(self):
+        """Các mảng cần lưu để khôi phục chỉ mục (ngoài chính các vector)"""
+        return {'centroids': self.centroids, 'list_ptr': self.list_ptr, 'list_ids': self.list_ids}
+
+    def restore(self, vectors, state):
+        """Khôi phục chỉ mục từ state() đã lưu và các vector của corpus"""
+        self.vectors = vectors
+        self.centroids = state['centroids']
+        self.list_ptr = state['list_ptr']
+        self.list_ids = state['list_ids']
+        self.n_lists = len(self.centroids)
+        self.list_vectors = _normalize(_as_numpy(vectors))[self.list_ids]
+
+
+class ClusterIndex:
+    """
+    Gom cụm các câu hỏi diễn đạt lại (paraphrase) của nhau, tìm kiếm theo tâm cụm trước
+
+    Các vector có cosine >= threshold được gom tham lam vào cùng một cụm; mỗi cụm
+    có một tâm (trung bình đã chuẩn hóa) và bán kính (cosine nhỏ nhất giữa tâm
+    và thành viên). Khi tìm kiếm, query được chấm điểm với các tâm cụm, chỉ các
+    thành viên của n_probe cụm tốt nhất được chấm điểm; sau đó (exact=True) các
+    cụm có cận trên của điểm >= điểm thứ k đã tìm được cũng được mở ra, nên kết
+    quả giống tìm kiếm chính xác. Corpus càng nhiều câu diễn đạt lại thì càng
+    ít cụm và càng ít vector phải chấm điểm.
+
+    Núm điều chỉnh:
+        threshold: Cao hơn -> cụm chặt hơn (cận trên sát hơn) nhưng nhiều cụm hơn
+        n_probe: Số cụm được mở trước khi dùng cận trên
+        exact: False -> chỉ mở n_probe cụm (xấp xỉ như ivf, nhanh hơn)
+    """
+
+    backend = 'cluster'
+    BUILD_PARAMS = ('threshold',)
+
+    def __init__(self, threshold=0.85, n_probe=4, exact=True, chunk_size=4096):
+        """
+        Args:
+            threshold: Cosine tối thiểu giữa một vector và tâm cụm để vào cụm đó
+            n_probe: Số cụm có cận trên cao nhất được mở trước cho mỗi query
+            exact: Mở thêm mọi cụm còn có thể chứa kết quả trong top-k
+            chunk_size: Số vector được gom cụm mỗi khối khi build
+        """
+        self.threshold = threshold
+        self.n_probe = n_probe
+        self.exact = exact
+        self.chunk_size = chunk_size
+        self.vectors = None
+        self.centroids = None
+        self.min_cosines = None
+        self.list_ptr = None
+        self.list_ids = None
+        self.list_vectors = None
+
+    def params(self):
+        """Tham số của chỉ mục (được lưu cùng chỉ mục)"""
+        return {'threshold': self.threshold, 'n_probe': self.n_probe, 'exact': self.exact,
+                'chunk_size': self.chunk_size}
+
+    @property
+    def n_clusters(self):
+        return len(self.centroids)
+
+    def _group(self, normalized, centroids):
+        """
+        Gán mỗi vector (đã chuẩn hóa) vào cụm gần nhất nếu cosine >= threshold,
+        vector không gần cụm nào mở cụm mới (chính nó làm đại diện)
+
+        Returns:
+            Tuple (assignment, leaders): cụm của từng vector (các cụm mới đánh số
+            tiếp sau len(centroids)) và các vector đại diện của cụm mới
+        """
+        n_old = len(centroids)
+        leaders = np.asarray(centroids, dtype=np.float32).reshape(n_old, normalized.shape[1])
+        assignment = np.empty(len(normalized), dtype=np.int64)
+        for start in range(0, len(normalized), self.chunk_size):
+            chunk = normalized[start:start + self.chunk_size]
+            best = np.full(len(chunk), -1, dtype=np.int64)
+            if len(leaders):
+                scores = chunk @ leaders.T
+                best = np.argmax(scores, axis=1)
+                best[scores[np.arange(len(chunk)), best] < self.threshold] = -1
+
+            pending = np.flatnonzero(best < 0)
+            if len(pending):
+                # Trong khối: vector chưa có cụm đầu tiên mở cụm mới và nhận các vector
+                # chưa có cụm khác đủ gần nó
+                block = chunk[pending]
+                similar = (block @ block.T) >= self.threshold
+                local = np.full(len(pending), -1, dtype=np.int64)
+                new_leaders = []
+                for i in range(len(pending)):
+                    if local[i] >= 0:
+                        continue
+                    members = similar[i] & (local < 0)
+                    members[i] = True
+                    local[members] = len(leaders) + len(new_leaders)
+                    new_leaders.append(i)
+                best[pending] = local
+                leaders = np.concatenate([leaders, block[new_leaders]])
+            assignment[start:start + len(chunk)] = best
+        return assignment, leaders[n_old:]
+
+    def _member_cosines(self, normalized, assignment):
+        """Cosine giữa mỗi vector và tâm cụm của nó"""
+        cosines = np.empty(len(normalized), dtype=np.float32)
+        for start in range(0, len(normalized), self.chunk_size):
+            stop = start + self.chunk_size
+            cosines[start:stop] = np.einsum('ij,ij->i', normalized[start:stop],
+                                            self.centroids[assignment[start:stop]])
+        return cosines
+
+    def _update_radii(self, normalized, assignment):
+        """Nới bán kính các cụm để chứa các vector mới gán vào"""
+        min_cosines = np.concatenate([self.min_cosines,
+                                      np.ones(self.n_clusters - len(self.min_cosines), dtype=np.float32)])
+        np.minimum.at(min_cosines, assignment, self._member_cosines(normalized, assignment))
+        self.min_cosines = min_cosines
+
+    def build(self, vectors):
+        """
+        Gom cụm corpus
+
+        Args:
+            vectors: Ma trận (n, dim); có thể là memmap
+        """
+        self.vectors = vectors
+        normalized = _normalize(_as_numpy(vectors))
+        assignment, leaders = self._group(normalized, np.empty((0, normalized.shape[1]), dtype=np.float32))
+        n_clusters = len(leaders)
+        # Tổng các vector của mỗi cụm = one-hot(assignment) @ normalized
+        one_hot = csr_matrix((np.ones(len(normalized), dtype=np.float32),
+                              (assignment, np.arange(len(normalized)))), shape=(n_clusters, len(normalized)))
+        self.centroids = _normalize(np.asarray(one_hot @ normalized, dtype=np.float32))
+        self.min_cosines = np.empty(0, dtype=np.float32)
+        self._update_radii(normalized, assignment)
+        self._set_lists(assignment, normalized)
+
+    def _set_lists(self, assignment, normalized):
+        """Xếp các vector (đã chuẩn hóa) liền nhau theo cụm như IVFIndex"""
+        self.list_ids = np.argsort(assignment, kind='stable')
+        self.list_ptr = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=self.n_clusters))])
+        self.list_vectors = normalized[self.list_ids]
+
+    def _lists_by_id(self):
+        """Ngược với _set_lists: (cụm, vector đã chuẩn hóa) của từng vector theo chỉ số"""
+        assignment = np.empty(len(self.list_ids), dtype=np.int64)
+        assignment[self.list_ids] = np.repeat(np.arange(self.n_clusters), np.diff(self.list_ptr))
+        normalized = np.empty_like(self.list_vectors)
+        normalized[self.list_ids] = self.list_vectors
+        return assignment, normalized
+
+    def _assign_new(self, normalized):
+        """Gán các vector mới vào cụm đã có hoặc cụm mới; tâm các cụm cũ giữ nguyên"""
+        assignment, leaders = self._group(normalized, self.centroids)
+        self.centroids = np.concatenate([self.centroids, leaders])
+        self._update_radii(normalized, assignment)
+        return assignment
+
+    def add(self, vectors, n_new):
+        """
+        Cập nhật chỉ mục sau khi thêm vector vào cuối corpus (build lại để gom cụm lại)
+
+        Args:
+            vectors: Toàn bộ corpus mới (n, dim); n_new dòng cuối là vector mới
+            n_new: Số vector mới
+        """
+        assignment, normalized = self._lists_by_id()
+        new_vectors = _normalize(_as_numpy(vectors[len(vectors) - n_new:]))
+        new_assignment = self._assign_new(new_vectors)
+        self._set_lists(np.concatenate([assignment, new_assignment]), np.concatenate([normalized, new_vectors]))
+        self.vectors = vectors
+
+    def remove(self, vectors, removed):
+        """
+        Cập nhật chỉ mục sau khi xóa các dòng removed (chỉ số cũ) khỏi corpus;
+        bán kính các cụm giữ nguyên (cận trên vẫn đúng)
+
+        Args:
+            vectors: Corpus sau khi xóa
+            removed: Mảng chỉ số (trong corpus cũ) của các vector bị xóa
+        """
+        assignment, normalized = self._lists_by_id()
+        self._set_lists(np.delete(assignment, removed), np.delete(normalized, removed, axis=0))
+        self.vectors = vectors
+
+    def replace(self, vectors, rows):
+        """
+        Cập nhật chỉ mục sau khi các dòng rows của corpus được ghi đè
+
+        Args:
+            vectors: Corpus sau khi ghi đè
+            rows: Mảng chỉ số các dòng bị thay đổi
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        assignment, normalized = self._lists_by_id()
+        normalized[rows] = _normalize(_as_numpy(vectors[rows]))
+        assignment[rows] = self._assign_new(normalized[rows])
+        self._set_lists(assignment, normalized)
+        self.vectors = vectors
+
+    def _upper_bounds(self, centroid_scores):
+        """
+        Cận trên cosine giữa query và mọi thành viên của từng cụm: góc tới thành viên
+        không nhỏ hơn góc tới tâm cụm trừ bán kính góc của cụm
+        """
+        query_angles = np.arccos(np.clip(centroid_scores.astype(np.float64), -1.0, 1.0))
+        radii = np.arccos(np.clip(self.min_cosines.astype(np.float64), -1.0, 1.0))
+        return np.cos(np.maximum(query_angles - radii, 0.0)) + BOUND_SLACK
+
+    def _score_clusters(self, query, clusters):
+        """(chỉ số, cosine) các thành viên của các cụm clusters"""
+        starts = self.list_ptr[clusters]
+        lengths = self.list_ptr[clusters + 1] - starts
+        # Vị trí (trong list_vectors) của mọi thành viên, không lặp Python theo cụm
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        positions = np.arange(int(lengths.sum())) + offsets
+        return self.list_ids[positions], self.list_vectors[positions] @ query
+
+    def search(self, queries, k):
+        """
+        Tìm k vector gần nhất cho mỗi query (chính xác nếu exact=True)
+
+        Returns:
+            List (mỗi query một phần tử) các list cặp (index, cosine score)
+        """
+        queries = _normalize(_as_numpy(queries))
+        bounds = self._upper_bounds(queries @ self.centroids.T)
+        # Cụm rỗng (mọi thành viên đã bị remove) không được chọn để mở
+        empty = self.list_ptr[1:] == self.list_ptr[:-1]
+        bounds[:, empty] = -np.inf
+        n_probe = min(self.n_probe, self.n_clusters - int(empty.sum()))
+        if n_probe <= 0:
+            return [[] for _ in range(len(queries))]
+
+        results = []
+        for query, query_bounds in zip(queries, bounds):
+            opened = np.zeros(self.n_clusters, dtype=bool)
+            opened[np.argpartition(-query_bounds, n_probe - 1)[:n_probe]] = True
+            candidates, scores = self._score_clusters(query, np.flatnonzero(opened))
+            if self.exact:
+                # Điểm thứ k hiện có; cụm có cận trên thấp hơn không thể vào top-k
+                kth = np.partition(scores, len(scores) - k)[len(scores) - k] if len(scores) >= k else -np.inf
+                remaining = np.flatnonzero(~opened & (query_bounds >= kth))
+                if len(remaining):
+                    more_candidates, more_scores = self._score_clusters(query, remaining)
+                    candidates = np.concatenate([candidates, more_candidates])
+                    scores = np.concatenate([scores, more_scores])
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            # Sắp theo chỉ số câu hỏi để bằng điểm thì ưu tiên chỉ số nhỏ như exact
+            order = np.argsort(candidates, kind='stable')
+            candidates, scores = candidates[order], scores[order]
+            results.append([(int(candidates[position]), score)
+                            for position, score in select_top_k(scores, k)])
+        return results
+
+    def state(self):
+        """Các mảng cần lưu để khôi phục chỉ mục (ngoài chính các vector)"""
+        return {'centroids': self.centroids, 'min_cosines': self.min_cosines,
+                'list_ptr': self.list_ptr, 'list_ids': self.list_ids}
+
+    def restore(self, vectors, state):
+        """Khôi phục chỉ mục từ state() đã lưu và các vector của corpus"""
+        self.vectors = vectors
+        self.centroids = state['centroids']
+        self.min_cosines = state['min_cosines']
+        self.list_ptr = state['list_ptr']
+        self.list_ids = state['list_ids']
+        self.list_vectors = _normalize(_as_numpy(vectors))[self.list_ids]
+
+
+class HNSWIndex:
+    """
+    Đồ thị HNSW qua hnswlib (tùy chọn)
+
+    Núm điều chỉnh:
+        M, ef_construction: Chất lượng đồ thị khi xây (lớn hơn -> recall cao hơn, build chậm hơn)
+        ef_search: Độ rộng tìm kiếm (lớn hơn -> recall cao hơn, chậm hơn)
+    """
+
+    backend = 'hnsw'
+    BUILD_PARAMS = ('M', 'ef_construction', 'seed')
+
+    def __init__(self, M=16, ef_construction=200, ef_search=64, seed=0):
+        if hnswlib is None:
+            raise ImportError("Backend 'hnsw' cần thư viện hnswlib: pip install hnswlib")
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self.graph = None
+        self.vectors = None
+
+    def params(self):
+        """Tham số của chỉ mục (được lưu cùng chỉ mục)"""
+        return {'M': self.M, 'ef_construction': self.ef_construction,
+                'ef_search': self.ef_search, 'seed': self.seed}
+
+    def build(self, vectors):
+        self.vectors = vectors
+        data = _normalize(_as_numpy(vectors))
+        self.graph = hnswlib.Index(space='ip', dim=data.shape[1])
+        self.graph.init_index(max_elements=len(data), M=self.M,
+                              ef_construction=self.ef_construction, random_seed=self.seed)
+        self.graph.add_items(data, np.arange(len(data)))
+        self.graph.set_ef(self.ef_search)
+
+    def add(self, vectors, n_new):
+        """Thêm n_new vector cuối của corpus vào đồ thị"""
+        start = len(vectors) - n_new
+        self.graph.resize_index(len(vectors))
+        self.graph.add_items(_normalize(_as_numpy(vectors[start:])), np.arange(start, len(vectors)))
+        self.vectors = vectors
+
+    def remove(self, vectors, removed):
+        """Xóa vector làm dịch chỉ số của các vector phía sau nên đồ thị được build lại"""
+        self.build(vectors)
+
+    def replace(self, vectors, rows):
+        """Ghi đè các vector rows trong đồ thị (hnswlib cập nhật nhãn đã tồn tại)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        self.graph.add_items(_normalize(_as_numpy(vectors[rows])), rows)
+        self.vectors = vectors
+
+    def search(self, queries, k):
+        queries = _normalize(_as_numpy(queries))
+        k = min(k, len(self.vectors))
+        self.graph.set_ef(max(self.ef_search, k))
+        labels, distances = self.graph.knn_query(queries, k=k)
+        # space='ip' trả về 1 - inner product
+        return [[(int(label), np.float32(1.0 - distance)) for label, distance in zip(row_labels, row_distances)]
+                for row_labels, row_distances in zip(labels, distances)]
+
+    def state(self):
+        """Đồ thị do hnswlib serialize, lưu dạng bytes trong file .npz"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.bin')
+            self.graph.save_index(path)
+            with open(path, 'rb') as file:
+                return {'graph': np.frombuffer(file.read(), dtype=np.uint8)}
+
+    def restore(self, vectors, state):
+        """Khôi phục đồ thị từ state() đã lưu"""
+        self.vectors = vectors
+        self.graph = hnswlib.Index(space='ip', dim=_as_numpy(vectors[:1]).shape[1])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.bin')
+            with open(path, 'wb') as file:
+                file.write(state['graph'].tobytes())
+            self.graph.load_index(path, max_elements=len(vectors))
+        self.graph.set_ef(self.ef_search)
+
+
+class ShardedExactIndex:
+    """
+    Tìm kiếm chính xác song song: corpus được chia thành các shard trong bộ nhớ
+    dùng chung, mỗi tiến trình worker tính top-k của một shard (xem sharding.py)
+
+    Kết quả giống ExactIndex (storage float32). Mỗi lần thêm/xóa/sửa vector,
+    corpus được chia sẻ lại cho các worker.
+    """
+
+    backend = 'sharded'
+    # restore() chia sẻ lại corpus theo tham số hiện tại
+    BUILD_PARAMS = ()
+
+    def __init__(self, n_workers=None, n_shards=None, chunk_size=DEFAULT_CHUNK_SIZE, start_method='spawn'):
+        """
+        Args:
+            n_workers: Số tiến trình worker (mặc định: số CPU)
+            n_shards: Số shard (mặc định: bằng n_workers)
+            chunk_size: Số vector được chấm điểm mỗi khối trong một shard
+            start_method: Cách tạo tiến trình của multiprocessing
+        """
+        self.pool = ShardPool(n_workers, n_shards, start_method)
+        self.chunk_size = chunk_size
+        self.vectors = None
+        self.inverse_norms = None
+
+    def params(self):
+        """Tham số của chỉ mục (được lưu cùng chỉ mục)"""
+        return {'n_workers': self.pool.n_workers, 'n_shards': self.pool.n_shards,
+                'chunk_size': self.chunk_size, 'start_method': self.pool.start_method}
+
+    def build(self, vectors):
+        """
+        Sao chép corpus vào bộ nhớ dùng chung và chia shard
+
+        Args:
+            vectors: Ma trận (n, dim)
+        """
+        norms = ExactIndex(self.chunk_size)
+        norms.build(vectors)
+        self.vectors = vectors
+        self.inverse_norms = norms.inverse_norms
+        self.pool.share({'vectors': _as_numpy(vectors), 'inverse_norms': self.inverse_norms}, len(vectors))
+
+    def add(self, vectors, n_new):
+        """Chia sẻ lại toàn bộ corpus sau khi thêm vector"""
+        self.build(vectors)
+
+    def remove(self, vectors, removed):
+        """Chia sẻ lại toàn bộ corpus sau khi xóa vector"""
+        self.build(vectors)
+
+    def replace(self, vectors, rows):
+        """Chia sẻ lại toàn bộ corpus sau khi ghi đè vector"""
+        self.build(vectors)
+
+    def search(self, queries, k):
+        """
+        Tìm k vector gần nhất cho mỗi query trên mọi shard song song
+
+        Returns:
+            List (mỗi query một phần tử) các list cặp (index, cosine score)
+        """
+        queries = _normalize(_as_numpy(queries))
+        return self.pool.search(dense_search_task, queries, k, self.chunk_size)
+
+    def state(self):
+        """Không có gì cần lưu ngoài các vector"""
+        return {}
+
+    def restore(self, vectors, state):
+        """Khôi phục chỉ mục: chia sẻ lại corpus cho các worker"""
+        self.build(vectors)
+
+    def close(self):
+        """Dừng các worker và giải phóng bộ nhớ dùng chung"""
+        self.pool.close()
+
+
+BACKENDS = {
+    'exact': ExactIndex,
+    'ivf': IVFIndex,
+    'cluster': ClusterIndex,
+    'hnsw': HNSWIndex,
+    'sharded': ShardedExactIndex,
+}
+
+
+def create_index(backend='exact', **params):
+    """
+    Tạo chỉ mục vector theo tên backend
+
+    Args:
+        backend: 'exact', 'ivf', 'cluster', 'hnsw' hoặc 'sharded'
+        **params: Tham số của backend (xem từng class)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend chỉ mục không hợp lệ: {backend} (chọn một trong {sorted(BACKENDS)})")
+    return BACKENDS[backend](**params)
+
+
+def save_index(index, path, fingerprint):
+    """
+    Lưu cấu trúc chỉ mục (không gồm các vector) ra file .npz
+
+    Args:
+        index: Chỉ mục đã build
+        path: Đường dẫn file
+        fingerprint: Dấu vân tay của corpus, dùng để kiểm tra khi đọc lại
+    """
+    meta = json.dumps({'backend': index.backend, 'params': index.params(),
+                       'fingerprint': fingerprint, 'n_vectors': len(index.vectors)})
+    # Ghi ra file tạm rồi đổi tên: tiến trình khác không bao giờ đọc phải file ghi dở
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, meta=np.array(meta), **index.state())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_index(path, vectors, fingerprint, index=None):
+    """
+    Đọc chỉ mục đã lưu và gắn lại các vector
+
+    Args:
+        path: Đường dẫn file
+        vectors: Các vector của corpus
+        fingerprint: Dấu vân tay của corpus hiện tại
+        index: Chỉ mục chưa build với các tham số mong muốn (None = dùng tham số đã
+            lưu). File chỉ được dùng nếu cùng backend và cùng các tham số build
+            (BUILD_PARAMS, None = chấp nhận mọi giá trị); state được khôi phục vào
+            index nên các tham số tìm kiếm (n_probe, ef_search, rescore, chunk_size...)
+            lấy theo index chứ không theo file
+
+    Returns:
+        Chỉ mục, hoặc None nếu file không tồn tại/không khớp corpus hoặc tham số
+    """
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            state = {name: data[name] for name in data.files if name != 'meta'}
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+    if meta['fingerprint'] != fingerprint or meta['n_vectors'] != len(vectors):
+        return None
+    if index is None:
+        index = create_index(meta['backend'], **meta['params'])
+    else:
+        if meta['backend'] != index.backend:
+            return None
+        wanted = index.params()
+        for name in index.BUILD_PARAMS:
+            if wanted[name] is not None and wanted[name] != meta['params'].get(name):
+                return None
+    index.restore(vectors, state)
+    return index
+
+
+def tier_of(score, high_threshold, low_threshold):
+    """Mức độ tin cậy của ChatbotPro: 2 = cao, 1 = trung bình, 0 = thấp"""
+    if score >= high_threshold:
+        return 2
+    if score > low_threshold:
+        return 1
+    return 0
+
+
+def recall_report(approx_index, exact_index, queries, k=10, thresholds=(0.75, 0.45)):
+    """
+    So sánh chỉ mục xấp xỉ với tìm kiếm chính xác
+
+    Args:
+        approx_index: Chỉ mục cần đánh giá (ivf/hnsw)
+        exact_index: ExactIndex trên cùng corpus
+        queries: Ma trận query embeddings (n_queries, dim)
+        k: Độ sâu tính recall@k
+        thresholds: (ngưỡng cao, ngưỡng thấp) của ChatbotPro
+
+    Returns:
+        Dict gồm recall@1, recall@k, tỉ lệ cùng mức độ tin cậy (tier_agreement),
+        độ lệch điểm top-1 trung bình và độ trễ trung bình (ms/query) của hai chỉ mục
+    """
+    queries = _as_numpy(queries)
+    high_threshold, low_threshold = thresholds
+
+    start = time.perf_counter()
+    exact = exact_index.search(queries, k)
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    start = time.perf_counter()
+    approx = approx_index.search(queries, k)
+    approx_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    hits_at_1 = 0
+    hits_at_k = 0
+    same_tier = 0
+    score_gap = 0.0
+    for exact_row, approx_row in zip(exact, approx):
+        exact_ids = [idx for idx, _ in exact_row]
+        approx_ids = {idx for idx, _ in approx_row}
+        hits_at_1 += bool(approx_row) and approx_row[0][0] == exact_ids[0]
+        hits_at_k += len(approx_ids.intersection(exact_ids)) / len(exact_ids)
+        approx_best = float(approx_row[0][1]) if approx_row else -1.0
+        exact_best = float(exact_row[0][1])
+        same_tier += tier_of(approx_best, high_threshold, low_threshold) == \
+            tier_of(exact_best, high_threshold, low_threshold)
+        score_gap += exact_best - approx_best
+
+    n = len(queries)
+    return {
+        'backend': approx_index.backend,
+        'params': approx_index.params(),
+        'n_queries': n,
+        'recall@1': hits_at_1 / n,
+        f'recall@{k}': hits_at_k / n,
+        'tier_agreement': same_tier / n,
+        'mean_top1_score_gap': score_gap / n,
+        'exact_ms_per_query': exact_ms,
+        'approx_ms_per_query': approx_ms,
+    }